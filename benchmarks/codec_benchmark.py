@@ -0,0 +1,93 @@
+"""
+Encode/decode throughput of the frame codecs.
+
+Builds realistic SyncAlbumDetails and GetUsers response payloads and times every codec implementation that is
+installed: the standard library's json, orjson and msgpack.
+
+Usage (from the repository root):
+    python -m benchmarks.codec_benchmark --albums 300 --users 1000 --repeat 200
+"""
+import argparse
+import random
+import string
+import time
+from datetime import datetime, timedelta, timezone
+
+from fotogo_networking.frame_codecs import JsonCodec, MsgpackCodec, OrjsonCodec, msgpack, orjson
+from fotogo_networking.status_code import StatusCode
+
+
+def _random_id(length: int = 28) -> str:
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
+
+
+def _signed_url(owner_id: str, image_id: str) -> str:
+    return f"https://storage.googleapis.com/fotogo-5e99f.appspot.com/{owner_id}/{image_id}" \
+           f"?Expiration=1700000000&GoogleAccessId=firebase-adminsdk%40fotogo-5e99f.iam.gserviceaccount.com" \
+           f"&Signature={_random_id(342)}"
+
+
+def sync_album_details_payload(albums: int) -> dict:
+    owner_id = _random_id()
+    now = datetime.now(timezone.utc)
+    album_list = []
+    for _ in range(albums):
+        start = now - timedelta(days=random.randint(10, 1000))
+        album_list.append(dict(
+            owner_id=owner_id,
+            album_id=f"{time.time()}",
+            name=' '.join(random.choices(['Trip', 'to', 'Paris', 'Family', 'Summer', '2022', 'Birthday'], k=3)),
+            date_range=[start.strftime('%Y-%m-%d'), (start + timedelta(days=7)).strftime('%Y-%m-%d')],
+            last_modified=now - timedelta(minutes=random.randint(0, 100000)),
+            is_built=True,
+            tags=random.sample(range(20), 3),
+            permitted_users=[],
+            cover_image=_signed_url(owner_id, f"IMG_{random.randint(1000, 9999)}.jpg"),
+        ))
+    return dict(status_code=StatusCode.OK_200, payload=album_list)
+
+
+def get_users_payload(users: int) -> dict:
+    return dict(status_code=StatusCode.OK_200, payload=[
+        dict(id=_random_id(), name=f"User {i}", email=f"user{i}@example.com",
+             photo_url=f"https://lh3.googleusercontent.com/a/{_random_id(60)}=s96-c", priv=random.choice([0, 1]))
+        for i in range(users)
+    ])
+
+
+def _throughput(fn, arg, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(arg)
+    return repeat / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--albums', type=int, default=300, help="Albums in the SyncAlbumDetails payload.")
+    parser.add_argument('--users', type=int, default=1000, help="Users in the GetUsers payload.")
+    parser.add_argument('--repeat', type=int, default=200, help="Encodes and decodes timed per codec and payload.")
+    args = parser.parse_args()
+
+    codecs = [('json (stdlib)', JsonCodec())]
+    if orjson is not None:
+        codecs.append(('orjson', OrjsonCodec()))
+    if msgpack is not None:
+        codecs.append(('msgpack', MsgpackCodec()))
+
+    payloads = [('SyncAlbumDetails', sync_album_details_payload(args.albums)),
+                ('GetUsers', get_users_payload(args.users))]
+
+    for payload_name, payload in payloads:
+        print(payload_name)
+        for codec_name, codec in codecs:
+            encoded = codec.encode(payload)
+            encode_rate = _throughput(codec.encode, payload, args.repeat)
+            decode_rate = _throughput(codec.decode, encoded, args.repeat)
+            size_mb = len(encoded) / (1024 * 1024)
+            print(f"  {codec_name:>14}: {len(encoded):9} bytes  encode {encode_rate:9.1f}/s "
+                  f"({encode_rate * size_mb:7.1f} MB/s)  decode {decode_rate:9.1f}/s ({decode_rate * size_mb:7.1f} MB/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Load benchmark of the socket server engines.
+
+Runs the threaded and the asyncio engines against the same stub Framework (no Firebase involved) and hammers each one
+with concurrent clients, every client opening a new connection per request. Reports the connections per second each
+engine sustained.
+
+Usage (from the repository root):
+    python -m benchmarks.connections_benchmark --clients 64 --requests 200
+"""
+import argparse
+import json
+import socket
+import threading
+import time
+
+from fotogo_networking.async_socket_server import AsyncSocketServer
+from fotogo_networking.metrics import Metrics
+from fotogo_networking.response import Response
+from fotogo_networking.server_config import ServerConfig
+from fotogo_networking.socket_server import SocketServer
+from fotogo_networking.status_code import StatusCode
+
+
+class _SilentLogger:
+    def info(self, message, color=None):
+        pass
+
+    def error(self, message):
+        pass
+
+
+class _StubFramework:
+    """Stands in for Framework: no authentication and no DB, only a short blocking call per request."""
+
+    def __init__(self, work_time: float):
+        self.logger = _SilentLogger()
+        self.metrics = Metrics()
+        self._work_time = work_time
+
+    def execute(self, id_token, request) -> Response:
+        if self._work_time:
+            time.sleep(self._work_time)
+        return Response(StatusCode.OK_200, 'pong')
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _request_frame() -> bytes:
+    data = json.dumps(dict(id_token='token', request_id=1, args={}, payload=[])).encode()
+    return len(data).to_bytes(4, "big") + data
+
+
+def _client(port: int, requests: int, frame: bytes, results: list):
+    ok = failed = 0
+    for _ in range(requests):
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=10) as s:
+                s.sendall(frame)
+                response = b''
+                while chunk := s.recv(4096):
+                    response += chunk
+            if json.loads(response)['status_code'] == StatusCode.OK_200:
+                ok += 1
+            else:
+                failed += 1
+        except (OSError, ValueError):
+            failed += 1
+    results.append((ok, failed))
+
+
+def run(engine_cls, clients: int, requests: int, backlog: int, work_time: float) -> tuple[float, int, int]:
+    port = _free_port()
+    server = engine_cls(_StubFramework(work_time), ServerConfig(address=('127.0.0.1', port), backlog=backlog))
+    server.start(backlog=backlog)
+
+    frame = _request_frame()
+    results = []
+    threads = [threading.Thread(target=_client, args=[port, requests, frame, results]) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    server.stop()
+    ok = sum(r[0] for r in results)
+    failed = sum(r[1] for r in results)
+    return ok / elapsed, ok, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=64, help="Concurrent client threads.")
+    parser.add_argument('--requests', type=int, default=200, help="Connections opened by each client.")
+    parser.add_argument('--backlog', type=int, default=128, help="Listen backlog of the server.")
+    parser.add_argument('--work-time', type=float, default=0.0,
+                        help="Seconds each request blocks inside the stub endpoint.")
+    args = parser.parse_args()
+
+    for name, engine_cls in (('threaded', SocketServer), ('asyncio', AsyncSocketServer)):
+        rate, ok, failed = run(engine_cls, args.clients, args.requests, args.backlog, args.work_time)
+        print(f"{name:>9}: {rate:10.1f} connections/s  ({ok} ok, {failed} failed)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""
+Firestore round-trips of the multi-image paths of DBService.
+
+Runs DBService against an in-memory stand-in for the Firestore client, which counts every RPC (document reads and
+writes, batched lookups, queries and batch commits) and sleeps --rtt milliseconds per RPC to model the network.
+Compares the per-image paths (a call for each image) with the batched ones:
+    upload: image_exists + add_image / link_images_to_album for each image, vs get_images + add_images /
+            link_images_to_album.
+    remove: unlink_images_from_album for each image, vs unlink_images_from_album.
+
+Usage (from the repository root):
+    python -m benchmarks.firestore_benchmark --images 50 1000 --rtt 20
+"""
+import argparse
+import copy
+import time
+from datetime import datetime
+from unittest import mock
+
+from google.cloud.firestore_v1 import ArrayRemove, ArrayUnion
+
+import db_services.db_service
+from db_services.data_structures import Image
+from db_services.db_service import DBService
+
+
+class _Snapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = copy.deepcopy(data)
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field):
+        return self._data[field]
+
+
+class _DocumentReference:
+    def __init__(self, db, collection: str, document_id: str):
+        self._db = db
+        self._collection = collection
+        self.id = document_id
+
+    def _documents(self) -> dict:
+        return self._db.data.setdefault(self._collection, {})
+
+    def _apply_update(self, fields: dict):
+        if self.id not in self._documents():
+            raise KeyError(f"No document to update: {self._collection}/{self.id}")
+        document = self._documents()[self.id]
+        for field, value in fields.items():
+            if isinstance(value, ArrayUnion):
+                current = document.get(field, [])
+                document[field] = current + [v for v in value.values if v not in current]
+            elif isinstance(value, ArrayRemove):
+                document[field] = [v for v in document.get(field, []) if v not in value.values]
+            else:
+                document[field] = copy.deepcopy(value)
+
+    def collection(self, name: str):
+        return _CollectionReference(self._db, f"{self._collection}/{self.id}/{name}")
+
+    def get(self, *args, **kwargs):
+        self._db.rpc()
+        return _Snapshot(self, self._documents().get(self.id))
+
+    def set(self, data: dict):
+        self._db.rpc()
+        self._documents()[self.id] = copy.deepcopy(data)
+
+    def update(self, fields: dict):
+        self._db.rpc()
+        self._apply_update(fields)
+
+    def delete(self):
+        self._db.rpc()
+        self._documents().pop(self.id, None)
+
+
+class _Query:
+    def __init__(self, db, collection: str, filters: tuple = (), limit: int = None):
+        self._db = db
+        self._collection = collection
+        self._filters = filters
+        self._limit = limit
+
+    def where(self, field: str, op: str, value):
+        return _Query(self._db, self._collection, self._filters + ((field, op, value),), self._limit)
+
+    def limit(self, count: int):
+        return _Query(self._db, self._collection, self._filters, count)
+
+    def _matches(self, data: dict) -> bool:
+        for field, op, value in self._filters:
+            if op == '==' and data.get(field) != value:
+                return False
+            if op == 'array_contains' and value not in data.get(field, []):
+                return False
+        return True
+
+    def get(self, *args, **kwargs):
+        self._db.rpc()
+        documents = self._db.data.setdefault(self._collection, {})
+        snapshots = [_Snapshot(_DocumentReference(self._db, self._collection, document_id), data)
+                     for document_id, data in documents.items() if self._matches(data)]
+        return snapshots[:self._limit] if self._limit is not None else snapshots
+
+    stream = get
+
+
+class _CollectionReference(_Query):
+    def document(self, document_id: str):
+        return _DocumentReference(self._db, self._collection, document_id)
+
+    def add(self, data: dict, document_id: str):
+        self.document(document_id).set(data)
+
+
+class _WriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, reference: _DocumentReference, data: dict):
+        self._writes.append(lambda: reference._documents().__setitem__(reference.id, copy.deepcopy(data)))
+
+    def update(self, reference: _DocumentReference, fields: dict):
+        self._writes.append(lambda: reference._apply_update(fields))
+
+    def delete(self, reference: _DocumentReference):
+        self._writes.append(lambda: reference._documents().pop(reference.id, None))
+
+    def commit(self):
+        self._db.rpc()
+        for write in self._writes:
+            write()
+
+
+class _InMemoryFirestore:
+    """Stands in for the Firestore client: holds the documents in dicts, and counts (and delays) every RPC."""
+
+    def __init__(self, rtt: float = 0):
+        self.data: dict[str, dict[str, dict]] = {}
+        self.rpcs = 0
+        self._rtt = rtt
+
+    def rpc(self):
+        self.rpcs += 1
+        if self._rtt:
+            time.sleep(self._rtt)
+
+    def collection(self, name: str):
+        return _CollectionReference(self, name)
+
+    def batch(self):
+        return _WriteBatch(self)
+
+    def get_all(self, references: list, *args, **kwargs):
+        self.rpc()
+        return [_Snapshot(reference, reference._documents().get(reference.id)) for reference in references]
+
+
+def _db_service(firestore_client: _InMemoryFirestore) -> DBService:
+    with mock.patch.object(db_services.db_service.firestore, 'client', lambda app: firestore_client), \
+            mock.patch.object(db_services.db_service.auth, 'Client', lambda app: None):
+        return DBService(None)
+
+
+def _images(count: int, album_id: str, prefix: str) -> list[Image]:
+    return [Image(owner_id='user', file_name=f"{prefix}{i}.jpg", timestamp=datetime.now(), containing_albums=[album_id])
+            for i in range(count)]
+
+
+def _upload(db: DBService, images: list[Image], identity, batched: bool) -> None:
+    """Uploads images to the "second" album, linking the ones that already exist, like the upload_images endpoint."""
+    if batched:
+        snapshots = db.get_images([image.file_name for image in images], identity)
+        db.add_images([image for image in images if not snapshots[image.file_name].exists], identity)
+        db.link_images_to_album('user', [image.file_name for image in images if snapshots[image.file_name].exists],
+                                'second', identity)
+    else:
+        for image in images:
+            if db.image_exists(image.file_name, identity):
+                db.link_images_to_album('user', [image.file_name], 'second', identity)
+            else:
+                db.add_image(image, identity)
+
+
+def _remove(db: DBService, images: list[Image], identity, batched: bool) -> None:
+    """Removes images from the "second" album, like the remove_from_album endpoint."""
+    if batched:
+        db.unlink_images_from_album('user', [image.file_name for image in images], 'second', identity)
+    else:
+        for image in images:
+            db.unlink_images_from_album('user', [image.file_name], 'second', identity)
+
+
+def run(images: int, rtt: float, batched: bool) -> tuple[tuple[int, float], tuple[int, float]]:
+    firestore_client = _InMemoryFirestore(rtt)
+    firestore_client.data = {'users': {'user': dict(privilege_level=1)},
+                             'albums': {'first': dict(owner_id='user'), 'second': dict(owner_id='user')}}
+    db = _db_service(firestore_client)
+    identity = db.get_identity('user')
+    existing_images = _images(images, 'first', 'old')
+    uploaded_images = existing_images + _images(images, 'second', 'new')
+    db.add_images(existing_images, identity)
+
+    results = []
+    for operation in (_upload, _remove):
+        firestore_client.rpcs = 0
+        start = time.perf_counter()
+        operation(db, uploaded_images, identity, batched)
+        results.append((firestore_client.rpcs, time.perf_counter() - start))
+
+        if operation is _upload:
+            assert all('second' in firestore_client.data['images'][image.file_name]['containing_albums']
+                       for image in uploaded_images)
+    # the new images were only in the removed album, so they are deleted; the existing ones remain in the first
+    assert sorted(firestore_client.data['images']) == sorted(image.file_name for image in existing_images)
+    assert all(document['containing_albums'] == ['first'] for document in firestore_client.data['images'].values())
+    return results[0], results[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, nargs='+', default=[50, 1000],
+                        help="Images added, and existing images linked, per run.")
+    parser.add_argument('--rtt', type=float, default=20, help="Simulated round-trip time of an RPC, in milliseconds.")
+    args = parser.parse_args()
+
+    for images in args.images:
+        for name, batched in (('per-image', False), ('batched', True)):
+            for operation, (rpcs, elapsed) in zip(('upload', 'remove'), run(images, args.rtt / 1000, batched)):
+                print(f"{images:6} new + {images:6} existing images  {operation} {name:>9}: {rpcs:6} RPCs  "
+                      f"{elapsed * 1000:10.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
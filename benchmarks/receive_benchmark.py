@@ -0,0 +1,78 @@
+"""
+Micro-benchmark of the request receive path.
+
+Sends frames of several sizes over a local socket pair and times three ways of receiving them:
+
+* legacy: the original loop, which grows a bytes object with `data += read_data` in 16 KB steps. Its run time is
+  quadratic in the frame size, so by default it is skipped above 64 MB (it takes many minutes at 200 MB).
+* memory: receive_frame into a preallocated bytearray with recv_into.
+* spilled: receive_frame into a temporary file, mapped back into memory.
+
+Usage (from the repository root):
+    python -m benchmarks.receive_benchmark --sizes 1 20 200 --repeat 3
+"""
+import argparse
+import socket
+import threading
+import time
+
+from fotogo_networking.connection_context import ConnectionContext
+from fotogo_networking.data_transportation import receive_frame
+from fotogo_networking.server_config import ServerConfig
+
+MB = 1024 * 1024
+
+
+def _legacy_receive(sender: socket.socket, length: int) -> bytes:
+    bytes_left = length
+    data = b''
+    while bytes_left > 0:
+        read_amount = max(0, min(bytes_left, 16384))
+        read_data = sender.recv(read_amount)
+        data += read_data
+        bytes_left -= len(read_data)
+    return data
+
+
+def _time_receive(receive, payload: bytes) -> float:
+    server_side, client_side = socket.socketpair()
+    with server_side, client_side:
+        sender = threading.Thread(target=client_side.sendall, args=[payload])
+        start = time.perf_counter()
+        sender.start()
+        data = receive(server_side, len(payload))
+        elapsed = time.perf_counter() - start
+        sender.join()
+    assert len(data) == len(payload)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 20, 200], help="Frame sizes in MB.")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per size and path; the best run is reported.")
+    parser.add_argument('--skip-legacy-above', type=int, default=64,
+                        help="Skip the legacy loop for frames larger than this many MB (it is quadratic).")
+    args = parser.parse_args()
+
+    in_memory = ConnectionContext(ServerConfig(spill_threshold=2 ** 40, connection_memory_budget=2 ** 40))
+    spilled = ConnectionContext(ServerConfig(spill_threshold=0))
+    paths = {
+        'legacy': _legacy_receive,
+        'memory': lambda s, n: receive_frame(s, n, in_memory)[0],
+        'spilled': lambda s, n: receive_frame(s, n, spilled)[0],
+    }
+
+    for size in args.sizes:
+        payload = bytes(size * MB)
+        for name, receive in paths.items():
+            if name == 'legacy' and size > args.skip_legacy_above:
+                print(f"{size:5} MB  {name:>8}: skipped")
+                continue
+            best = min(_time_receive(receive, payload) for _ in range(args.repeat))
+            in_memory.release_memory(in_memory.memory_in_use)
+            print(f"{size:5} MB  {name:>8}: {best * 1000:10.1f} ms  {size / best:10.1f} MB/s")
+
+
+if __name__ == '__main__':
+    main()
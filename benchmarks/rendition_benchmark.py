@@ -0,0 +1,74 @@
+"""
+Throughput of the thumbnail and preview rendering of uploaded images.
+
+Generates --images synthetic JPEG photos of --width x --height pixels, then renders their renditions (see
+db_services.renditions) in the calling process, and with RenditionPipeline at every --processes count. Reports the
+images per second, and per second per process, of each run. Needs Pillow.
+
+Usage (from the repository root):
+    python -m benchmarks.rendition_benchmark --images 48 --width 4032 --height 3024 --processes 1 2 4 8
+"""
+import argparse
+import io
+import os
+import time
+
+from PIL import Image
+
+from db_services.renditions import RENDITIONS, RenditionPipeline, render
+
+
+def _photo(width: int, height: int, seed: int) -> bytes:
+    """A JPEG with noise over a gradient - compressing about like a photo, unlike a flat color."""
+    gradient = Image.linear_gradient('L').resize((width, height)).rotate(seed * 37 % 360)
+    noise = Image.effect_noise((width, height), 48)
+    image = Image.merge('RGB', (gradient, noise, Image.blend(gradient, noise, 0.5)))
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=92)
+    return output.getvalue()
+
+
+def run(images: list[bytes], processes: int | None) -> float:
+    """Renders the images, in the calling process if processes is None, and returns the elapsed time."""
+    if processes is None:
+        start = time.perf_counter()
+        renditions = [render(image) for image in images]
+    else:
+        pipeline = RenditionPipeline(processes)
+        pipeline.render_many(images[:processes])  # start the worker processes outside of the measurement
+        start = time.perf_counter()
+        renditions = pipeline.render_many(images)
+    elapsed = time.perf_counter() - start
+    if processes is not None:
+        pipeline.close()
+
+    assert len(renditions) == len(images) and all(set(i) == set(RENDITIONS) for i in renditions)
+    assert all(len(i['thumbnail']) < len(image) for i, image in zip(renditions, images))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=48, help="Images rendered per run.")
+    parser.add_argument('--width', type=int, default=4032, help="Width of the images, in pixels.")
+    parser.add_argument('--height', type=int, default=3024, help="Height of the images, in pixels.")
+    parser.add_argument('--processes', type=int, nargs='+',
+                        default=sorted({1, 2, max(1, os.cpu_count() // 2), os.cpu_count()}),
+                        help="Worker process counts to measure. Default to 1, 2, half and all of the CPU cores.")
+    args = parser.parse_args()
+
+    # a few distinct photos, repeated - generating them takes longer than rendering them
+    photos = [_photo(args.width, args.height, seed) for seed in range(min(args.images, 8))]
+    images = [photos[i % len(photos)] for i in range(args.images)]
+    print(f"{args.images} images of {args.width}x{args.height}, {sum(map(len, images)) / len(images) / 1024:.0f} KB "
+          f"on average, {os.cpu_count()} CPU cores")
+
+    for processes in [None] + args.processes:
+        elapsed = run(images, processes)
+        name = 'in-process' if processes is None else f"{processes} processes"
+        print(f"{name:>14}: {elapsed * 1000:10.1f} ms  {args.images / elapsed:8.1f} images/s  "
+              f"{args.images / elapsed / (processes or 1):8.1f} images/s per process")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Latency of downloading an album's images from Cloud Storage, as a function of the download concurrency.
+
+Runs StorageService against a local fake of the Cloud Storage JSON API, which serves every download after --latency
+milliseconds, to model the round-trip to the bucket. Downloads --images blobs with get_file_bytes one after another
+(as GetAlbumContents used to), then with get_files_bytes at every --concurrency.
+
+Usage (from the repository root):
+    python -m benchmarks.storage_benchmark --images 200 --latency 40 --concurrency 1 4 8 16 32
+"""
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import storage
+
+import db_services.storage_service
+from db_services.storage_service import StorageService
+
+_BUCKET = 'benchmark'
+
+
+class _FakeStorageHandler(BaseHTTPRequestHandler):
+    """Serves every GET with the same contents, after the server's latency. Only downloads are supported."""
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(self.server.contents)))
+        self.end_headers()
+        self.wfile.write(self.server.contents)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _storage_service(endpoint: str) -> StorageService:
+    client = storage.Client(project=_BUCKET, credentials=AnonymousCredentials(),
+                            client_options={'api_endpoint': endpoint})
+    with mock.patch.object(db_services.storage_service.storage, 'bucket', lambda app: client.bucket(_BUCKET)):
+        return StorageService(None)
+
+
+def run(service: StorageService, paths: list[str], concurrency: int | None) -> float:
+    """Downloads the paths, serially if concurrency is None, and returns the elapsed time."""
+    start = time.perf_counter()
+    if concurrency is None:
+        files = [service.get_file_bytes(path) for path in paths]
+    else:
+        files = service.get_files_bytes(paths, max_concurrency=concurrency)
+    elapsed = time.perf_counter() - start
+    assert len(files) == len(paths)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=200, help="Images downloaded per run.")
+    parser.add_argument('--size', type=int, default=64 * 1024, help="Size of every image, in bytes.")
+    parser.add_argument('--latency', type=float, default=40,
+                        help="Simulated latency of every download, in milliseconds.")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16, 32],
+                        help="Download concurrencies to measure.")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _FakeStorageHandler)
+    server.daemon_threads = True
+    server.latency = args.latency / 1000
+    server.contents = bytes(args.size)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        service = _storage_service(f"http://127.0.0.1:{server.server_address[1]}")
+        paths = [f"user/image{i}.jpg" for i in range(args.images)]
+        for concurrency in [None] + args.concurrency:
+            elapsed = run(service, paths, concurrency)
+            name = 'serial' if concurrency is None else f"concurrency {concurrency}"
+            print(f"{args.images:6} images  {name:>16}: {elapsed * 1000:10.1f} ms  "
+                  f"{args.images / elapsed:8.1f} images/s")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Connection setup latency over TLS, with and without session resumption.
+
+Runs each socket server engine with TLS against the stub Framework of connections_benchmark. A client opens
+connections one after the other, sending one request on each. It times the TCP connect plus the TLS handshake of
+every connection, either always doing a full handshake, or resuming the session of its previous connection. Runs
+once with session tickets and once with the server's session cache. Also prints the server's TLS metrics.
+
+Without --certfile, a throwaway self-signed certificate is generated with the openssl command line tool.
+
+Usage (from the repository root):
+    python -m benchmarks.tls_benchmark --connections 300
+"""
+import argparse
+import os
+import socket
+import ssl
+import statistics
+import subprocess
+import tempfile
+import time
+
+from benchmarks.connections_benchmark import _StubFramework, _free_port, _request_frame
+from fotogo_networking.async_socket_server import AsyncSocketServer
+from fotogo_networking.server_config import ServerConfig
+from fotogo_networking.socket_server import SocketServer
+
+
+def _self_signed_certificate(directory: str) -> tuple[str, str]:
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+                    '-nodes', '-days', '1', '-subj', '/CN=localhost', '-keyout', keyfile, '-out', certfile],
+                   check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def _connect(port: int, context: ssl.SSLContext, frame: bytes, session: ssl.SSLSession = None) \
+        -> tuple[float, ssl.SSLSession, bool]:
+    start = time.perf_counter()
+    with socket.create_connection(('127.0.0.1', port), timeout=10) as raw:
+        with context.wrap_socket(raw, server_hostname='localhost', session=session) as s:
+            setup = time.perf_counter() - start
+            s.sendall(frame)
+            while s.recv(4096):  # TLS 1.3 session tickets arrive after the handshake, with the response
+                pass
+            return setup, s.session, s.session_reused
+
+
+def run(engine_cls, certfile: str, keyfile: str, session_tickets: bool, connections: int, resume: bool) \
+        -> tuple[list[float], int, dict]:
+    port = _free_port()
+    framework = _StubFramework(0)
+    server = engine_cls(framework, ServerConfig(address=('127.0.0.1', port), tls_certfile=certfile,
+                                                tls_keyfile=keyfile, tls_session_tickets=session_tickets))
+    server.start(backlog=128)
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.load_verify_locations(certfile)
+    frame = _request_frame()
+    setups = []
+    resumed = 0
+    session = None
+    try:
+        for _ in range(connections):
+            setup, new_session, reused = _connect(port, context, frame, session if resume else None)
+            setups.append(setup)
+            resumed += reused
+            session = new_session
+    finally:
+        server.stop()
+    return setups, resumed, framework.metrics.snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=300, help="Connections opened per run.")
+    parser.add_argument('--certfile', help="PEM certificate for the server (for CN/SAN localhost).")
+    parser.add_argument('--keyfile', help="The certificate's private key.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = (args.certfile, args.keyfile) if args.certfile else _self_signed_certificate(directory)
+
+        for engine_name, engine_cls in (('threaded', SocketServer), ('asyncio', AsyncSocketServer)):
+            for mode, session_tickets in (('tickets', True), ('session cache', False)):
+                for resume in (False, True):
+                    setups, resumed, snapshot = run(engine_cls, certfile, keyfile, session_tickets,
+                                                    args.connections, resume)
+                    setups_ms = sorted(setup * 1000 for setup in setups)
+                    print(f"{engine_name:>9} {mode:>13} {'resumed' if resume else 'full':>7}: "
+                          f"median {statistics.median(setups_ms):7.2f} ms  "
+                          f"p95 {setups_ms[int(len(setups_ms) * 0.95) - 1]:7.2f} ms  "
+                          f"({resumed}/{len(setups)} resumed, server hit rate "
+                          f"{snapshot['gauges']['tls.resumption_hit_rate']:.2f})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+import threading
+import time
+from collections import OrderedDict
+
+from fotogo_networking.metrics import Metrics
+
+# Rough memory costs of the cached data, to keep the cache within its budget without measuring every object
+_SNAPSHOT_BYTES = 1024  # a DocumentSnapshot, besides its fields' data
+_MEMBERSHIP_BYTES = 128  # an image id in an album's set of images
+_LISTENER_BYTES = 64 * 1024  # a listener's stream, thread and buffers
+
+
+def _snapshot_size(snapshot) -> int:
+    """Estimates the memory a DocumentSnapshot takes, from the size of its fields' data."""
+    return _SNAPSHOT_BYTES + len(str(snapshot.to_dict()))
+
+
+class _UserAlbums:
+    """The cached albums, tombstones and album->image-ids membership of a single user, and their listeners."""
+
+    def __init__(self, uid: str):
+        self.uid = uid
+        self.albums: dict[str, object] = {}  # album id -> DocumentSnapshot
+        self.tombstones: dict[str, object] = {}  # album id -> DocumentSnapshot
+        self.members: dict[str, set[str]] = {}  # album id -> image ids
+        self.image_albums: dict[str, list[str]] = {}  # image id -> album ids, to diff the membership on changes
+        self.snapshot_sizes: dict[tuple[int, str], int] = {}  # (listener index, document id) -> estimated size
+        self.snapshot_bytes = 0
+        self.watches = []
+        self.synced = set()  # the listeners that delivered their first snapshot
+        self.read_times = {}  # listener index -> the time of the last snapshot it delivered
+        self.last_used = time.monotonic()
+
+    @property
+    def ready(self) -> bool:
+        """Whether all the listeners delivered their first snapshot, and are still listening."""
+        return len(self.synced) == len(self.watches) and all(watch.is_active for watch in self.watches)
+
+    @property
+    def size(self) -> int:
+        """
+        The estimated memory the user's data takes, in bytes: the listeners, the snapshots of every document they
+        listen to (which they hold in their own snapshot trees, whether the index keeps them or not) and the
+        membership index.
+        """
+        return len(self.watches) * _LISTENER_BYTES + self.snapshot_bytes + len(self.image_albums) * _MEMBERSHIP_BYTES
+
+
+class AlbumIndexCache:
+    """
+    An in-memory index of the albums of recently active users, kept fresh by Firestore snapshot listeners.
+
+    Every cached user has three listeners - on its albums, its album tombstones and its images (from which the
+    album->image-ids membership is built). Once they delivered their first snapshots, the user's albums are read from
+    memory with no RPC. The listeners apply the changes as Firestore pushes them, so the cache lags the database by
+    the listeners' latency - a read right after a write may not see the write yet.
+
+    A user is cached once its albums were read twice within idle_timeout seconds without hitting the cache (see
+    touch), so users that read their albums once, or not at all, do not pay for the listeners.
+
+    Users are evicted (and their listeners stopped) when they were not used for idle_timeout seconds, or, least
+    recently used first, when there are more than max_users of them or their estimated memory exceeds memory_budget.
+
+    Starting the listeners of a user reads all its albums and images once (billed as a read per document), which
+    the reads served from memory until the user is evicted pay back.
+    """
+
+    def __init__(self, db, albums_collection: str, tombstones_collection: str, images_collection: str,
+                 max_users: int = 1000, memory_budget: int = 64 * 1024 * 1024, idle_timeout: float = 600,
+                 metrics: Metrics = None):
+        """
+        Creates an AlbumIndexCache.
+
+        :param db: Firestore client.
+        :param albums_collection: The name of the albums collection.
+        :param tombstones_collection: The name of the album tombstones collection.
+        :param images_collection: The name of the images collection.
+        :param max_users: How many users to cache. Default to 1000.
+        :param memory_budget: The estimated memory (in bytes) the cached users may take. Default to 64 MB.
+        :param idle_timeout: How many seconds a user stays cached after it was last used. Default to 600.
+        :param metrics: Metrics registry to report the listeners, hit rate and memory into. None to not report them.
+        """
+        self._db = db
+        self._albums_collection = albums_collection
+        self._tombstones_collection = tombstones_collection
+        self._images_collection = images_collection
+        self._max_users = max_users
+        self._memory_budget = memory_budget
+        self._idle_timeout = idle_timeout
+        self._users: OrderedDict[str, _UserAlbums] = OrderedDict()
+        self._album_owners: dict[str, str] = {}  # album id -> the id of the cached user that owns it
+        self._candidates: OrderedDict[str, float] = OrderedDict()  # uid -> when its albums last missed the cache
+        self._lock = threading.RLock()
+        self._metrics = metrics if metrics is not None else Metrics()
+
+        self._metrics.register_gauge('album_cache.users', lambda: len(self._users))
+        self._metrics.register_gauge('album_cache.listeners', lambda: sum(len(i.watches) for i in self._users_list()))
+        self._metrics.register_gauge('album_cache.bytes', lambda: sum(i.size for i in self._users_list()))
+        self._metrics.register_gauge('album_cache.hit_rate', self.__hit_rate)
+
+    def touch(self, uid: str) -> None:
+        """
+        Marks a user as active, after a read of its albums missed the cache - starts caching it, if its albums already
+        missed the cache within the last idle_timeout seconds.
+
+        :param uid: User id.
+        """
+        with self._lock:
+            user = self._users.get(uid)
+            if user is None:
+                now = time.monotonic()
+                missed_at = self._candidates.pop(uid, None)
+                if missed_at is None or now - missed_at > self._idle_timeout:
+                    self._candidates[uid] = now
+                    while len(self._candidates) > self._max_users:
+                        self._candidates.popitem(last=False)
+                    return
+                user = _UserAlbums(uid)
+                self._users[uid] = user
+                self.__listen(user)
+            user.last_used = time.monotonic()
+            self._users.move_to_end(uid)
+            evicted = self.__evict()
+        AlbumIndexCache.__unlisten(evicted)
+
+    def user_albums(self, uid: str) -> list | None:
+        """
+        Returns the albums of a cached user.
+
+        :param uid: User id.
+        :return: list of the albums' DocumentSnapshots. None on a cache miss.
+        """
+        with self._lock:  # the listeners' callbacks change the index under the lock
+            user = self.__ready_user(uid)
+            return list(user.albums.values()) if user is not None else None
+
+    def user_tombstones(self, uid: str) -> list | None:
+        """
+        Returns the tombstones of the albums a cached user deleted.
+
+        :param uid: User id.
+        :return: list of the tombstones' DocumentSnapshots. None on a cache miss.
+        """
+        with self._lock:
+            user = self.__ready_user(uid)
+            return list(user.tombstones.values()) if user is not None else None
+
+    def synced_at(self, uid: str):
+        """
+        Returns the time the cached albums and tombstones of a user are up to date with - every change committed
+        before it was applied to them.
+
+        :param uid: User id.
+        :return: datetime. None if the user is not cached.
+        """
+        with self._lock:
+            user = self._users.get(uid)
+            if user is None or not user.ready:
+                return None
+            return min(user.read_times[0], user.read_times[1])
+
+    def get_album(self, album_id: str):
+        """
+        Returns an album of a cached user.
+
+        Only albums that exist are found - an album that is not cached may still exist, as an album of a user that is
+        not cached.
+
+        :param album_id: Album id.
+        :return: The album's DocumentSnapshot. None on a cache miss.
+        """
+        with self._lock:
+            uid = self._album_owners.get(album_id)
+            user = self.__ready_user(uid) if uid is not None else None
+            if user is None and uid is None:
+                self._metrics.increment('album_cache.misses')
+            return user.albums.get(album_id) if user is not None else None
+
+    def album_image_ids(self, uid: str, album_id: str) -> set[str] | None:
+        """
+        Returns the ids of the images on an album of a cached user.
+
+        :param uid: The album's owner id.
+        :param album_id: Album id.
+        :return: set of image ids. None on a cache miss.
+        """
+        with self._lock:
+            user = self.__ready_user(uid)
+            return set(user.members.get(album_id, ())) if user is not None else None
+
+    def close(self) -> None:
+        """Stops all the listeners and empties the cache."""
+        with self._lock:
+            users = [self.__remove(uid) for uid in list(self._users)]
+            self._candidates.clear()
+        AlbumIndexCache.__unlisten(users)
+
+    def _users_list(self) -> list[_UserAlbums]:
+        with self._lock:
+            return list(self._users.values())
+
+    def __ready_user(self, uid: str) -> _UserAlbums | None:
+        """Returns a cached user whose listeners are synced, counting the hit or miss. Holds the lock."""
+        user = self._users.get(uid)
+        if user is not None and any(not watch.is_active for watch in user.watches):
+            # a listener failed - stop the others, so the user is listened to again on its next touch. Stopping a
+            # listener waits for its thread, so it is stopped by another thread, which does not hold the lock
+            threading.Thread(target=AlbumIndexCache.__unlisten, args=([self.__remove(uid)],), daemon=True).start()
+            user = None
+        if user is None or not user.ready:
+            self._metrics.increment('album_cache.misses')
+            return None
+        self._metrics.increment('album_cache.hits')
+        user.last_used = time.monotonic()
+        self._users.move_to_end(uid)
+        return user
+
+    def __remove(self, uid: str) -> _UserAlbums:
+        """Removes a user from the cache and the album index, leaving its listeners to be stopped. Holds the lock."""
+        user = self._users.pop(uid)
+        for album_id in user.albums:
+            if self._album_owners.get(album_id) == uid:
+                del self._album_owners[album_id]
+        return user
+
+    def __listen(self, user: _UserAlbums) -> None:
+        """Starts the listeners of a user."""
+        listeners = (
+            (self._albums_collection, lambda change: self.__on_album(user, change)),
+            (self._tombstones_collection, lambda change: AlbumIndexCache.__on_document(user.tombstones, change)),
+            (self._images_collection, lambda change: AlbumIndexCache.__on_image(user, change)),
+        )
+        for index, (collection, on_change) in enumerate(listeners):
+            def callback(docs, changes, read_time, index=index, on_change=on_change):
+                with self._lock:
+                    if self._users.get(user.uid) is not user:
+                        return  # evicted - its listeners are being stopped
+                    for change in changes:
+                        on_change(change)
+                        AlbumIndexCache.__on_size(user, index, change)
+                    user.synced.add(index)
+                    user.read_times[index] = read_time
+
+            user.watches.append(self._db.collection(collection).where('owner_id', '==', user.uid).on_snapshot(callback))
+
+    @staticmethod
+    def __unlisten(users: list[_UserAlbums]) -> None:
+        """Stops the listeners of users that were removed from the cache. Must not hold the lock."""
+        for user in users:
+            for watch in user.watches:
+                watch.unsubscribe()
+
+    def __on_album(self, user: _UserAlbums, change) -> None:
+        """Applies a change of an album, to the user's albums and the album index."""
+        AlbumIndexCache.__on_document(user.albums, change)
+        if change.type.name == 'REMOVED':
+            self._album_owners.pop(change.document.id, None)
+        else:
+            self._album_owners[change.document.id] = user.uid
+
+    @staticmethod
+    def __on_document(documents: dict, change) -> None:
+        """Applies a change of an album or a tombstone."""
+        if change.type.name == 'REMOVED':
+            documents.pop(change.document.id, None)
+        else:
+            documents[change.document.id] = change.document
+
+    @staticmethod
+    def __on_image(user: _UserAlbums, change) -> None:
+        """Applies a change of an image to the albums' membership."""
+        image_id = change.document.id
+        for album_id in user.image_albums.pop(image_id, ()):
+            user.members[album_id].discard(image_id)
+            if not user.members[album_id]:
+                del user.members[album_id]
+        if change.type.name != 'REMOVED':
+            album_ids = change.document.to_dict().get('containing_albums') or []
+            user.image_albums[image_id] = album_ids
+            for album_id in album_ids:
+                user.members.setdefault(album_id, set()).add(image_id)
+
+    @staticmethod
+    def __on_size(user: _UserAlbums, index: int, change) -> None:
+        """Updates the estimated memory of the snapshots the user's listener holds, after a change."""
+        key = (index, change.document.id)
+        user.snapshot_bytes -= user.snapshot_sizes.pop(key, 0)
+        if change.type.name != 'REMOVED':
+            user.snapshot_sizes[key] = _snapshot_size(change.document)
+            user.snapshot_bytes += user.snapshot_sizes[key]
+
+    def __evict(self) -> list[_UserAlbums]:
+        """
+        Removes idle users, then the least recently used ones while the cache is over its bounds. Holds the lock.
+
+        :return: The removed users, whose listeners should be stopped once the lock is released.
+        """
+        now = time.monotonic()
+        evicted = [self.__remove(uid) for uid, user in list(self._users.items())
+                   if now - user.last_used > self._idle_timeout]
+
+        size = sum(user.size for user in self._users.values())
+        while len(self._users) > 1 and (len(self._users) > self._max_users or size > self._memory_budget):
+            user = self.__remove(next(iter(self._users)))
+            size -= user.size
+            evicted.append(user)
+            self._metrics.increment('album_cache.evictions')
+        return evicted
+
+    def __hit_rate(self) -> float:
+        hits = self._metrics.counter('album_cache.hits')
+        lookups = hits + self._metrics.counter('album_cache.misses')
+        return hits / lookups if lookups else 0
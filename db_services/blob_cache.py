@@ -0,0 +1,242 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+
+from fotogo_networking.metrics import Metrics
+
+
+def remove_stale_process_directories(directory: str) -> int:
+    """
+    Removes the cache directories of processes that are no longer running, under a directory that holds a cache
+    directory per process, named after its pid. A crashed worker is restarted with a new pid, and nothing else would
+    remove the contents it cached.
+
+    :param directory: The directory that holds the per-process cache directories.
+    :return: How many directories were removed.
+    """
+    removed = 0
+    for name in os.listdir(directory) if os.path.isdir(directory) else ():
+        if not name.isdigit() or int(name) == os.getpid():
+            continue
+        try:
+            os.kill(int(name), 0)
+            continue  # still running
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            continue  # running, as another user
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+        removed += 1
+    return removed
+
+
+class _Entry:
+    """A cached blob: the generation it was downloaded at and the digest of its contents."""
+
+    def __init__(self, generation: int | None, digest: str, size: int):
+        self.generation = generation
+        self.digest = digest
+        self.size = size
+        self.validated_at = time.monotonic()
+
+
+class BlobCache:
+    """
+    A read-through disk cache of blobs' contents, bounded by a byte budget.
+
+    The contents are stored content-addressed - in a file named after their SHA-256 digest - so blobs with the same
+    contents are stored once. The cache maps every blob path to the generation it was downloaded at and its digest;
+    once an entry is older than revalidate_after seconds, it is revalidated with a conditional download, which only
+    downloads the blob again if its generation changed.
+
+    When the cached contents exceed max_bytes, the least recently used blobs are evicted. Contents up to
+    memory_item_size bytes are also kept in an in-memory hot tier of memory_size bytes, so the smallest images are
+    served without reading the disk.
+
+    The cache directory is emptied when the cache is created - the entries are not persisted.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1024 * 1024 * 1024, revalidate_after: float = 60,
+                 memory_size: int = 0, memory_item_size: int = 256 * 1024, metrics: Metrics = None):
+        """
+        Creates a BlobCache.
+
+        :param directory: The directory to store the contents in. Created if it does not exist.
+        :param max_bytes: How many bytes of contents the disk may hold. Default to 1 GB.
+        :param revalidate_after: How many seconds an entry is served before it is revalidated against the blob's
+        generation. Default to 60.
+        :param memory_size: How many bytes of contents the in-memory hot tier may hold. Default to 0 (no hot tier).
+        :param memory_item_size: The largest contents (in bytes) kept in the hot tier. Default to 256 KB.
+        :param metrics: Metrics registry to report the hits, misses and bytes saved into. None to not report them.
+        """
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._revalidate_after = revalidate_after
+        self._memory_size = memory_size
+        self._memory_item_size = memory_item_size
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()  # blob path -> entry, least recently used first
+        self._references: dict[str, int] = {}  # digest -> how many entries have these contents
+        self._bytes = 0
+        self._memory: OrderedDict[str, bytes] = OrderedDict()  # digest -> contents, least recently used first
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._metrics = metrics if metrics is not None else Metrics()
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+        self._metrics.register_gauge('blob_cache.bytes', lambda: self._bytes)
+        self._metrics.register_gauge('blob_cache.memory_bytes', lambda: self._memory_bytes)
+        self._metrics.register_gauge('blob_cache.hit_rate', self.__hit_rate)
+
+    def get(self, blob_path: str, download: Callable[[int | None], tuple[bytes | None, int | None]]) -> bytes:
+        """
+        Returns the contents of a blob - from the cache, or downloaded (and cached) on a miss.
+
+        :param blob_path: Path of the blob.
+        :param download: Called with the cached generation of the blob (None if it is not cached) to download it.
+        Returns the contents and their generation, or None as the contents if the blob is still at the cached
+        generation.
+        :return: The blob's contents.
+        """
+        with self._lock:
+            entry = self._entries.get(blob_path)
+            if entry is not None:
+                self._entries.move_to_end(blob_path)
+
+        if entry is not None and time.monotonic() - entry.validated_at > self._revalidate_after:
+            data, generation = download(entry.generation)
+            if data is not None:
+                self.__miss(blob_path, data, generation)
+                return data
+            entry.validated_at = time.monotonic()
+
+        data = self.__read(entry) if entry is not None else None
+        if data is None:
+            data, generation = download(None)
+            self.__miss(blob_path, data, generation)
+            return data
+
+        self._metrics.increment('blob_cache.hits')
+        self._metrics.increment('blob_cache.bytes_saved', len(data))
+        return data
+
+    def invalidate(self, blob_path: str) -> None:
+        """
+        Drops a blob from the cache, when it is deleted or overwritten.
+
+        :param blob_path: Path of the blob.
+        """
+        with self._lock:
+            entry = self._entries.pop(blob_path, None)
+            if entry is not None:
+                self.__release(entry)
+
+    def invalidate_directory(self, directory_path: str) -> None:
+        """
+        Drops all the blobs under a directory from the cache.
+
+        :param directory_path: The path of the directory.
+        """
+        with self._lock:
+            for blob_path in [i for i in self._entries if i.startswith(directory_path)]:
+                self.__release(self._entries.pop(blob_path))
+
+    def __path(self, digest: str) -> str:
+        return os.path.join(self._directory, digest[:2], digest)
+
+    def __read(self, entry: _Entry) -> bytes | None:
+        """Reads an entry's contents, from the hot tier or the disk. None if they were evicted meanwhile."""
+        with self._lock:
+            data = self._memory.get(entry.digest)
+            if data is not None:
+                self._memory.move_to_end(entry.digest)
+                self._metrics.increment('blob_cache.memory_hits')
+                return data
+        try:
+            with open(self.__path(entry.digest), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        self.__remember(entry.digest, data)
+        return data
+
+    def __miss(self, blob_path: str, data: bytes, generation: int | None) -> None:
+        """Counts a miss, and caches the downloaded contents."""
+        self._metrics.increment('blob_cache.misses')
+        if len(data) > self._max_bytes:
+            return
+
+        digest = hashlib.sha256(data).hexdigest()
+        self.__write(digest, data)
+
+        with self._lock:
+            previous = self._entries.pop(blob_path, None)
+            self._entries[blob_path] = _Entry(generation, digest, len(data))
+            if previous is None or previous.digest != digest:
+                # referenced before the previous entry is released, so contents they share are never deleted
+                self._references[digest] = self._references.get(digest, 0) + 1
+                if self._references[digest] == 1:
+                    self._bytes += len(data)
+                if previous is not None:
+                    self.__release(previous)
+
+            while self._bytes > self._max_bytes:
+                self.__release(self._entries.popitem(last=False)[1])
+                self._metrics.increment('blob_cache.evictions')
+            cached = digest in self._references
+
+        if cached:
+            # the contents may have been deleted by another entry's release before they were referenced
+            self.__write(digest, data)
+            self.__remember(digest, data)
+
+    def __write(self, digest: str, data: bytes) -> None:
+        """Writes contents to the disk, unless they are already there."""
+        path = self.__path(digest)
+        if os.path.exists(path):
+            return
+        # written to a temporary file first, so a concurrent read never sees partial contents
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self._directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def __remember(self, digest: str, data: bytes) -> None:
+        """Keeps small contents in the hot tier, evicting the least recently used ones to make room."""
+        if len(data) > self._memory_item_size or len(data) > self._memory_size:
+            return
+        with self._lock:
+            if digest in self._memory:
+                return
+            self._memory[digest] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self._memory_size:
+                self._memory_bytes -= len(self._memory.popitem(last=False)[1])
+
+    def __release(self, entry: _Entry) -> None:
+        """Drops an entry's reference to its contents, deleting them when no entry references them. Holds the lock."""
+        self._references[entry.digest] -= 1
+        if self._references[entry.digest] > 0:
+            return
+
+        del self._references[entry.digest]
+        self._bytes -= entry.size
+        data = self._memory.pop(entry.digest, None)
+        if data is not None:
+            self._memory_bytes -= len(data)
+        try:
+            os.remove(self.__path(entry.digest))
+        except OSError:
+            pass
+
+    def __hit_rate(self) -> float:
+        hits = self._metrics.counter('blob_cache.hits')
+        lookups = hits + self._metrics.counter('blob_cache.misses')
+        return hits / lookups if lookups else 0
@@ -0,0 +1,79 @@
+import random
+
+from firebase_admin import firestore
+
+from db_services.data_structures import IdentityContext
+
+
+class ShardedCounters:
+    """
+    Counters materialized in Firestore, so reading them is a single small query instead of counting the documents.
+
+    A single document sustains only about one write per second, so the counters are spread over several shard
+    documents: every increment goes to a random shard, and the value of a counter is the sum of its shards.
+
+    The counters are only trusted once they were reset with absolute counts (see reset) - until then, read returns
+    None. Increments that race with a reset may be lost or counted twice, which the next reset corrects.
+    """
+    _RECONCILED_FIELD = 'reconciled_at'
+
+    def __init__(self, db, collection: str = 'counters', document_id: str = 'statistics', shards: int = 10):
+        """
+        Creates a ShardedCounters.
+
+        :param db: Firestore client.
+        :param collection: The collection of the counters' document. Default to "counters".
+        :param document_id: The counters' document. The shards are stored in its "shards" subcollection. Default to
+        "statistics".
+        :param shards: How many shards to spread the increments over. Default to 10.
+        """
+        self._shards_ref = db.collection(collection).document(document_id).collection('shards')
+        self._shards = shards
+        self._db = db
+
+    def increment(self, writer, field: str, amount: int = 1) -> None:
+        """
+        Adds an increment of a counter to a write batch or a transaction, so it is committed with the write it counts.
+
+        :param writer: WriteBatch or Transaction.
+        :param field: The counter to increment.
+        :param amount: How much to add to the counter. Negative to decrement it. Default to 1.
+        """
+        if amount == 0:
+            return
+        writer.set(self._shards_ref.document(str(random.randrange(self._shards))),
+                   {field: firestore.Increment(amount)}, merge=True)
+
+    def read(self, identity: IdentityContext = None) -> dict[str, int] | None:
+        """
+        Reads the counters, by reading all the shards in a single query.
+
+        :param identity: The identity context of the request, to count the reads in.
+        :return: dict of counter name to its value. None if the counters were never reset.
+        """
+        shards = list(self._shards_ref.get())
+        if identity is not None:
+            identity.count_reads(max(1, len(shards)))
+
+        counts = {}
+        reconciled = False
+        for shard in shards:
+            for field, value in shard.to_dict().items():
+                if field == ShardedCounters._RECONCILED_FIELD:
+                    reconciled = True
+                else:
+                    counts[field] = counts.get(field, 0) + value
+        return counts if reconciled else None
+
+    def reset(self, counts: dict[str, int]) -> None:
+        """
+        Sets the counters to absolute counts: the first shard holds the counts, and the other shards are cleared.
+
+        :param counts: dict of counter name to its value.
+        """
+        batch = self._db.batch()
+        batch.set(self._shards_ref.document('0'),
+                  dict(counts, **{ShardedCounters._RECONCILED_FIELD: firestore.SERVER_TIMESTAMP}))
+        for shard in range(1, self._shards):
+            batch.delete(self._shards_ref.document(str(shard)))
+        batch.commit()
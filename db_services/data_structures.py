@@ -62,7 +62,7 @@ class Image:
     Holds the required data for an image, as stored in the DB.
     """
     def __init__(self, owner_id: str, file_name: str, timestamp: datetime, image_url: str = None, tag: int = None,
-                 location: GeoPoint = None, containing_albums: list[str] = None):
+                 location: GeoPoint = None, containing_albums: list[str] = None, renditions: list[str] = None):
         if containing_albums is None:
             containing_albums = []
         self.owner_id = owner_id
@@ -72,8 +72,61 @@ class Image:
         self.location = location
         self.tag = tag
         self.containing_albums = containing_albums
+        # the renditions stored besides the original (see db_services.renditions). None if it was never rendered
+        self.renditions = renditions
 
     def __repr__(self):
         return f"Image(owner_id: {self.owner_id}, file_name: {self.file_name}, timestamp: {self.timestamp}, " \
                f"url: {self.url}, location: {self.location}, tag: {self.tag}, " \
-               f"containing_albums: {self.containing_albums})"
+               f"containing_albums: {self.containing_albums}, renditions: {self.renditions})"
+
+
+class IdentityContext:
+    """
+    Holds the identity of the user making a request: their user document, loaded once when the request is
+    authenticated.
+
+    Passed to the DBService methods, which use it instead of reading the user document again, and count the Firestore
+    reads they make in it.
+    """
+
+    def __init__(self, uid: str, user_data: dict = None):
+        """
+        Creates an IdentityContext.
+
+        :param uid: User id.
+        :param user_data: The user's document, as a dictionary. None if the user does not exist in the database.
+        """
+        self.uid = uid
+        self.user_data = user_data
+        self.reads = 0
+
+    @property
+    def exists(self) -> bool:
+        """
+        Get whether the user exists in the Users collection.
+
+        :return: bool
+        """
+        return self.user_data is not None
+
+    @property
+    def privilege_level(self) -> int | None:
+        """
+        Get the user's privilege level (0 for admins, 1 for users).
+
+        :return: int, or None if the user does not exist.
+        """
+        return self.user_data.get('privilege_level') if self.user_data is not None else None
+
+    def count_reads(self, count: int = 1) -> None:
+        """
+        Counts Firestore document reads made on behalf of the request.
+
+        :param count: How many documents were read.
+        """
+        self.reads += count
+
+    def __repr__(self):
+        return f"IdentityContext(uid: {self.uid}, exists: {self.exists}, privilege_level: {self.privilege_level}, " \
+               f"reads: {self.reads})"
@@ -1,17 +1,28 @@
+import base64
+import itertools
+import json
+import math
 import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import time
-from typing import Type
+from typing import Callable
 
 import firebase_admin
 import google.cloud.firestore_v1.client
 from firebase_admin import firestore, auth
 from firebase_admin.auth import UserRecord
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
+from google.cloud.firestore_v1.field_path import FieldPath
 
-from db_services.data_structures import AlbumDetails, Image, DateTimeRange
+from db_services.album_cache import AlbumIndexCache
+from db_services.counters import ShardedCounters
+from db_services.data_structures import AlbumDetails, Image, DateTimeRange, IdentityContext
+from db_services.token_cache import CertificateRefresher, VerifiedTokenCache
 from fotogo_networking.admin_data_structures import DBStatistics, UserData
 from fotogo_networking.exceptions import *
 from fotogo_networking.exceptions import UserNotExistsException, AlbumNotExistsException, ImageNotExistsException
+from fotogo_networking.metrics import Metrics
 
 TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
 
@@ -21,37 +32,198 @@ class DBService:
     _USERS_COLLECTION = 'users'
     _ALBUMS_COLLECTION = 'albums'
     _IMAGES_COLLECTION = 'images'
-
-    def __init__(self, app):
+    _TOMBSTONES_COLLECTION = 'album_tombstones'  # a document per deleted album, for the delta sync
+    _MAX_BATCH_WRITES = 500  # the most writes a single Firestore commit may hold
+    _DELETE_PAGE_SIZE = 500
+    _DELETE_OPS_PER_SECOND = 500
+    _DELETE_ATTEMPTS = 15  # as many as the BulkWriter's default error handler allows
+    _MAX_USERS_LOOKUP = 100  # the most identifiers a single auth.get_users call may hold
+    _USERS_LOOKUP_THREADS = 8
+
+    def __init__(self, app, metrics: Metrics = None, logger=None, token_cache_size: int = 10000,
+                 materialized_counters: bool = False, album_cache: bool = False):
         """
         Initializes DBService with a Firebase app.
 
+        Also starts refreshing the ID token certificates in the background (see CertificateRefresher).
+
         :param app: Firebase app.
+        :param metrics: Metrics registry to report the token cache's hit rate and the verification latency into.
+        Default to a private registry.
+        :param logger: Logger object to report background errors to. None to not report them.
+        :param token_cache_size: How many verified ID tokens to cache. Default to 10000.
+        :param materialized_counters: Whether to keep the users, albums and images counts in ShardedCounters, updated
+        with every write that adds or deletes a document, so generate_statistics reads them instead of counting the
+        collections. Default to False.
+        :param album_cache: Whether to keep the albums of recently active users in an AlbumIndexCache, so their album
+        reads are served from memory. Default to False.
         """
         self._db: google.cloud.firestore_v1.client.Client = firestore.client(app)
+        self._counters = ShardedCounters(self._db)
+        self._materialized_counters = materialized_counters
         self._client = auth.Client(app)
-
-    @staticmethod
-    def delete_documents(coll_ref, batch_size=10):
+        self._users_lookup_executor = ThreadPoolExecutor(max_workers=DBService._USERS_LOOKUP_THREADS,
+                                                         thread_name_prefix="auth-lookup")
+        self._metrics = metrics if metrics is not None else Metrics()
+        self._token_cache = VerifiedTokenCache(token_cache_size, self._metrics)
+        self._album_cache = None
+        if album_cache:
+            self._album_cache = AlbumIndexCache(self._db, DBService._ALBUMS_COLLECTION,
+                                                DBService._TOMBSTONES_COLLECTION, DBService._IMAGES_COLLECTION,
+                                                metrics=self._metrics)
+
+        # firebase_admin does not expose the transport it fetches the certificates with
+        certificate_request = getattr(getattr(self._client, '_token_verifier', None), 'request', None)
+        self._certificate_refresher = None
+        if certificate_request is not None:
+            self._certificate_refresher = CertificateRefresher(certificate_request, logger=logger)
+            self._certificate_refresher.start()
+
+    def delete_documents(self, coll_ref, page_size: int = _DELETE_PAGE_SIZE,
+                         max_ops_per_second: int = _DELETE_OPS_PER_SECOND,
+                         on_progress: Callable[[int], None] = None) -> int:
         """
         Deletes all the documents in coll_ref.
 
-        Used to delete mass documents (like collections with hundreds of documents) in a memory-effective way.
-        Deletes batch_size documents each iteration recursively, in order to not fill-up the memory.
+        Used to delete mass documents (like collections with thousands of documents) in a memory-effective way.
+        Pages through the documents' references (without their fields) page_size at a time, and deletes each page with
+        a BulkWriter, which commits the deletes in batches of 20, sending the batches in parallel.
 
-        :param coll_ref: Reference to the collection to delete.
-        :param batch_size: How many documents to delete in each iteration. Default to 10.
-        :return:
+        :raises Exception: If some of the documents could not be deleted, after the BulkWriter's retries.
+
+        :param coll_ref: Reference to the collection (or query) to delete.
+        :param page_size: How many documents to read and delete in each iteration. Default to 500.
+        :param max_ops_per_second: How many deletes per second the BulkWriter may send, which bounds how many of them
+        run in parallel. Default to 500, the rate Firestore recommends starting a bulk operation with.
+        :param on_progress: Called with how many documents were deleted so far, after every page.
+        :return: How many documents were deleted.
         """
-        docs = coll_ref.limit(batch_size).stream()
+        bulk_writer = self._db.bulk_writer(BulkWriterOptions(initial_ops_per_second=max_ops_per_second,
+                                                             max_ops_per_second=max_ops_per_second))
+        failed = []
+
+        def on_write_error(error, writer) -> bool:
+            """Retries a failed delete, until it ran out of attempts. Returns whether to retry it."""
+            if error.attempts < DBService._DELETE_ATTEMPTS:
+                return True
+            failed.append(error.operation.reference.id)
+            return False
+
+        bulk_writer.on_write_error(on_write_error)
+
+        query = coll_ref.select([FieldPath.document_id()]).order_by(FieldPath.document_id()).limit(page_size)
         deleted = 0
+        last = None
+        try:
+            while True:
+                page = list((query.start_after(last) if last is not None else query).stream())
+                for doc in page:
+                    bulk_writer.delete(doc.reference)
+                bulk_writer.flush()
+
+                deleted += len(page)
+                if on_progress is not None:
+                    on_progress(deleted - len(failed))
+                if len(page) < page_size:
+                    break
+                last = page[-1]
+        finally:
+            bulk_writer.close()
+
+        if failed:
+            raise Exception(f"Failed to delete {len(failed)} documents, such as {failed[0]}")
+        return deleted
 
-        for doc in docs:
-            doc.reference.delete()
-            deleted = deleted + 1
+    @staticmethod
+    def _get_document(doc_ref, identity: IdentityContext = None):
+        """
+        Reads a document, counting the read in the request's identity context.
+
+        :param doc_ref: Reference to the document.
+        :param identity: The identity context of the request. None to not count the read.
+        :return: DocumentSnapshot
+        """
+        if identity is not None:
+            identity.count_reads()
+        return doc_ref.get()
+
+    @staticmethod
+    def _get_query(query, identity: IdentityContext = None) -> list:
+        """
+        Runs a query, counting the documents it read in the request's identity context.
+
+        :param query: The query to run.
+        :param identity: The identity context of the request. None to not count the reads.
+        :return: List of DocumentSnapshot
+        """
+        docs = list(query.get())
+        if identity is not None:
+            identity.count_reads(max(1, len(docs)))  # a query that matches nothing is billed as one read
+        return docs
+
+    def _get_documents(self, collection: str, document_ids: list[str], identity: IdentityContext = None) -> dict:
+        """
+        Reads many documents of a collection in a single batched lookup (Client.get_all), instead of a round-trip per
+        document.
 
-        if deleted >= batch_size:
-            return DBService.delete_documents(coll_ref, batch_size)
+        :param collection: The name of the collection.
+        :param document_ids: The ids of the documents to read.
+        :param identity: The identity context of the request. None to not count the reads.
+        :return: dict of document id to its DocumentSnapshot (with exists False for missing documents).
+        """
+        if not document_ids:
+            return {}
+        if identity is not None:
+            identity.count_reads(len(set(document_ids)))
+        collection_ref = self._db.collection(collection)
+        return {doc.id: doc for doc in self._db.get_all([collection_ref.document(i) for i in set(document_ids)])}
+
+    def _get_album(self, album_id: str, identity: IdentityContext = None):
+        """
+        Reads an album's document - from the album cache, if its owner is cached.
+
+        :param album_id: Album id.
+        :param identity: The identity context of the request, to count the read in (reads from the cache are free).
+        :return: DocumentSnapshot
+        """
+        if self._album_cache is None:
+            return DBService._get_document(self._db.collection(DBService._ALBUMS_COLLECTION).document(album_id),
+                                           identity)
+
+        album = self._album_cache.get_album(album_id)
+        if album is None:
+            album = DBService._get_document(self._db.collection(DBService._ALBUMS_COLLECTION).document(album_id),
+                                            identity)
+            if album.exists:
+                self._album_cache.touch(album.to_dict().get('owner_id'))
+        return album
+
+    @staticmethod
+    def _count(query, identity: IdentityContext = None) -> int:
+        """
+        Counts the documents matching a query with a count aggregation, on the server, without downloading them.
+
+        :param query: The query (or collection) to count.
+        :param identity: The identity context of the request. None to not count the reads.
+        :return: The number of documents.
+        """
+        count = int(query.count().get()[0][0].value)
+        if identity is not None:
+            identity.count_reads(max(1, math.ceil(count / 1000)))  # billed as one read per 1000 counted documents
+        return count
+
+    def _counter_writes(self, **amounts: int) -> list:
+        """
+        Returns the writes that add amounts to the materialized counters, for _commit_in_batches - none, if the
+        counters are not kept.
+
+        :param amounts: The amount to add to each counter, by its name (the collection it counts).
+        :return: list of writes.
+        """
+        if not self._materialized_counters:
+            return []
+        return [lambda batch, field=field, amount=amount: self._counters.increment(batch, field, amount)
+                for field, amount in amounts.items() if amount]
 
     def get_user_record(self, uid: str) -> UserRecord:
         """
@@ -64,17 +236,38 @@ class DBService:
 
     """ USERS """
 
+    def get_identity(self, uid: str) -> IdentityContext:
+        """
+        Loads the identity context of a user - their user document - once per request.
+
+        :param uid: User id.
+        :return: IdentityContext object (with exists False if the user is not registered).
+        """
+        identity = IdentityContext(uid)
+        doc = DBService._get_document(self._db.collection(DBService._USERS_COLLECTION).document(uid), identity)
+        identity.user_data = doc.to_dict() if doc.exists else None
+        return identity
+
     def authenticate_user(self, id_token) -> str:
         """
         Authenticate user by its id token.
         This is a must security step before executing the client's request, to verify the client's identity.
         If the token is not valid, expired or has invalid signature, a 401 response is returned.
 
+        Tokens that were already verified are served from a cache until they expire, without checking their signature
+        again.
+
         :param id_token: The token to verify.
         :return: User id.
         """
+        uid = self._token_cache.get(id_token)
+        if uid is not None:
+            return uid
+
         try:
-            res = self._client.verify_id_token(id_token)
+            with self._metrics.timer('auth.verify_seconds'):
+                res = self._client.verify_id_token(id_token)
+            self._token_cache.put(id_token, res['uid'], res['exp'])
             return res['uid']
         except firebase_admin.auth.TokenSignError:
             raise UserNotAuthenticatedException("Invalid token signature.")
@@ -85,7 +278,7 @@ class DBService:
         except firebase_admin.auth.InvalidIdTokenError:
             raise UserNotAuthenticatedException("The provided ID token is not a valid Firebase ID token.")
 
-    def get_privilege_level(self, uid: str) -> int:
+    def get_privilege_level(self, uid: str, identity: IdentityContext = None) -> int:
         """
         Checks for user's privilege level in the system.\n
         Privilege levels are:
@@ -93,10 +286,20 @@ class DBService:
         * 0: Admin. Has the highest privilege to view statistics, access sensitive data and perform dangerous actions like delete accounts.
         * 1: User. The end-user which can do "regular" operations and manage their account only.
 
+        :raises UserNotExistsException: If the user does not exist.
+
         :param uid: user id.
+        :param identity: The identity context of the request. Used instead of reading the user document if it is uid's.
         :return: int - privilege level.
         """
-        return self._db.collection(DBService._USERS_COLLECTION).document(uid).get().to_dict()['privilege_level']
+        if identity is not None and identity.uid == uid:
+            user_data = identity.user_data
+        else:
+            user_data = DBService._get_document(self._db.collection(DBService._USERS_COLLECTION).document(uid),
+                                                identity).to_dict()
+        if user_data is None:
+            raise UserNotExistsException
+        return user_data['privilege_level']
 
     def add_user(self, uid: str) -> None:
         """
@@ -107,56 +310,84 @@ class DBService:
         :return: None
         """
         user = self.get_user_record(uid)
-        self._db.collection(DBService._USERS_COLLECTION).document(uid).set(
-            dict(email=user.email, name=user.display_name, privilege_level=1))
+        user_ref = self._db.collection(DBService._USERS_COLLECTION).document(uid)
+        data = dict(email=user.email, name=user.display_name, privilege_level=1)
+        if not self._materialized_counters:
+            user_ref.set(data)
+            return
+
+        # the user may already exist, so it is only counted if the transaction creates it
+        @firestore.transactional
+        def add_user(transaction):
+            exists = user_ref.get(transaction=transaction).exists
+            transaction.set(user_ref, data)
+            if not exists:
+                self._counters.increment(transaction, DBService._USERS_COLLECTION)
 
-    def user_exists(self, uid) -> bool:
+        add_user(self._db.transaction())
+
+    def user_exists(self, uid, identity: IdentityContext = None) -> bool:
         """
         Returns if aa uid (user id) exists in the Users collection.
 
         :param uid: User id
+        :param identity: The identity context of the request. Used instead of reading the user document if it is uid's.
         :return: bool
         """
-        return self._db.collection(DBService._USERS_COLLECTION).document(uid).get().exists
+        if identity is not None and identity.uid == uid:
+            return identity.exists
+        return DBService._get_document(self._db.collection(DBService._USERS_COLLECTION).document(uid), identity).exists
 
-    def delete_user_data(self, uid) -> None:
+    def delete_user_data(self, uid, on_progress: Callable[[str, int], None] = None) -> None:
         """
         Deletes all the data related to a user in the database.
 
         Deletes all images and albums owned by the user, as well as its document in the users collection.
 
         :param uid: User id to delete.
+        :param on_progress: Called with the collection being deleted ("images" or "albums") and how many of its
+        documents were deleted so far, after every page of delete_documents.
         """
-        # delete images' documents
-        DBService.delete_documents(self._db.collection(DBService._IMAGES_COLLECTION).where('owner_id', '==', uid))
+        deleted = {}
+        for collection in (DBService._IMAGES_COLLECTION, DBService._ALBUMS_COLLECTION):
+            deleted[collection] = -self.delete_documents(
+                self._db.collection(collection).where('owner_id', '==', uid),
+                on_progress=(lambda count, collection=collection: on_progress(collection, count))
+                if on_progress is not None else None)
 
-        # delete albums' documents
-        DBService.delete_documents(self._db.collection(DBService._ALBUMS_COLLECTION).where('owner_id', '==', uid))
+        # delete the tombstones of the albums the user deleted before
+        self.delete_documents(self._db.collection(DBService._TOMBSTONES_COLLECTION).where('owner_id', '==', uid))
 
         # delete user document
-        self._db.collection(DBService._USERS_COLLECTION).document(uid).delete()
+        user_ref = self._db.collection(DBService._USERS_COLLECTION).document(uid)
+        if self._materialized_counters and user_ref.get().exists:
+            deleted[DBService._USERS_COLLECTION] = -1
+        self._commit_in_batches([lambda batch: batch.delete(user_ref)] + self._counter_writes(**deleted))
 
     """ ALBUMS """
 
     def update_last_modified(self, last_modified: datetime, album_id: str):
-        self._db.collection(DBService._ALBUMS_COLLECTION).document(album_id).update(dict(last_modified=last_modified))
+        self._db.collection(DBService._ALBUMS_COLLECTION).document(album_id).update(
+            dict(last_modified=last_modified, changed_at=firestore.SERVER_TIMESTAMP))
 
-    def create_album(self, album: AlbumDetails) -> str:
+    def create_album(self, album: AlbumDetails, identity: IdentityContext = None) -> str:
         """
         Creates a new album in the database.
 
         The owner_id must exist in the Users collection.
 
         :param album: AlbumDetails object.
+        :param identity: The identity context of the request.
         :return: The album's id, as stored in the database.
         """
-        if not self.user_exists(album.owner_id):
+        if not self.user_exists(album.owner_id, identity):
             raise UserNotExistsException
 
         album_id = str(time.time())
-        while self.album_exists(album_id):
+        while self.album_exists(album_id, identity):
             album_id += str(random.randint(0, 10))
-        self._db.collection(DBService._ALBUMS_COLLECTION).add({
+        album_ref = self._db.collection(DBService._ALBUMS_COLLECTION).document(album_id)
+        self._commit_in_batches([lambda batch: batch.set(album_ref, {
             'owner_id': album.owner_id,
             'name': album.name,
             'date_range': {
@@ -166,20 +397,26 @@ class DBService:
             'is_built': album.is_built,
             'tags': album.tags,
             'permitted_users': album.permitted_users,
-            'last_modified': datetime.now()
-        }, album_id)
+            'last_modified': datetime.now(),
+            'cover_image': None,
+            'changed_at': firestore.SERVER_TIMESTAMP
+        })] + self._counter_writes(albums=1))
         return album_id
 
-    def sync_album_details(self, uid, requested_albums: dict = None) -> list[AlbumDetails]:
+    def sync_album_details(self, uid, requested_albums: dict = None,
+                           identity: IdentityContext = None) -> list[AlbumDetails]:
         """
         Syncs client's albums with the albums stored in DB, for one user.
 
-        For each outdated album, fetches all album data and the first image of it as a cover image. For deleted albums,
-        returns AlbumDetails object with empty owner_id, as a sign that the album needs to be deleted in client side.
+        For each outdated album, fetches all album data and its cover image. For deleted albums, returns AlbumDetails
+        object with empty owner_id, as a sign that the album needs to be deleted in client side.
+
+        Fetches all the albums of the user - clients that keep a watermark should use sync_album_changes instead.
 
         :param uid: user id.
         :param requested_albums: A dictionary containing all the albums' IDs as keys and their last-modified field as
         value.
+        :param identity: The identity context of the request.
         :return:
         """
         if requested_albums is None:
@@ -187,7 +424,12 @@ class DBService:
         album_details = []
 
         # get all albums owned by the given user ID
-        docs = self._db.collection(DBService._ALBUMS_COLLECTION).where('owner_id', '==', uid).get()
+        docs = self._album_cache.user_albums(uid) if self._album_cache is not None else None
+        if docs is None:
+            if self._album_cache is not None:
+                self._album_cache.touch(uid)
+            docs = DBService._get_query(self._db.collection(DBService._ALBUMS_COLLECTION).where('owner_id', '==', uid),
+                                        identity)
 
         # look for deleted albums
         db_album_ids = [k.id for k in docs]
@@ -214,80 +456,227 @@ class DBService:
                 continue
 
             # else, append to returned album_details list
-            album_images = list(
-                self._db.collection(DBService._IMAGES_COLLECTION).where('containing_albums', 'array_contains',
-                                                                        doc.id).get())
-            album_details.append(AlbumDetails(
-                owner_id=doc.get('owner_id'),
-                album_id=doc.id,
-                name=doc.get('name'),
-                date_range=DateTimeRange(start=doc.get('date_range')['from_date'],
-                                         end=doc.get('date_range')['to_date']),
-                last_modified=doc.get('last_modified'),
-                is_built=doc.get('is_built'),
-                tags=doc.get('tags'),
-                permitted_users=doc.get('permitted_users'),
-                cover_image=album_images[0].id if len(album_images) > 0 else None
-                # id of first image in album
-            ))
+            album_details.append(self._album_details(doc, identity))
 
         return album_details
 
-    def get_album_contents(self, album_id) -> list[Image]:
+    def sync_album_changes(self, uid, watermark: datetime = None,
+                           identity: IdentityContext = None) -> tuple[list[AlbumDetails], datetime | None]:
+        """
+        Syncs client's albums with the albums stored in DB, for one user, by returning only what changed since the
+        client's last sync.
+
+        Every write to an album stamps it with the server's time in its changed_at field, and deleting an album leaves
+        a tombstone stamped the same way. The albums and the tombstones changed after the watermark are read by two
+        queries, so a sync costs as many reads as there are changes. Deleted albums are returned as AlbumDetails
+        objects with empty owner_id, like in sync_album_details.
+
+        Without a watermark, all the albums of the user are returned (and no tombstones) - the client should replace
+        its cached albums with them.
+
+        The albums and tombstones of users in the album cache are filtered in memory instead of queried.
+
+        :param uid: user id.
+        :param watermark: The watermark returned by the client's last sync. None for a full sync.
+        :param identity: The identity context of the request.
+        :return: list of AlbumDetails of the changed albums, and the watermark to send on the next sync.
+        """
+        albums_query = self._db.collection(DBService._ALBUMS_COLLECTION).where('owner_id', '==', uid)
+        cached_docs = self._album_cache.user_albums(uid) if self._album_cache is not None else None
+        cached_tombstones = self._album_cache.user_tombstones(uid) if cached_docs is not None else None
+        synced_at = self._album_cache.synced_at(uid) if cached_tombstones is not None else None
+        if synced_at is None and self._album_cache is not None:
+            self._album_cache.touch(uid)
+        if synced_at is not None:
+            if watermark is None:
+                docs, tombstones = cached_docs, []
+            else:
+                docs, tombstones = [[i for i in cached if (i.to_dict().get('changed_at') or watermark) > watermark]
+                                    for cached in (cached_docs, cached_tombstones)]
+        elif watermark is None:
+            docs = DBService._get_query(albums_query, identity)
+            tombstones = []
+        else:
+            docs = DBService._get_query(albums_query.where('changed_at', '>', watermark), identity)
+            tombstones = DBService._get_query(
+                self._db.collection(DBService._TOMBSTONES_COLLECTION).where('owner_id', '==', uid)
+                .where('changed_at', '>', watermark), identity)
+
+        album_details = [self._album_details(doc, identity) for doc in docs]
+        album_details.extend(AlbumDetails(album_id=tombstone.id, owner_id='', name='',
+                                          date_range=DateTimeRange(start=datetime.now(), end=datetime.now()),
+                                          last_modified=datetime.now())
+                             for tombstone in tombstones)
+
+        # albums written before the changed_at field existed have none, and only come with full syncs
+        changed_at = [doc.to_dict().get('changed_at') for doc in docs + tombstones]
+        changed_at = [i for i in changed_at if i is not None]
+        if synced_at is not None:
+            # the albums and tombstones listeners may lag each other - a watermark past the one that lags would make
+            # the next sync skip the changes it has not delivered yet
+            changed_at = [min(i, synced_at) for i in changed_at]
+        return album_details, max(changed_at, default=watermark)
+
+    def _album_details(self, doc, identity: IdentityContext = None) -> AlbumDetails:
+        """
+        Builds an AlbumDetails object from an album's document.
+
+        :param doc: The album's DocumentSnapshot.
+        :param identity: The identity context of the request.
+        :return: AlbumDetails object.
+        """
+        data = doc.to_dict()
+        if 'cover_image' in data:
+            cover_image = data['cover_image']
+        else:
+            # albums written before the cover image was stored on them
+            album_images = DBService._get_query(
+                self._db.collection(DBService._IMAGES_COLLECTION).where('containing_albums', 'array_contains', doc.id)
+                .limit(1), identity)
+            cover_image = album_images[0].id if len(album_images) > 0 else None
+
+        return AlbumDetails(
+            owner_id=data.get('owner_id'),
+            album_id=doc.id,
+            name=data.get('name'),
+            date_range=DateTimeRange(start=data.get('date_range')['from_date'],
+                                     end=data.get('date_range')['to_date']),
+            last_modified=data.get('last_modified'),
+            is_built=data.get('is_built'),
+            tags=data.get('tags'),
+            permitted_users=data.get('permitted_users'),
+            cover_image=cover_image
+        )
+
+    def get_album_contents(self, album_id, identity: IdentityContext = None) -> list[Image]:
         """
         Returns a list of all the images on an album.
 
         :param album_id: Album id.
+        :param identity: The identity context of the request.
         :return: List of Image object, representing all the images on the album.
         """
-        if not self.album_exists(album_id):
+        if not self.album_exists(album_id, identity):
             raise AlbumNotExistsException
 
-        images = []
-        docs = self._db.collection(DBService._IMAGES_COLLECTION).where('containing_albums', 'array_contains',
-                                                                       album_id).get()
-        for doc in docs:
-            images.append(Image(
-                owner_id=doc.get('owner_id'),
-                file_name=doc.get('file_name'),
-                image_url=doc.get('url'),
-                timestamp=doc.get('timestamp'),
-                location=doc.get('location'),
-                tag=doc.get('tag'),
-                containing_albums=doc.get('containing_albums')
-            ))
+        docs = DBService._get_query(
+            self._db.collection(DBService._IMAGES_COLLECTION).where('containing_albums', 'array_contains', album_id),
+            identity)
+        return [DBService._image_from_doc(doc) for doc in docs]
 
-        return images
+    def get_album_contents_page(self, album_id, page_size: int, cursor: str = None,
+                                identity: IdentityContext = None) -> tuple[list[Image], str | None]:
+        """
+        Returns a page of the images on an album, ordered by their timestamps (and ids, between equal timestamps).
 
-    def update_album(self, album: AlbumDetails):
+        :param album_id: Album id.
+        :param page_size: How many images to return.
+        :param cursor: The cursor returned with the previous page. None for the first page.
+        :param identity: The identity context of the request.
+        :return: List of Image objects, and the cursor of the next page (None if this page is the last one).
+        """
+        if not self.album_exists(album_id, identity):
+            raise AlbumNotExistsException
+
+        query = self._db.collection(DBService._IMAGES_COLLECTION) \
+            .where('containing_albums', 'array_contains', album_id) \
+            .order_by('timestamp').order_by(FieldPath.document_id()).limit(page_size)
+        if cursor is not None:
+            timestamp, image_id = DBService._decode_cursor(cursor)
+            query = query.start_after({'timestamp': timestamp, FieldPath.document_id(): image_id})
+        docs = DBService._get_query(query, identity)
+
+        next_cursor = DBService._encode_cursor(docs[-1].get('timestamp'), docs[-1].id) \
+            if len(docs) == page_size else None
+        return [DBService._image_from_doc(doc) for doc in docs], next_cursor
+
+    @staticmethod
+    def _encode_cursor(timestamp, document_id: str) -> str:
+        """
+        Encodes the position after a document, in a query ordered by timestamp, as an opaque cursor.
+
+        The timestamps are stored as the clients sent them - strings or numbers, or datetimes - and Firestore orders
+        values of different types apart, so the cursor keeps the timestamp's type.
+
+        :param timestamp: The document's timestamp field, as stored.
+        :param document_id: The document's id.
+        :return: The cursor.
+        """
+        value = ['datetime', timestamp.isoformat()] if isinstance(timestamp, datetime) else ['value', timestamp]
+        return base64.urlsafe_b64encode(json.dumps(value + [document_id]).encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> tuple:
+        """
+        Decodes a cursor made by _encode_cursor.
+
+        :raises ValueError: If the cursor is malformed.
+
+        :param cursor: The cursor.
+        :return: The timestamp (of the type it is stored as) and the id of the document the cursor is after.
+        """
+        try:
+            kind, timestamp, document_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if kind == 'datetime':
+                return datetime.fromisoformat(timestamp), document_id
+            if kind != 'value':
+                raise ValueError(f"Unknown timestamp kind: {kind}")
+            return timestamp, document_id
+        except (TypeError, ValueError) as e:  # including binascii.Error and json.JSONDecodeError
+            raise ValueError(f"Malformed cursor: {cursor}") from e
+
+    @staticmethod
+    def _image_from_doc(doc) -> Image:
+        """
+        Builds an Image object from an image's document.
+
+        :param doc: The image's DocumentSnapshot.
+        :return: Image object.
+        """
+        return Image(
+            owner_id=doc.get('owner_id'),
+            file_name=doc.get('file_name'),
+            image_url=doc.get('url'),
+            timestamp=doc.get('timestamp'),
+            location=doc.get('location'),
+            tag=doc.get('tag'),
+            containing_albums=doc.get('containing_albums'),
+            # images uploaded before renditions were generated have no renditions field
+            renditions=doc.to_dict().get('renditions')
+        )
+
+    def update_album(self, album: AlbumDetails, identity: IdentityContext = None):
         """
         Updates album details, like its title.
 
         :param album: AlbumDetails object with updated data.
+        :param identity: The identity context of the request.
         :return: False if the user does not exist, else None.
         """
-        if not self.user_exists(album.owner_id):
+        if not self.user_exists(album.owner_id, identity):
             return False
             # raise Exception('Trying to update album to a user that does not exists!')
 
         self._db.collection(DBService._ALBUMS_COLLECTION).document(album.id).update(dict(
             name=album.name,
             date_range=dict(from_date=album.date_range.start, to_date=album.date_range.end),
-            last_modified=album.last_modified
+            last_modified=album.last_modified,
+            changed_at=firestore.SERVER_TIMESTAMP
         ))
 
         return True
 
-    def album_exists(self, album_id):
+    def album_exists(self, album_id, identity: IdentityContext = None):
         """
         Returns if an album_id exists in the Albums collection.
 
         :param album_id: Album id
+        :param identity: The identity context of the request, to count the read in.
         :return: bool
         """
-        return self._db.collection(DBService._ALBUMS_COLLECTION).document(album_id).get().exists
+        return self._get_album(album_id, identity).exists
 
-    def delete_album(self, uid, album_id) -> list[str]:
+    def delete_album(self, uid, album_id, identity: IdentityContext = None) -> list[str]:
         """
         Deletes an album.
 
@@ -295,115 +684,276 @@ class DBService:
         Raises AlbumNotExistsException or PermissionDeniedException.
 
         Deletes the album's document, unlinks the album from all its images and return the ones that remain with no
-        containing albums.
+        containing albums. Leaves a tombstone of the album, for sync_album_changes.
+
+        The images that remain with no containing albums are deleted from the database too. The images are unlinked
+        (or deleted) and the album is deleted in batched writes, with the images read by a single query.
 
         :param uid: User id
         :param album_id: The id of the album to delete.
+        :param identity: The identity context of the request.
         :return: List of the IDs of the images that have no containing albums alter the deletion.
         """
-        if not self.album_exists(album_id):
+        album_ref = self._db.collection(DBService._ALBUMS_COLLECTION).document(album_id)
+        album = self._get_album(album_id, identity)
+        if not album.exists:
             raise AlbumNotExistsException
-        album = list(self._db.collection(DBService._ALBUMS_COLLECTION).where('owner_id', '==', uid).get())
-        if len(album) == 0:
+        if album.get('owner_id') != uid:
             raise PermissionDeniedException
 
         # get album images
-        album_images = self._db.collection(DBService._IMAGES_COLLECTION).where('containing_albums', 'array_contains',
-                                                                               album_id).get()
-
-        # unlink images from album and create a list of images that needs to be deleted
-        img_ids_for_deletion = [i.id for i in album_images if self.unlink_image_from_album(uid, i.id, album_id)]
-
-        # Remove the album document
-        self._db.collection(DBService._ALBUMS_COLLECTION).document(album_id).delete()
+        album_images = DBService._get_query(
+            self._db.collection(DBService._IMAGES_COLLECTION).where('containing_albums', 'array_contains', album_id),
+            identity)
+
+        # unlink images from album, delete the ones left with no containing albums and remove the album document
+        writes, img_ids_for_deletion = self._unlink_writes(uid, album_images, album_id)
+        writes.append(lambda batch: batch.delete(album_ref))
+        writes.append(lambda batch: batch.set(
+            self._db.collection(DBService._TOMBSTONES_COLLECTION).document(album_id),
+            dict(owner_id=uid, changed_at=firestore.SERVER_TIMESTAMP)))
+        self._commit_in_batches(writes + self._counter_writes(albums=-1, images=-len(img_ids_for_deletion)))
 
         return img_ids_for_deletion
 
     """ IMAGES """
 
-    def add_image(self, image: Image) -> None:
+    def add_image(self, image: Image, identity: IdentityContext = None) -> None:
         """
         Adds an image to the database.
 
         Creates a document in the Images collection.
 
         :param image: Image object to add
+        :param identity: The identity context of the request.
         """
-        if not self.user_exists(image.owner_id):
+        if not self.user_exists(image.owner_id, identity):
             raise UserNotExistsException
 
-        self._db.collection(DBService._IMAGES_COLLECTION).document(image.file_name).set({
+        image_ref = self._db.collection(DBService._IMAGES_COLLECTION).document(image.file_name)
+        self._commit_in_batches([lambda batch: batch.set(image_ref, {
             'owner_id': image.owner_id,
             'file_name': image.file_name,
             'url': image.url,  # ^^ get after uploading image
             'timestamp': image.timestamp,
             'location': image.location,
             'tag': image.tag,
-            'containing_albums': image.containing_albums
-        })
+            'containing_albums': image.containing_albums,
+            'renditions': image.renditions
+        })] + self._add_cover_writes(dict.fromkeys(image.containing_albums, image.file_name), identity) +
+            self._counter_writes(images=1))
 
-    def link_image_to_album(self, uid, image_id, album_id) -> Type[UserNotExistsException | AlbumNotExistsException |
-                                                                   ImageNotExistsException]:
+    def _commit_in_batches(self, writes) -> int:
         """
-        Links an image to an album.
+        Commits writes in WriteBatches of up to _MAX_BATCH_WRITES writes each - one round-trip per batch.
 
-        Adds the album's id to the containing_albums field of the image.
+        Each batch is atomic on its own, but the batches are not atomic together.
 
-        The user, album and the image must exist in the database.
+        :param writes: Iterable of functions, each adding one write to the WriteBatch it is called with.
+        :return: How many batches were committed.
+        """
+        batch = self._db.batch()
+        pending = commits = 0
+        for write in writes:
+            write(batch)
+            pending += 1
+            if pending == DBService._MAX_BATCH_WRITES:
+                batch.commit()
+                commits += 1
+                batch = self._db.batch()
+                pending = 0
+        if pending:
+            batch.commit()
+            commits += 1
+        return commits
+
+    def add_images(self, images: list[Image], identity: IdentityContext = None) -> None:
+        """
+        Adds many images to the database, in batched writes instead of a round-trip per image.
+
+        Creates a document in the Images collection for each image. All the images must belong to the same owner.
+        Albums the images are in that have no cover image get the first of them as their cover.
+
+        :raises UserNotExistsException: If the owner does not exist.
+
+        :param images: Image objects to add.
+        :param identity: The identity context of the request.
+        """
+        if not images:
+            return
+        if not self.user_exists(images[0].owner_id, identity):
+            raise UserNotExistsException
+
+        covers = {}
+        for image in images:
+            for album_id in image.containing_albums:
+                covers.setdefault(album_id, image.file_name)
+
+        images_collection = self._db.collection(DBService._IMAGES_COLLECTION)
+        self._commit_in_batches([
+            lambda batch, image=image: batch.set(images_collection.document(image.file_name), {
+                'owner_id': image.owner_id,
+                'file_name': image.file_name,
+                'url': image.url,
+                'timestamp': image.timestamp,
+                'location': image.location,
+                'tag': image.tag,
+                'containing_albums': image.containing_albums,
+                'renditions': image.renditions
+            })
+            for image in images] + self._add_cover_writes(covers, identity) + self._counter_writes(images=len(images)))
+
+    def link_images_to_album(self, uid, image_ids: list[str], album_id, identity: IdentityContext = None) -> None:
+        """
+        Links many images to an album, in batched writes instead of a read-modify-write per image.
+
+        Adds the album's id to the containing_albums field of every image with an atomic ArrayUnion, so the images'
+        documents do not need to be read first, and an image is never linked to the same album twice.
+
+        The user and the album must exist, and so must every image - a batch that updates a missing image fails. If the
+        album has no cover image, the first image becomes its cover.
+
+        :raises UserNotExistsException: If the user does not exist.
+        :raises AlbumNotExistsException: If the album does not exist.
+
+        :param uid: The id of the user making the request.
+        :param image_ids: The ids of the images to link.
+        :param album_id: The id of the album.
+        :param identity: The identity context of the request.
+        """
+        if not image_ids:
+            return
+        if not self.user_exists(uid, identity):
+            raise UserNotExistsException
+        album = self._get_album(album_id, identity)
+        if not album.exists:
+            raise AlbumNotExistsException
+
+        images_collection = self._db.collection(DBService._IMAGES_COLLECTION)
+        self._commit_in_batches([
+            lambda batch, image_id=image_id: batch.update(images_collection.document(image_id),
+                                                          dict(containing_albums=firestore.ArrayUnion([album_id])))
+            for image_id in image_ids] + self._add_cover_writes({album_id: image_ids[0]}, albums={album_id: album}))
+
+    def _unlink_writes(self, uid, image_snapshots: list, album_id) -> tuple[list, list[str]]:
+        """
+        Prepares the writes that unlink images from an album.
+
+        Images that remain with no containing albums are deleted; the others get the album removed from their
+        containing_albums with an atomic ArrayRemove.
+
+        :raises ImageNotExistsException: If one of the images does not exist.
+        :raises PermissionDeniedException: If one of the images is not owned by the user.
 
         :param uid: The id of the user making the request.
-        :param image_id:
-        :param album_id:
-        :return: UserNotExistsException if the user does not exist, AlbumNotExistsException if the album does not exist,
-        ImageNotExistsException if the image does not exist. If everything is OK, returns None.
-        """
-        if not self.user_exists(uid):
-            return UserNotExistsException
-        if not self.album_exists(album_id):
-            return AlbumNotExistsException
-        if not self.image_exists(image_id):
-            return ImageNotExistsException
-        image = self._db.collection(DBService._IMAGES_COLLECTION).document(image_id)
-        # if uid != image.get().to_dict().get('owner_id'):
-        #     raise PermissionDeniedException('User does not have permission to this image: ' + image_id)
-
-        containing_albums: list = image.get().to_dict()['containing_albums']
-        containing_albums.append(album_id)
-        image.update(dict(containing_albums=containing_albums))
-
-    def unlink_image_from_album(self, uid, image_id, album_id, delete_if_unlinked: bool = True) -> bool:
-        """
-        Removes an album_id from the containing_albums array of an image.\n
-        If delete_if_unlinked is true and containing_albums is empty after the removal, the image's document is deleted,
-        and True is returned; else returns False.
+        :param image_snapshots: The DocumentSnapshots of the images.
+        :param album_id: The album to unlink from.
+        :return: The writes, for _commit_in_batches, and the IDs of the images that are deleted.
+        """
+        images_collection = self._db.collection(DBService._IMAGES_COLLECTION)
+        writes = []
+        deleted_image_ids = []
+        for snapshot in image_snapshots:
+            if not snapshot.exists:
+                raise ImageNotExistsException
+            image = snapshot.to_dict()
+            if uid != image.get('owner_id'):
+                raise PermissionDeniedException('User does not have permission to this image: ' + snapshot.id)
+
+            image_ref = images_collection.document(snapshot.id)
+            if [i for i in image['containing_albums'] if i != album_id]:
+                writes.append(lambda batch, image_ref=image_ref: batch.update(
+                    image_ref, dict(containing_albums=firestore.ArrayRemove([album_id]))))
+            else:
+                writes.append(lambda batch, image_ref=image_ref: batch.delete(image_ref))
+                deleted_image_ids.append(snapshot.id)
+        return writes, deleted_image_ids
+
+    def unlink_images_from_album(self, uid, image_ids: list[str], album_id,
+                                 identity: IdentityContext = None) -> list[str]:
+        """
+        Unlinks many images from an album, with the images read in a single batched lookup and written in batched
+        writes.
+
+        Images that remain with no containing albums are deleted from the database. If the album's cover image is
+        unlinked, another image of the album replaces it. Nothing is written if one of the checks fails.
+
+        :raises UserNotExistsException: If the user does not exist.
+        :raises AlbumNotExistsException: If the album does not exist.
+        :raises ImageNotExistsException: If one of the images does not exist.
+        :raises PermissionDeniedException: If one of the images is not owned by the user.
 
         :param uid: The id of the user making the request.
-        :param image_id: The image's id to delete.
+        :param image_ids: The ids of the images to unlink.
         :param album_id: The album to unlink from.
-        :param delete_if_unlinked: Whether to delete the image's document if containing_albums is empty after the
-        removal.
-        :return: Whether the image has been deleted or not.
+        :param identity: The identity context of the request.
+        :return: The IDs of the images that have been deleted.
         """
-        if not self.user_exists(uid):
+        if not image_ids:
+            return []
+        if not self.user_exists(uid, identity):
             raise UserNotExistsException
-        if not self.album_exists(album_id):
+        album = self._get_album(album_id, identity)
+        if not album.exists:
             raise AlbumNotExistsException
-        if not self.image_exists(image_id):
-            raise ImageNotExistsException
-        image = self._db.collection(DBService._IMAGES_COLLECTION).document(image_id)
-        if uid != image.get().to_dict().get('owner_id'):
-            raise PermissionDeniedException('User does not have permission to this image: ' + image_id)
-
-        containing_albums: list = image.get().to_dict()['containing_albums']
-        containing_albums.remove(album_id)
-        image.update(dict(containing_albums=containing_albums))
-        image.update({'containing_albums': containing_albums})
-        if delete_if_unlinked and len(containing_albums) == 0:
-            self.delete_image(uid, image_id)
-            return True
-        return False
-
-    def update_image_tag(self, uid, image_id, tag: int) -> None:
+
+        snapshots = self._get_documents(DBService._IMAGES_COLLECTION, image_ids, identity)
+        writes, deleted_image_ids = self._unlink_writes(uid, snapshots.values(), album_id)
+        writes += self._replace_cover_writes(album, set(image_ids), identity)
+        self._commit_in_batches(writes + self._counter_writes(images=-len(deleted_image_ids)))
+        return deleted_image_ids
+
+    @staticmethod
+    def _cover_write(album_ref, image_id):
+        """
+        Returns the write that sets the cover image of an album, for _commit_in_batches.
+
+        :param album_ref: Reference to the album.
+        :param image_id: The id of the cover image. None if the album has no images.
+        :return: The write.
+        """
+        return lambda batch: batch.update(album_ref, dict(cover_image=image_id, changed_at=firestore.SERVER_TIMESTAMP))
+
+    def _add_cover_writes(self, covers: dict, identity: IdentityContext = None, albums: dict = None) -> list:
+        """
+        Returns the writes that set the cover images of albums that have none, as images are linked to them.
+
+        :param covers: dict of album id to the id of an image linked to it.
+        :param identity: The identity context of the request.
+        :param albums: dict of album id to its DocumentSnapshot, if they were already read. None to read them.
+        :return: list of writes, for _commit_in_batches.
+        """
+        if albums is None:
+            albums = self._get_documents(DBService._ALBUMS_COLLECTION, list(covers), identity)
+        return [DBService._cover_write(album.reference, covers[album.id]) for album in albums.values()
+                if album.exists and album.id in covers and album.to_dict().get('cover_image') is None]
+
+    def _replace_cover_writes(self, album, removed_image_ids: set, identity: IdentityContext = None) -> list:
+        """
+        Returns the write that replaces the cover image of an album, if it is one of the images unlinked from it.
+
+        :param album: The album's DocumentSnapshot, from before the images were unlinked.
+        :param removed_image_ids: The ids of the images unlinked from the album.
+        :param identity: The identity context of the request.
+        :return: list of writes, for _commit_in_batches.
+        """
+        if album.to_dict().get('cover_image') not in removed_image_ids:
+            return []
+
+        album_image_ids = None
+        if self._album_cache is not None:
+            album_image_ids = self._album_cache.album_image_ids(album.to_dict().get('owner_id'), album.id)
+        if album_image_ids is not None:
+            return [DBService._cover_write(album.reference, next(iter(album_image_ids - removed_image_ids), None))]
+
+        # at most len(removed_image_ids) of the album's images are removed, so one more is enough to find another
+        album_images = DBService._get_query(
+            self._db.collection(DBService._IMAGES_COLLECTION).where('containing_albums', 'array_contains', album.id)
+            .limit(len(removed_image_ids) + 1), identity)
+        cover_image = next((i.id for i in album_images if i.id not in removed_image_ids), None)
+        return [DBService._cover_write(album.reference, cover_image)]
+
+    def update_image_tag(self, uid, image_id, tag: int, identity: IdentityContext = None) -> None:
         """
         Updates the "tag" field of an image.\n
         Checks if the user and the image exists, and if the user has permission to that image.
@@ -411,86 +961,223 @@ class DBService:
         :param uid: The id of the user making the request.
         :param image_id: The id of the image.
         :param tag: New tag id.
+        :param identity: The identity context of the request.
         """
-        if not self.user_exists(uid):
+        if not self.user_exists(uid, identity):
             raise Exception('User does not exists!')
-        if not self.image_exists(image_id):
+        if not self.image_exists(image_id, identity):
             raise Exception('Image does not exists!')
 
         self._db.collection(DBService._IMAGES_COLLECTION).document(image_id).update(dict(tag=tag))
 
-    def image_exists(self, image_id) -> bool:
+    def add_image_renditions(self, renditions: dict[str, list[str]]) -> None:
+        """
+        Records the renditions generated for images, in batched writes. Every image must exist.
+
+        The renditions are added to the renditions field of every image with an atomic ArrayUnion, so the images'
+        documents do not need to be read first. Images that no renditions were generated for (they cannot be decoded)
+        get an empty renditions field, which marks them as rendered.
+
+        :param renditions: dict of image id to the names of the renditions generated for it.
+        """
+        images_collection = self._db.collection(DBService._IMAGES_COLLECTION)
+        self._commit_in_batches([
+            lambda batch, image_id=image_id, names=names: batch.update(
+                images_collection.document(image_id), dict(renditions=firestore.ArrayUnion(names) if names else []))
+            for image_id, names in renditions.items()])
+
+    def get_images(self, image_ids: list[str], identity: IdentityContext = None) -> dict:
+        """
+        Looks up many images in a single batched lookup.
+
+        :param image_ids: The ids of the images.
+        :param identity: The identity context of the request, to count the reads in.
+        :return: dict of image id to its DocumentSnapshot (with exists False for images that do not exist).
+        """
+        return self._get_documents(DBService._IMAGES_COLLECTION, image_ids, identity)
+
+    def image_exists(self, image_id, identity: IdentityContext = None) -> bool:
         """
         Checks if a document with the given id is exists in the "images" collection.
 
         :param image_id: The id of the image document.
+        :param identity: The identity context of the request, to count the read in.
         :return: If the document exists.
         """
-        return self._db.collection(DBService._IMAGES_COLLECTION).document(image_id).get().exists
+        return DBService._get_document(self._db.collection(DBService._IMAGES_COLLECTION).document(image_id),
+                                       identity).exists
 
-    def delete_image(self, uid: str, image_id: str) -> None:
+    def delete_image(self, uid: str, image_id: str, identity: IdentityContext = None) -> None:
         """
         Deletes a document represents an image from the database.
         Checks if the user has permission to edit the image (by checking if the user has acc)
 
         :param uid: User id which requests to delete the image.
         :param image_id: The desired image id to delete
+        :param identity: The identity context of the request.
         :return:
         """
         # TODO: check if the image is in an album which the user has access to (make a function to check for that
         #  permission)
-        if not self.user_exists(uid):
+        if not self.user_exists(uid, identity):
             raise Exception('Trying to delete image to a user that does not exists!')
-        if not self.image_exists(image_id):
+        if not self.image_exists(image_id, identity):
+            return
+
+        image_ref = self._db.collection(DBService._IMAGES_COLLECTION).document(image_id)
+        self._commit_in_batches([lambda batch: batch.delete(image_ref)] + self._counter_writes(images=-1))
+
+    def delete_images(self, uid: str, image_ids: list[str], identity: IdentityContext = None) -> None:
+        """
+        Deletes the documents of many images, in batched writes - like undoing add_images for images whose files failed
+        to upload.
+
+        Images that do not exist, or are not owned by the user, are skipped. Albums whose cover image is one of the
+        deleted images get another cover, in the same batches.
+
+        :param uid: User id which requests to delete the images.
+        :param image_ids: The ids of the images to delete.
+        :param identity: The identity context of the request.
+        """
+        if not image_ids:
             return
+        snapshots = self._get_documents(DBService._IMAGES_COLLECTION, image_ids, identity)
+        images = [i for i in snapshots.values() if i.exists and i.to_dict().get('owner_id') == uid]
+
+        removed_from = {}  # album id -> the ids of the deleted images it contained
+        for image in images:
+            for album_id in image.to_dict().get('containing_albums') or []:
+                removed_from.setdefault(album_id, set()).add(image.id)
+        albums = self._get_documents(DBService._ALBUMS_COLLECTION, list(removed_from), identity)
+        cover_writes = [write for album in albums.values() if album.exists
+                        for write in self._replace_cover_writes(album, removed_from[album.id], identity)]
 
-        self._db.collection(DBService._IMAGES_COLLECTION).document(image_id).delete()
+        self._commit_in_batches([lambda batch, image=image: batch.delete(image.reference) for image in images] +
+                                cover_writes + self._counter_writes(images=-len(images)))
 
     """ ADMIN """
 
-    def generate_statistics(self, uid: str) -> DBStatistics:
+    def generate_statistics(self, uid: str, identity: IdentityContext = None) -> DBStatistics:
         """
         Generates statistics of the system, and packs them in DBStatistics object.
 
         The uid must be at admin privilege level.
 
+        With materialized counters, the counts are read from them; else (or if they were never reconciled), the
+        collections are counted with count aggregation queries.
+
         :param uid: The id of the user making the request.
+        :param identity: The identity context of the request.
         :return: DBStatistics object.
         """
-        if self.get_privilege_level(uid) != 0:
+        if self.get_privilege_level(uid, identity) != 0:
             raise PermissionDeniedException("User does not have admin permission.")
 
-        users_count = len(self._db.collection(DBService._USERS_COLLECTION).get())
+        counts = self._counters.read(identity) if self._materialized_counters else None
+        if counts is None:
+            return self.reconcile_counters(identity) if self._materialized_counters else self._count_all(identity)
+
+        return DBStatistics(counts.get(DBService._USERS_COLLECTION, 0), counts.get(DBService._ALBUMS_COLLECTION, 0),
+                            counts.get(DBService._IMAGES_COLLECTION, 0))
+
+    def _count_all(self, identity: IdentityContext = None) -> DBStatistics:
+        """
+        Counts the users, albums and images with count aggregation queries.
+
+        :param identity: The identity context of the request.
+        :return: DBStatistics object.
+        """
+        users_count = DBService._count(self._db.collection(DBService._USERS_COLLECTION), identity)
         # count the non-admin users
-        # users_count = 0
-        # for user in self._db.collection(DBService._USERS_COLLECTION).get():
-        #     if user.get('privilege_level') != 0:
-        #         users_count += 1
-        albums_count = len(self._db.collection(DBService._ALBUMS_COLLECTION).get())
-        images_count = len(self._db.collection(DBService._IMAGES_COLLECTION).get())
+        # users_count = DBService._count(
+        #     self._db.collection(DBService._USERS_COLLECTION).where('privilege_level', '!=', 0), identity)
+        albums_count = DBService._count(self._db.collection(DBService._ALBUMS_COLLECTION), identity)
+        images_count = DBService._count(self._db.collection(DBService._IMAGES_COLLECTION), identity)
 
         return DBStatistics(users_count, albums_count, images_count)
 
-    def get_users_data(self, uid: str) -> list[UserData]:
+    def reconcile_counters(self, identity: IdentityContext = None) -> DBStatistics:
+        """
+        Rebuilds the materialized counters from scratch: counts the collections with count aggregation queries, and
+        resets the counters to the counts.
+
+        Run it when the counters are first enabled, and from time to time to correct drifts (from writes that raced
+        with a reconcile, or failed midway).
+
+        :param identity: The identity context of the request.
+        :return: DBStatistics object with the counts.
+        """
+        statistics = self._count_all(identity)
+        self._counters.reset({DBService._USERS_COLLECTION: statistics.users_count,
+                              DBService._ALBUMS_COLLECTION: statistics.albums_count,
+                              DBService._IMAGES_COLLECTION: statistics.images_count})
+        return statistics
+
+    def get_users_data(self, uid: str, identity: IdentityContext = None) -> list[UserData]:
         """
-        Returns the user data of all the non-admin users registered.
+        Returns the user data of all the users registered.
 
         :raises PermissionDeniedException: If uid does not have admin permission.
 
         :param uid: User id.
+        :param identity: The identity context of the request.
         :return: list of UserData objects
         """
-        if self.get_privilege_level(uid) != 0:
+        if self.get_privilege_level(uid, identity) != 0:
             raise PermissionDeniedException("User does not have admin permission.")
 
-        users_docs = self._db.collection(DBService._USERS_COLLECTION).get()
-        user_records = [
-            self.get_user_record(user.id)
-            for user in users_docs]
-
-        return [
-            UserData(uid=user.uid, display_name=user.display_name, email=user.email, photo_url=user.photo_url,
-                     privilege_level=self._db.collection(DBService._USERS_COLLECTION).document(user.uid).get().get(
-                         'privilege_level'))
-            for user in user_records
-        ]
+        return self._users_data(DBService._get_query(self._db.collection(DBService._USERS_COLLECTION), identity))
+
+    def get_users_page(self, uid: str, page_size: int, cursor: str = None,
+                       identity: IdentityContext = None) -> tuple[list[UserData], str | None]:
+        """
+        Returns the user data of a page of the users registered, ordered by their ids.
+
+        :raises PermissionDeniedException: If uid does not have admin permission.
+
+        :param uid: User id.
+        :param page_size: How many users to return.
+        :param cursor: The cursor returned with the previous page. None for the first page.
+        :param identity: The identity context of the request.
+        :return: list of UserData objects, and the cursor of the next page (None if this page is the last one).
+        """
+        if self.get_privilege_level(uid, identity) != 0:
+            raise PermissionDeniedException("User does not have admin permission.")
+
+        query = self._db.collection(DBService._USERS_COLLECTION).order_by(FieldPath.document_id()).limit(page_size)
+        if cursor is not None:
+            query = query.start_after({FieldPath.document_id(): cursor})
+        users_docs = DBService._get_query(query, identity)
+
+        next_cursor = users_docs[-1].id if len(users_docs) == page_size else None
+        return self._users_data(users_docs), next_cursor
+
+    def _users_data(self, users_docs: list) -> list[UserData]:
+        """
+        Builds the user data of users from their documents and their Firebase Auth records.
+
+        The records are looked up with auth.get_users, 100 users per call, several calls in parallel. The privilege
+        levels are taken from the documents. Users that have no Auth record fall back to the name and email stored in
+        their documents.
+
+        :param users_docs: The DocumentSnapshots of the users.
+        :return: list of UserData objects, in the order of users_docs.
+        """
+        uids = iter([user.id for user in users_docs])
+        chunks = iter(lambda: list(itertools.islice(uids, DBService._MAX_USERS_LOOKUP)), [])
+        records = {}
+        for result in self._users_lookup_executor.map(
+                lambda chunk: self._client.get_users([auth.UidIdentifier(i) for i in chunk]), chunks):
+            records.update((record.uid, record) for record in result.users)
+
+        users_data = []
+        for user in users_docs:
+            data = user.to_dict()
+            record = records.get(user.id)
+            users_data.append(
+                UserData(uid=user.id, display_name=record.display_name, email=record.email,
+                         photo_url=record.photo_url, privilege_level=data.get('privilege_level'))
+                if record is not None else
+                UserData(uid=user.id, display_name=data.get('name'), email=data.get('email'), photo_url=None,
+                         privilege_level=data.get('privilege_level')))
+        return users_data
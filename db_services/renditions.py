@@ -0,0 +1,113 @@
+import io
+import multiprocessing
+import threading
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+ORIGINAL = 'original'
+# The renditions generated for every image: name -> (the longest side, in pixels, JPEG quality)
+RENDITIONS = {
+    'preview': (1280, 85),
+    'thumbnail': (256, 80),
+}
+
+
+def rendition_path(uid: str, file_name: str, rendition: str = ORIGINAL) -> str:
+    """
+    Returns the path of an image's rendition in the storage - the originals are stored under "<uid>/", and the
+    renditions next to them under "<uid>/thumbs/<rendition>/".
+
+    :raises ValueError: If the rendition is unknown.
+
+    :param uid: The image's owner id.
+    :param file_name: The image's file name.
+    :param rendition: The rendition's name. Default to the original.
+    :return: The path.
+    """
+    if rendition == ORIGINAL:
+        return f"{uid}/{file_name}"
+    if rendition not in RENDITIONS:
+        raise ValueError(f"Unknown rendition: {rendition}")
+    return f"{uid}/thumbs/{rendition}/{file_name}"
+
+
+def render(data: bytes) -> dict[str, bytes]:
+    """
+    Renders the renditions of an image, decoding it once. Runs in the pipeline's worker processes.
+
+    :param data: The image's contents.
+    :return: dict of rendition name to its JPEG contents. Empty if the image cannot be decoded - it is served in its
+    original only.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            largest = max(size for size, _ in RENDITIONS.values())
+            # JPEG images are decoded at the smallest scale (1/2, 1/4 or 1/8) still larger than the largest rendition
+            image.draft('RGB', (largest, largest))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+
+            renditions = {}
+            # from the largest rendition down, each one scaled from the previous one
+            for name, (size, quality) in sorted(RENDITIONS.items(), key=lambda i: -i[1][0]):
+                image.thumbnail((size, size), Image.Resampling.LANCZOS)
+                output = io.BytesIO()
+                image.save(output, 'JPEG', quality=quality, optimize=True)
+                renditions[name] = output.getvalue()
+            return renditions
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return {}
+
+
+class RenditionPipeline:
+    """
+    Renders the thumbnail and preview renditions of uploaded images (see RENDITIONS) in a pool of worker processes, so
+    the decoding and scaling run on all the cores instead of holding the GIL of the server's process.
+
+    Needs Pillow - without it, the pipeline is disabled and no renditions are generated.
+    """
+
+    def __init__(self, processes: int = None, enabled: bool = True):
+        """
+        Creates a RenditionPipeline. The worker processes are started on first use.
+
+        :param processes: How many worker processes to render in. Default to the number of CPU cores.
+        :param enabled: Whether to generate renditions. Default to True (if Pillow is installed).
+        """
+        self._processes = processes
+        self._enabled = enabled and Image is not None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether renditions are generated - requested, and Pillow is installed."""
+        return self._enabled
+
+    def render_many(self, images: Iterable[bytes | memoryview]) -> list[dict[str, bytes]]:
+        """
+        Renders the renditions of several images in parallel.
+
+        :param images: The images' contents.
+        :return: list of dict of rendition name to its contents, in the order of images. Empty if the pipeline is
+        disabled.
+        """
+        if not self._enabled:
+            return []
+        with self._lock:
+            if self._executor is None:
+                # spawned rather than forked, since the server's process runs the Firebase clients' threads
+                self._executor = ProcessPoolExecutor(max_workers=self._processes,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+        return list(self._executor.map(render, (bytes(i) for i in images)))
+
+    def close(self) -> None:
+        """Stops the worker processes."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -1,18 +1,101 @@
-from datetime import datetime, timedelta
+import io
+import itertools
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
 
 from firebase_admin import storage
+from google.api_core.exceptions import NotModified
+from requests.adapters import HTTPAdapter
+from google.cloud.storage import Blob
+
+from db_services.blob_cache import BlobCache
+from db_services.url_cache import SignedUrlCache
+from fotogo_networking.metrics import Metrics
+
+
+class _MemoryReader(io.RawIOBase):
+    """
+    A read-only, seekable file over contents in memory. Unlike io.BytesIO, it does not copy the contents whole when it
+    is created - only the parts that are read are copied, as they are read.
+    """
+
+    def __init__(self, data: bytes | bytearray | memoryview):
+        self._view = memoryview(data).cast('B')
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        start = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(0, start + offset)
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else min(len(self._view), self._position + size)
+        data = self._view[self._position:end].tobytes()
+        self._position = max(self._position, end)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
 
 
 class StorageService:
     """A service that manages Firebase Storage."""
+    _DOWNLOAD_THREADS = 32
+    _DELETE_THREADS = 8
+    _SIGN_THREADS = 4
+    _UPLOAD_THREADS = 8
+    _RESUMABLE_UPLOAD_SIZE = 8 * 1024 * 1024  # larger files are uploaded in resumable chunks, like the client does
+    _UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # a multiple of 256 KB, as resumable uploads require
+    _URL_LIFETIME = timedelta(hours=1)
+    _MAX_BATCH_DELETES = 100  # the most calls a single Cloud Storage batch request may hold
 
-    def __init__(self, app):
+    def __init__(self, app, cache_directory: str = None, cache_size: int = 1024 * 1024 * 1024,
+                 memory_cache_size: int = 0, url_refresh_margin: float = 300, metrics: Metrics = None):
         """
         Initializes the StorageService with a storage bucket.
 
         :param app: A Firebase application.
+        :param cache_directory: Directory to cache the downloaded blobs in (see BlobCache). None to not cache them.
+        Default to None.
+        :param cache_size: How many bytes of blobs the cache directory may hold. Default to 1 GB.
+        :param memory_cache_size: How many bytes of small blobs the cache also keeps in memory. Default to 0.
+        :param url_refresh_margin: How many seconds before a cached signed URL expires it is signed again (see
+        SignedUrlCache). Default to 300.
+        :param metrics: Metrics registry to report the caches' hits, misses and bytes saved into. Default to a private
+        registry.
         """
         self._bucket = storage.bucket(app=app)
+        self._cache = None
+        if cache_directory is not None:
+            self._cache = BlobCache(cache_directory, cache_size, memory_size=memory_cache_size, metrics=metrics)
+        self._urls = SignedUrlCache(refresh_margin=url_refresh_margin, metrics=metrics)
+        # requests keeps only 10 connections per host by default, so most parallel downloads would open (and throw
+        # away) a connection each - keep one for every thread that may use the client instead
+        adapter = HTTPAdapter(pool_maxsize=StorageService._DOWNLOAD_THREADS + StorageService._DELETE_THREADS +
+                                           StorageService._UPLOAD_THREADS)
+        self._bucket.client._http.mount('https://', adapter)
+        self._bucket.client._http.mount('http://', adapter)
+        self._download_executor = ThreadPoolExecutor(max_workers=StorageService._DOWNLOAD_THREADS,
+                                                     thread_name_prefix="storage-download")
+        self._delete_executor = ThreadPoolExecutor(max_workers=StorageService._DELETE_THREADS,
+                                                   thread_name_prefix="storage-delete")
+        self._sign_executor = ThreadPoolExecutor(max_workers=StorageService._SIGN_THREADS,
+                                                 thread_name_prefix="storage-sign")
+        self._upload_executor = ThreadPoolExecutor(max_workers=StorageService._UPLOAD_THREADS,
+                                                   thread_name_prefix="storage-upload")
 
     def upload_file(self, blob_path: str, file_path: str, content_type='image/jpg') -> None:
         """
@@ -23,16 +106,105 @@ class StorageService:
         :param content_type: The type of the file. Default to "image/jpg" - JPG image format.
         """
         self._bucket.blob(blob_path).upload_from_file(file_path, content_type=content_type)
+        self.__invalidate(blob_path)
+
+    def upload_bytes(self, blob_path: str, data: bytes | bytearray | memoryview, content_type='image/jpg',
+                     timeout: float = None) -> None:
+        """
+        Uploads contents from memory to the storage, without writing them to a file first.
+
+        Contents larger than 8 MB are sent in a resumable upload, in chunks of 8 MB, so a failed chunk is retried
+        alone instead of the whole file. The contents are read in place - each request copies only the part of them
+        it sends.
+
+        :param blob_path: The path in the storage in which to store the contents.
+        :param data: The contents to upload.
+        :param content_type: The type of the contents. Default to "image/jpg" - JPG image format.
+        :param timeout: How many seconds to wait for the server on each request. None for the storage client's default
+        (60 seconds).
+        """
+        size = memoryview(data).nbytes
+        chunk_size = StorageService._UPLOAD_CHUNK_SIZE if size > StorageService._RESUMABLE_UPLOAD_SIZE else None
+        kwargs = dict(timeout=timeout) if timeout is not None else {}
+        self._bucket.blob(blob_path, chunk_size=chunk_size).upload_from_file(_MemoryReader(data), size=size,
+                                                                             content_type=content_type, **kwargs)
+        self.__invalidate(blob_path)
+
+    def upload_many(self, files: Iterable[tuple[str, bytes | bytearray | memoryview]],
+                    max_concurrency: int = _UPLOAD_THREADS, content_type='image/jpg',
+                    timeout: float = None) -> dict[str, Exception]:
+        """
+        Uploads many contents from memory to the storage, up to max_concurrency of them in parallel (see upload_bytes).
+
+        The files are consumed lazily, so at most max_concurrency contents are held by the uploads at a time. A failed
+        upload does not stop the others - the failures are returned instead, so the caller can undo what it wrote for
+        them.
+
+        :param files: (blob path, contents) pairs to upload.
+        :param max_concurrency: How many uploads may run at the same time. At most the number of upload threads (8),
+        which is the default.
+        :param content_type: The type of the contents. Default to "image/jpg" - JPG image format.
+        :param timeout: See upload_bytes.
+        :return: dict of the blob paths that failed to upload to their errors. Empty if all the uploads succeeded.
+        """
+        failures = {}
+        running = {}
+
+        def collect():
+            """Waits for at least one of the running uploads to finish, and records its failure."""
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                blob_path = running.pop(future)
+                if future.exception() is not None:
+                    failures[blob_path] = future.exception()
+
+        for blob_path, data in files:
+            while len(running) >= max_concurrency:
+                collect()
+            running[self._upload_executor.submit(self.upload_bytes, blob_path, data, content_type, timeout)] = blob_path
+        while running:
+            collect()
+        return failures
 
     def get_file_url(self, blob_path: str) -> str:
         """
-        Generates a signed URL to a blob.
+        Generates a signed URL to a blob, valid for an hour.
+
+        URLs are cached, and reused until shortly before they expire, since every signature is an RSA operation.
+
+        :param blob_path: Path to the blob.
+        :return: URL: str
+        """
+        url = self._urls.get(blob_path)
+        return url if url is not None else self.__sign(blob_path)
+
+    def get_files_urls(self, blob_paths: Iterable[str]) -> list[str]:
+        """
+        Generates signed URLs to several blobs, signing the ones that are not cached in parallel.
+
+        :param blob_paths: Paths to the blobs.
+        :return: list of URLs, in the order of blob_paths.
+        """
+        paths = list(blob_paths)
+        urls = [self._urls.get(path) for path in paths]
+        misses = {path for path, url in zip(paths, urls) if url is None}
+        if len(misses) > 1:
+            signed = dict(zip(misses, self._sign_executor.map(self.__sign, misses)))
+        else:
+            signed = {path: self.__sign(path) for path in misses}
+        return [url if url is not None else signed[path] for path, url in zip(paths, urls)]
+
+    def __sign(self, blob_path: str) -> str:
+        """
+        Signs a URL to a blob, and caches it.
 
         :param blob_path: Path to the blob.
         :return: URL: str
         """
-        return self._bucket.blob(blob_path).generate_signed_url(
-            datetime.now() + timedelta(hours=1))  # one HOUR expiration time (in Israel time zone UTC+3)
+        expires_at = datetime.now(timezone.utc) + StorageService._URL_LIFETIME
+        url = self._bucket.blob(blob_path).generate_signed_url(expires_at)
+        self._urls.put(blob_path, url, expires_at)
+        return url
 
     def download_file(self, blob_path: str, file_name: str):
         """
@@ -44,15 +216,107 @@ class StorageService:
         """
         return self._bucket.blob(blob_path).download_to_filename(file_name)
 
-    def get_file_bytes(self, blob_path: str) -> bytes:
+    def get_file_bytes(self, blob_path: str, timeout: float = None) -> bytes:
         """
-        Get the contents of a blob, in bytes.
+        Get the contents of a blob, in bytes - from the blob cache, if there is one.
 
         :param blob_path: Path of the blob to get.
+        :param timeout: How many seconds to wait for the server to connect and to send the contents. None for the
+        storage client's default (60 seconds).
         :return: File contents as bytes.
         """
+        if self._cache is not None:
+            return self._cache.get(blob_path, lambda generation: self.__download(blob_path, timeout, generation))
+        return self.__download(blob_path, timeout)[0]
+
+    def __download(self, blob_path: str, timeout: float = None,
+                   cached_generation: int = None) -> tuple[bytes | None, int | None]:
+        """
+        Downloads a blob.
+
+        :param blob_path: Path of the blob to download.
+        :param timeout: See get_file_bytes.
+        :param cached_generation: The generation of the blob's cached contents. If the blob is still at that
+        generation, it is not downloaded again. None to download it anyway.
+        :return: The blob's contents (None if it is still at cached_generation), and its generation.
+        """
+        blob = self._bucket.blob(blob_path)
+        kwargs = dict(timeout=timeout) if timeout is not None else {}
+        if cached_generation is not None:
+            kwargs['if_generation_not_match'] = cached_generation
+        try:
+            data = blob.download_as_bytes(**kwargs)
+        except NotModified:
+            return None, cached_generation
+        return data, int(blob.generation) if blob.generation is not None else None
+
+    def get_files_bytes(self, blob_paths: Iterable[str], max_concurrency: int = _DOWNLOAD_THREADS,
+                        timeout: float = None) -> list[bytes]:
+        """
+        Gets the contents of several blobs, in bytes, downloading up to max_concurrency of them in parallel.
+
+        All the files are held in memory until they are returned - use iter_files_bytes to stream many large files.
+
+        :raises Exception: The error of the first download that failed (or timed out). The downloads that did not
+        start yet are cancelled.
+
+        :param blob_paths: Paths of the blobs to get.
+        :param max_concurrency: How many downloads may run at the same time. At most the number of download threads
+        (32), which is the default.
+        :param timeout: How many seconds to wait for the server on each blob (see get_file_bytes). None for the storage
+        client's default.
+        :return: list of the files' contents as bytes, in the order of blob_paths.
+        """
+        paths = list(blob_paths)
+        results: list[bytes | None] = [None] * len(paths)
+        running = {}
+
+        def collect():
+            """Waits for at least one of the running downloads to finish, and stores its contents."""
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+        try:
+            for index, path in enumerate(paths):
+                while len(running) >= max_concurrency:
+                    collect()
+                running[self._download_executor.submit(self.get_file_bytes, path, timeout)] = index
+            while running:
+                collect()
+        finally:
+            for future in running:
+                future.cancel()
+        return results
+
+    def iter_files_bytes(self, blob_paths: Iterable[str], prefetch: int = 2) -> Iterator[bytes]:
+        """
+        Lazily gets the contents of several blobs, in bytes, in the order of blob_paths.
+
+        Keeps up to prefetch downloads running ahead of the consumer, so at most prefetch + 1 files are held in memory
+        at a time, no matter how many paths there are.
+
+        :param blob_paths: Paths of the blobs to get.
+        :param prefetch: How many downloads to run ahead of the consumer. Default to 2.
+        :return: Iterator of the files' contents as bytes.
+        """
+        paths = iter(blob_paths)
+        pending = deque()
+        for path in paths:
+            pending.append(self._download_executor.submit(self.get_file_bytes, path))
+            if len(pending) >= prefetch:
+                break
 
-        return self._bucket.blob(blob_path).download_as_bytes()
+        try:
+            while pending:
+                data = pending.popleft().result()
+                next_path = next(paths, None)
+                if next_path is not None:
+                    pending.append(self._download_executor.submit(self.get_file_bytes, next_path))
+                yield data
+        finally:
+            for future in pending:
+                future.cancel()
 
     def delete_file(self, blob_path: str) -> None:
         """
@@ -62,14 +326,100 @@ class StorageService:
         """
         if self._bucket.blob(blob_path).exists():
             self._bucket.blob(blob_path).delete()
+        self.__invalidate(blob_path)
+
+    def delete_files(self, blob_paths: Iterable[str]) -> int:
+        """
+        Deletes many blobs, in batch requests (see delete_blobs). Blobs that do not exist are ignored.
+
+        :param blob_paths: Paths to the blobs to delete.
+        :return: How many blobs were deleted.
+        """
+        return self.delete_blobs(self._bucket.blob(blob_path) for blob_path in blob_paths)
 
-    def delete_directory(self, directory_path: str) -> None:
+    def list_files(self, prefix: str = None) -> Iterator[str]:
         """
-        Deletes a directory in the bucket by looping over all the files in the directory and deleting each one of them.
+        Lists the paths of the blobs in the bucket, a page at a time.
+
+        :param prefix: Only list the blobs whose paths start with it. None to list all of them.
+        :return: Iterator of the blobs' paths.
+        """
+        return (blob.name for blob in self._bucket.list_blobs(prefix=prefix))
+
+    def delete_directory(self, directory_path: str, on_progress: Callable[[int], None] = None) -> int:
+        """
+        Deletes a directory in the bucket by deleting all the files in the directory.
         When the folder will be emptied, it will automatically delete itself.
 
+        The files are listed a page at a time, and deleted in batch requests of up to 100 deletes each, several batches
+        in parallel (see delete_blobs).
+
         :param directory_path: The path to the directory.
-        :return: None
+        :param on_progress: Called with how many files were deleted so far, after every batch.
+        :return: How many files were deleted.
+        """
+        deleted = self.delete_blobs(self._bucket.list_blobs(prefix=directory_path), on_progress)
+        self._urls.invalidate_directory(directory_path)
+        if self._cache is not None:
+            self._cache.invalidate_directory(directory_path)
+        return deleted
+
+    def delete_blobs(self, blobs: Iterable[Blob], on_progress: Callable[[int], None] = None) -> int:
+        """
+        Deletes many blobs, in batch requests of up to 100 deletes each, several batches in parallel.
+
+        At most twice as many batches as there are delete threads are held in memory at a time, no matter how many
+        blobs there are. Blobs that no longer exist are ignored.
+
+        :param blobs: The blobs to delete. Consumed lazily.
+        :param on_progress: Called with how many blobs were deleted so far, after every batch.
+        :return: How many blobs were deleted.
+        """
+        deleted = 0
+        pending = deque()
+        blobs = iter(blobs)
+        chunks = iter(lambda: list(itertools.islice(blobs, StorageService._MAX_BATCH_DELETES)), [])
+        try:
+            for chunk in chunks:
+                pending.append(self._delete_executor.submit(self.__delete_batch, chunk))
+                while pending and (len(pending) >= StorageService._DELETE_THREADS * 2 or pending[0].done()):
+                    deleted += pending.popleft().result()
+                    if on_progress is not None:
+                        on_progress(deleted)
+            while pending:
+                deleted += pending.popleft().result()
+                if on_progress is not None:
+                    on_progress(deleted)
+        finally:
+            for future in pending:
+                future.cancel()
+        return deleted
+
+    def __delete_batch(self, blobs: list[Blob]) -> int:
+        """
+        Deletes blobs in a single batch request.
+
+        :param blobs: The blobs to delete, up to 100 of them.
+        :return: The number of blobs in the batch.
+        """
+        # batches are tracked per thread by the storage client, so each delete thread has its own
+        with self._bucket.client.batch(raise_exception=False) as batch:
+            for blob in blobs:
+                blob.delete()
+        for blob in blobs:
+            self.__invalidate(blob.name)
+        # the batch only raises the last failure, so the responses are checked to let missing blobs through
+        for response in batch._responses:
+            if not response.ok and response.status_code != 404:
+                raise ConnectionError(f"Deleting a blob failed with status {response.status_code}")
+        return len(blobs)
+
+    def __invalidate(self, blob_path: str) -> None:
+        """
+        Drops a blob that was deleted or overwritten from the caches.
+
+        :param blob_path: Path of the blob.
         """
-        for blob in self._bucket.list_blobs(prefix=directory_path):
-            blob.delete()
+        self._urls.invalidate(blob_path)
+        if self._cache is not None:
+            self._cache.invalidate(blob_path)
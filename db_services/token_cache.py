@@ -0,0 +1,133 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from fotogo_networking.metrics import Metrics
+
+# The certificates Firebase ID tokens are signed with (firebase_admin._token_gen.ID_TOKEN_CERT_URI)
+ID_TOKEN_CERT_URI = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+_MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+
+
+class VerifiedTokenCache:
+    """
+    A bounded LRU cache of ID tokens whose signature was already verified, mapping each token to its user id.
+
+    A token is only served from the cache until its "exp" claim - after that, it is verified again (and rejected as
+    expired). Tokens that failed verification are never cached.
+    """
+
+    def __init__(self, max_size: int = 10000, metrics: Metrics = None):
+        """
+        Creates a VerifiedTokenCache.
+
+        :param max_size: How many tokens the cache holds before evicting the least recently used one. Default to 10000.
+        :param metrics: Metrics registry to report the hit rate and size into. None to not report them.
+        """
+        self._max_size = max_size
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+        if metrics is not None:
+            metrics.register_gauge('auth.token_cache.size', lambda: len(self._entries))
+            metrics.register_gauge('auth.token_cache.hit_rate', self.__hit_rate)
+
+    def get(self, id_token: str) -> str | None:
+        """
+        Returns the user id of a verified token, if it is cached and has not expired.
+
+        :param id_token: The token.
+        :return: User id, or None on a cache miss.
+        """
+        with self._lock:
+            entry = self._entries.get(id_token)
+            if entry is not None and entry[1] <= time.time():
+                del self._entries[id_token]
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(id_token)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, id_token: str, uid: str, expires_at: float) -> None:
+        """
+        Caches a verified token.
+
+        :param id_token: The token.
+        :param uid: The user id the token belongs to.
+        :param expires_at: The token's "exp" claim (seconds since the epoch).
+        """
+        with self._lock:
+            self._entries[id_token] = (uid, expires_at)
+            self._entries.move_to_end(id_token)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def __hit_rate(self) -> float:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return self._hits / lookups if lookups else 0
+
+
+class CertificateRefresher:
+    """
+    Keeps the Google certificates that sign ID tokens fresh in firebase_admin's certificate cache, so verifying a token
+    never waits for a certificate fetch.
+
+    firebase_admin fetches the certificates through an HTTP session that caches them for as long as their Cache-Control
+    max-age allows, and fetches them again on the first verification after that. A background thread fetches them
+    at startup and then again before every expiry, bypassing the cached copy.
+    """
+
+    def __init__(self, request, refresh_ratio: float = 0.8, retry_interval: float = 60, logger=None):
+        """
+        Creates a CertificateRefresher. The background thread is started by start().
+
+        :param request: The google.auth transport firebase_admin verifies tokens with (its CertificateFetchRequest).
+        :param refresh_ratio: The part of the certificates' max-age after which they are refreshed. Default to 0.8.
+        :param retry_interval: How many seconds to wait before retrying a failed fetch. Default to 60.
+        :param logger: Logger object to report failed fetches to. None to not report them.
+        """
+        self._request = request
+        self._refresh_ratio = refresh_ratio
+        self._retry_interval = retry_interval
+        self._logger = logger
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self.__run, name="certificate-refresher", daemon=True)
+
+    def start(self) -> None:
+        """Starts the background thread, which fetches the certificates right away."""
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the background thread."""
+        self._stopped.set()
+
+    def refresh(self) -> float:
+        """
+        Fetches the certificates, bypassing (and replacing) the cached copy.
+
+        :return: How many seconds until the certificates should be refreshed again.
+        """
+        response = self._request(ID_TOKEN_CERT_URI, method='GET', headers={'Cache-Control': 'no-cache'})
+        if response.status != 200:
+            raise ConnectionError(f"Fetching the ID token certificates failed with status {response.status}")
+        max_age = _MAX_AGE_PATTERN.search(response.headers.get('cache-control', ''))
+        return int(max_age.group(1)) * self._refresh_ratio if max_age else self._retry_interval
+
+    def __run(self):
+        """Refreshes the certificates before they expire, until stopped."""
+        while not self._stopped.is_set():
+            try:
+                delay = self.refresh()
+            except Exception as e:
+                if self._logger is not None:
+                    self._logger.error(f"Refreshing the ID token certificates failed: {e}")
+                delay = self._retry_interval
+            self._stopped.wait(delay)
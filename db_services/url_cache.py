@@ -0,0 +1,90 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from fotogo_networking.metrics import Metrics
+
+
+class SignedUrlCache:
+    """
+    A bounded LRU cache of signed URLs, keyed by blob path.
+
+    A URL is served until refresh_margin seconds before it expires - after that it is treated as a miss, so it is
+    signed again while clients still have time to use the old one.
+    """
+
+    def __init__(self, max_size: int = 100000, refresh_margin: float = 300, metrics: Metrics = None):
+        """
+        Creates a SignedUrlCache.
+
+        :param max_size: How many URLs the cache holds before evicting the least recently used one. Default to 100000.
+        :param refresh_margin: How many seconds before a URL expires it is signed again. Default to 300.
+        :param metrics: Metrics registry to report the hit rate and size into. None to not report them.
+        """
+        self._max_size = max_size
+        self._refresh_margin = refresh_margin
+        self._entries: OrderedDict[str, tuple[str, datetime]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+        if metrics is not None:
+            metrics.register_gauge('storage.url_cache.size', lambda: len(self._entries))
+            metrics.register_gauge('storage.url_cache.hit_rate', self.__hit_rate)
+
+    def get(self, blob_path: str) -> str | None:
+        """
+        Returns the signed URL of a blob, if it is cached and not about to expire.
+
+        :param blob_path: Path of the blob.
+        :return: The URL, or None on a cache miss.
+        """
+        with self._lock:
+            entry = self._entries.get(blob_path)
+            if entry is not None and (entry[1] - datetime.now(timezone.utc)).total_seconds() <= self._refresh_margin:
+                del self._entries[blob_path]
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(blob_path)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, blob_path: str, url: str, expires_at: datetime) -> None:
+        """
+        Caches a signed URL.
+
+        :param blob_path: Path of the blob.
+        :param url: The signed URL.
+        :param expires_at: When the URL expires (timezone-aware).
+        """
+        with self._lock:
+            self._entries[blob_path] = (url, expires_at)
+            self._entries.move_to_end(blob_path)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, blob_path: str) -> None:
+        """
+        Drops the URL of a blob, when the blob is deleted or overwritten.
+
+        :param blob_path: Path of the blob.
+        """
+        with self._lock:
+            self._entries.pop(blob_path, None)
+
+    def invalidate_directory(self, directory_path: str) -> None:
+        """
+        Drops the URLs of all the blobs under a directory.
+
+        :param directory_path: The path of the directory.
+        """
+        with self._lock:
+            for blob_path in [i for i in self._entries if i.startswith(directory_path)]:
+                del self._entries[blob_path]
+
+    def __hit_rate(self) -> float:
+        lookups = self._hits + self._misses
+        return self._hits / lookups if lookups else 0
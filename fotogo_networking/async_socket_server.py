@@ -0,0 +1,219 @@
+import asyncio
+import ssl
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fotogo_networking.logger import Fore
+from fotogo_networking.connection_context import ConnectionContext
+from fotogo_networking.data_transportation import *
+from fotogo_networking.request_type import PRIORITY_REQUEST_TYPES, RequestType
+from fotogo_networking.server_config import ServerConfig
+from fotogo_networking.tls import HandshakeMetrics, create_server_context
+from fotogo_networking.worker_pool import WorkerPool
+
+
+class AsyncSocketServer:
+    """
+    An asyncio-based socket server.
+
+    Connections are multiplexed on a single event loop instead of getting a thread each, while the blocking endpoint
+    calls (Framework.execute) run on a bounded WorkerPool, with the same load shedding as SocketServer. Speaks the same
+    protocol as SocketServer, including TLS termination.
+    """
+
+    def __init__(self, framework, config: ServerConfig):
+        self._config = config
+        self._address = config.address
+        self._keep_alive_timeout = config.keep_alive_timeout
+        self._max_requests_per_connection = config.max_requests_per_connection
+        self._max_pipelined_requests = config.max_pipelined_requests
+        self._framework = framework
+        self._worker_pool = WorkerPool(config.max_workers, config.max_queued_requests,
+                                       config.max_queued_priority_requests, framework.metrics)
+        # produces the frames of streamed responses, bounded apart from the worker pool and the loop's default executor
+        self._stream_executor = ThreadPoolExecutor(config.max_stream_workers, thread_name_prefix='fotogo-stream')
+        self._tls_context: ssl.SSLContext | None = None
+        self._handshake_metrics: HandshakeMetrics | None = None
+        if config.tls_certfile is not None:
+            self._tls_context = create_server_context(config)
+            self._handshake_metrics = HandshakeMetrics(framework.metrics, self._tls_context)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stop_event: asyncio.Event | None = None
+        self._started = threading.Event()
+        self._serving_thread: threading.Thread | None = None
+        self._startup_error: Exception | None = None
+        self._active = False
+
+    @property
+    def active(self) -> bool:
+        return self._active
+
+    def start(self, backlog: int = 1):
+        """
+        Starts the server.
+
+        Runs the event loop on a separate thread, so this call returns once the server is listening, the same way
+        SocketServer.start does.
+
+        :param backlog: How many backlogged clients are allowed (how many clients can wait in queue until they are
+        accepted). Default to 1.
+        """
+        self._worker_pool.start()
+        self._serving_thread = threading.Thread(target=asyncio.run, args=[self.__serve(backlog)])
+        self._serving_thread.start()
+        self._started.wait()
+        if self._startup_error is not None:
+            raise self._startup_error
+
+        self._active = True
+        self._framework.logger.info(f"Server is online (asyncio). Listening on port {self._address[1]}", Fore.CYAN)
+
+    async def __serve(self, backlog: int):
+        """Listens for clients until stop() is called."""
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        try:
+            server = await asyncio.start_server(self.__connection_handler, self._address[0], self._address[1],
+                                                backlog=backlog, reuse_port=self._config.reuse_port or None,
+                                                ssl=self._tls_context,
+                                                ssl_handshake_timeout=self._config.tls_handshake_timeout
+                                                if self._tls_context is not None else None)
+        except Exception as e:
+            self._startup_error = e
+            self._started.set()
+            return
+
+        self._started.set()
+        async with server:
+            await self._stop_event.wait()
+
+    async def __connection_handler(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Handles a client that connected to the server.
+
+        Passes the client's requests to Framework on the worker pool, and sends the responses back to the client.
+        If the client asked for keep-alive, keeps reading requests from the connection until it is closed, stays idle
+        for keep_alive_timeout or reaches max_requests_per_connection. Pipelined requests are executed concurrently (up
+        to max_pipelined_requests at a time) and answered as soon as they are done, so their responses may arrive out
+        of order - the client matches them by their correlation id.
+
+        :param reader: Client's stream reader.
+        :param writer: Client's stream writer.
+        """
+        self._framework.logger.info("Client accepted")
+        if self._handshake_metrics is not None:
+            self._handshake_metrics.record(writer.get_extra_info('ssl_object'))
+        connection = ConnectionContext(self._config, self._framework.metrics)
+        in_flight = asyncio.Semaphore(self._max_pipelined_requests)
+        tasks = set()
+        try:
+            while True:
+                await in_flight.acquire()
+                id_token, request = await receive_request_async(
+                    reader, connection, self._keep_alive_timeout if connection.keep_alive else None)
+                if request is None:  # closed or idle
+                    in_flight.release()
+                    break
+                if not id_token:
+                    in_flight.release()
+                    writer.writelines(serialize_response(request, connection))
+                    self._framework.logger.info(request)
+                    break
+
+                connection.begin_request(request.keep_alive)
+                task = asyncio.create_task(self.__execute(id_token, request, connection, writer, in_flight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+                if not request.keep_alive or connection.requests_served >= self._max_requests_per_connection:
+                    break
+
+            if tasks:
+                await asyncio.gather(*tasks)
+            await writer.drain()
+            if writer.can_write_eof():  # TLS connections are ended by closing them, with a close_notify alert
+                writer.write_eof()
+        except ConnectionError:
+            self._framework.logger.error(
+                f"Connection closed unexpectedly with client: {writer.get_extra_info('peername')}")
+        except Exception as e:
+            self._framework.logger.error(str(e))
+        finally:
+            writer.close()
+
+    async def __execute(self, id_token: str, request: Request, connection: ConnectionContext,
+                        writer: asyncio.StreamWriter, in_flight: asyncio.Semaphore):
+        """
+        Executes a single request on the worker pool and writes its response to the client.
+
+        :param id_token: User's id token.
+        :param request: Request object.
+        :param connection: The context of the connection the request arrived on.
+        :param writer: Client's stream writer.
+        :param in_flight: The connection's semaphore of pipelined requests, released when the request is done.
+        """
+        try:
+            future = self._worker_pool.submit(self._framework.execute, id_token, request,
+                                              priority=request.type in PRIORITY_REQUEST_TYPES)
+            res: Response = await asyncio.wrap_future(future) if future is not None else \
+                Response(StatusCode.ServiceUnavailable_503)
+            res.correlation_id = request.correlation_id
+            if isinstance(res, StreamingResponse):
+                await self.__send_stream(res, connection, writer, request.type)
+            else:
+                writer.writelines(serialize_response(res, connection, request.type))
+                await writer.drain()
+            self._framework.logger.info(res)
+        except ConnectionError:
+            self._framework.logger.error(
+                f"Connection closed unexpectedly with client: {writer.get_extra_info('peername')}")
+        except Exception as e:
+            # an endpoint that raised is answered, so the client is not left waiting for its response
+            self._framework.logger.error(str(e))
+            res = Response(StatusCode.InternalServerError_500)
+            res.correlation_id = request.correlation_id
+            try:
+                writer.writelines(serialize_response(res, connection, request.type))
+                await writer.drain()
+            except ConnectionError:
+                pass
+        finally:
+            connection.release_memory(request.buffered_bytes)
+            in_flight.release()
+
+    async def __send_stream(self, response: StreamingResponse, connection: ConnectionContext,
+                            writer: asyncio.StreamWriter, request_type: RequestType = None):
+        """
+        Sends a StreamingResponse frame by frame.
+
+        The frames are produced (which may block, e.g. on downloads) on the bounded stream executor (see
+        ServerConfig.max_stream_workers), and a frame is only produced after the previous one was flushed to the client
+        - so a slow client cannot make the server buffer the whole stream.
+
+        :param response: StreamingResponse object to send.
+        :param connection: The context of the connection the response is sent on.
+        :param writer: Client's stream writer.
+        :param request_type: The type of the request the response answers, for the compression metrics.
+        """
+        frames = serialize_stream(response, connection, request_type)
+        try:
+            while (frame := await self._loop.run_in_executor(self._stream_executor, next, frames, None)) is not None:
+                writer.writelines(frame)
+                await writer.drain()
+        finally:
+            await self._loop.run_in_executor(self._stream_executor, frames.close)
+
+    def stop(self):
+        """
+        Stops the server.
+
+        Sets active to False, stops the event loop's server and waits for the queued endpoint calls to finish.
+        """
+        self._active = False
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+        if self._serving_thread is not None:
+            self._serving_thread.join()
+        self._worker_pool.shutdown()
+        self._stream_executor.shutdown()
+        self._framework.logger.info("Server has been shut down", Fore.CYAN)
@@ -0,0 +1,92 @@
+from fotogo_networking.frame_codecs import Codec, JSON_CODEC
+from fotogo_networking.frame_compression import Compressor
+from fotogo_networking.metrics import Metrics
+from fotogo_networking.server_config import ServerConfig
+
+
+class ConnectionContext:
+    """
+    Holds the state of one client connection, shared by all the requests that arrive on it.
+
+    A connection starts in the classic one-request mode: the response is sent as-is, and the end of the response is
+    marked by closing the write side of the socket. If the first request asks for keep-alive, the connection becomes
+    persistent: every response is sent as a length-prefixed frame (like requests are) and the connection stays open
+    for more requests.
+
+    The format of the first request also decides the format of the responses: JSON-only for clients that send JSON
+    objects, binary frames (header + raw attachments) in the codec of the first frame for clients that send binary
+    frames. Responses on binary connections are always length-prefixed. A binary first frame may also pick a
+    compression, which the server then applies to the large sections of its responses.
+
+    Also accounts for the memory held by the connection's request frames, so large or pipelined uploads are spilled
+    to disk instead of growing the server's memory without a bound.
+    """
+
+    def __init__(self, config: ServerConfig = None, metrics: Metrics = None):
+        """
+        Creates a ConnectionContext for a newly accepted connection.
+
+        :param config: The ServerConfig with the connection's frame limits. Default to ServerConfig().
+        :param metrics: The Metrics registry to record the connection's compression metrics in. None to not record them.
+        """
+        if config is None:
+            config = ServerConfig()
+        self.keep_alive = False
+        self.binary: bool | None = None  # decided by the first request
+        self.codec: Codec = JSON_CODEC  # decided by the first request
+        self.compressor: Compressor | None = None  # decided by the first request
+        self.compression_threshold = config.compression_threshold
+        self.metrics = metrics
+        self.requests_served = 0
+        self.memory_in_use = 0
+        self.max_frame_size = config.max_frame_size
+        self.spill_threshold = config.spill_threshold
+        self.memory_budget = config.connection_memory_budget
+        self.spill_directory = config.spill_directory
+
+    @property
+    def framed(self) -> bool:
+        """
+        Whether responses on this connection are sent with a 4-byte length prefix.
+
+        :return: bool
+        """
+        return self.keep_alive or bool(self.binary)
+
+    def begin_request(self, keep_alive: bool) -> None:
+        """
+        Registers a new request that arrived on the connection.
+
+        The keep-alive mode of the connection is decided by its first request.
+
+        :param keep_alive: Whether the request asked to keep the connection open.
+        """
+        if self.requests_served == 0:
+            self.keep_alive = keep_alive
+        self.requests_served += 1
+
+    def reserve_memory(self, size: int) -> bool:
+        """
+        Reserves memory for a request frame of the given size, if it should be held in memory.
+
+        :param size: The frame size in bytes.
+        :return: True if the frame may be received into memory, False if it should be spilled to disk.
+        """
+        if size > self.spill_threshold or self.memory_in_use + size > self.memory_budget:
+            return False
+        self.memory_in_use += size
+        return True
+
+    def release_memory(self, size: int) -> None:
+        """
+        Releases memory that was reserved for a request frame, once its request is done.
+
+        :param size: The frame size in bytes, as reserved by reserve_memory.
+        """
+        self.memory_in_use -= size
+
+    def __repr__(self):
+        return f"ConnectionContext(keep_alive: {self.keep_alive}, binary: {self.binary}, codec: {self.codec.name}, " \
+               f"compressor: {self.compressor.name if self.compressor is not None else None}, " \
+               f"requests_served: {self.requests_served}, " \
+               f"memory_in_use: {self.memory_in_use})"
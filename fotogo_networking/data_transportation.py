@@ -1,59 +1,524 @@
-import json
+import asyncio
+import mmap
 import ssl
+import struct
+import tempfile
+import time
+from collections.abc import Iterator
 from ssl import SSLSocket
 
+from fotogo_networking.connection_context import ConnectionContext
+from fotogo_networking.frame_codecs import BytesLike, Codec, JSON_CODEC, get_codec
+from fotogo_networking.frame_compression import Compressor, get_compressor, is_compressed_format
 from fotogo_networking.request import Request
-from fotogo_networking.response import Response
+from fotogo_networking.request_type import RequestType
+from fotogo_networking.response import Response, StreamingResponse
+from fotogo_networking.server_config import MAX_PAYLOAD_LENGTH
 from fotogo_networking.status_code import StatusCode
 
-MAX_PAYLOAD_LENGTH = int.from_bytes(b'\xff\xff\xff\xff', "big")  # 4294967295 | 4,294,967,295 bytes
-MAX_PACKET_READ_LENGTH = 16384
+SPILL_READ_LENGTH = 1024 * 1024  # chunk size used when receiving a frame into a temporary file
 
+# Binary frames carry a JSON header followed by raw binary attachments, instead of base64 strings inside the JSON.
+# Layout (after the 4-byte length prefix every frame has):
+#   prologue:         magic (3 bytes) | version (1 byte) | flags (1 byte) | header length (4 bytes) |
+#                     attachments count (2 bytes)
+#   attachment table: attachment length (4 bytes) | attachment flags (1 byte) - for each attachment
+#   header:           object encoded by the frame's codec - the same object a JSON-only frame holds
+#   attachments:      the attachments' bytes, one after the other
+# The low 3 bits of the flags byte are the id of the codec the header is encoded with (see frame_codecs).
+# Bits 3-4 of the flags byte are the id of the compression the sender accepts (see frame_compression); bit 5 is set if
+# the header is compressed with it. Bit 0 of an attachment's flags is set if the attachment is compressed with it.
+# Inside the header, an attachment is referenced by its index: {"$attachment": <index>}.
+# Legacy frames are a bare JSON object, which can never start with the magic's NUL byte.
+BINARY_FRAME_MAGIC = b'\x00FG'
+BINARY_FRAME_VERSION = 1
+ATTACHMENT_REFERENCE_KEY = '$attachment'
+_BINARY_FRAME_PROLOGUE = struct.Struct('!3sBBIH')
+_ATTACHMENT_ENTRY = struct.Struct('!IB')
+_CODEC_MASK = 0x07
+_COMPRESSION_SHIFT = 3
+_COMPRESSION_MASK = 0x03
+_HEADER_COMPRESSED = 0x20
+_ATTACHMENT_COMPRESSED = 0x01
+_MAX_COALESCED_LENGTH = 64 * 1024
 
-def send_response(response: Response, sender: SSLSocket) -> bool:
+# values of the "stream" field of a StreamingResponse's frames
+STREAM_BEGIN = 'begin'
+STREAM_ITEM = 'item'
+STREAM_END = 'end'
+
+
+def _extract_attachments(obj, attachments: list[memoryview]):
     """
-    Accepts Response() object, parses it into bytes and sends it over the sender socket.
+    Replaces every bytes-like object inside a JSON-like structure with an attachment reference.
 
-    :param response: Response object to send back to the client.
-    :param sender: Sender socket (client socket).
-    :return: If the data was sent successfully.
+    :param obj: The structure (dicts, lists and values).
+    :param attachments: List to append the extracted attachments to.
+    :return: A copy of obj with the bytes-like objects replaced.
+    """
+    if isinstance(obj, BytesLike):
+        attachments.append(memoryview(obj))
+        return {ATTACHMENT_REFERENCE_KEY: len(attachments) - 1}
+    if isinstance(obj, dict):
+        return {k: _extract_attachments(v, attachments) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_extract_attachments(v, attachments) for v in obj]
+    return obj
+
+
+def _resolve_attachments(obj, attachments: list[memoryview]):
+    """
+    Replaces every attachment reference inside a JSON-like structure with the attachment it references.
+
+    :param obj: The structure (dicts, lists and values), as parsed from a binary frame's header.
+    :param attachments: The frame's attachments.
+    :return: obj, with the references replaced in place.
+    """
+    if isinstance(obj, dict):
+        if len(obj) == 1 and ATTACHMENT_REFERENCE_KEY in obj:
+            return attachments[obj[ATTACHMENT_REFERENCE_KEY]]
+        for k, v in obj.items():
+            obj[k] = _resolve_attachments(v, attachments)
+    elif isinstance(obj, list):
+        for i, v in enumerate(obj):
+            obj[i] = _resolve_attachments(v, attachments)
+    return obj
+
+
+def _compress(data: BytesLike, compressor: Compressor, threshold: int) -> tuple[BytesLike, bool]:
+    """
+    Compresses a section of a binary frame, if it is worth it.
+
+    Sections shorter than the threshold, files that are already compressed (like JPEG images), and sections that do not
+    shrink are left as they are.
+
+    :param data: The section's bytes.
+    :param compressor: The compressor of the connection.
+    :param threshold: The shortest section (in bytes) that is compressed.
+    :return: The bytes to send, and whether they are compressed.
+    """
+    if len(data) < threshold or is_compressed_format(data):
+        return data, False
+    compressed = compressor.compress(data)
+    if len(compressed) >= len(data):
+        return data, False
+    return compressed, True
+
+
+def _serialize_binary_frame(header: dict, codec: Codec, compressor: Compressor = None,
+                            compression_threshold: int = 0) -> tuple[list[BytesLike], int]:
+    """
+    Serializes a header object into a binary frame, moving the bytes-like objects inside it to attachments.
+
+    :param header: The object to send.
+    :param codec: The codec to encode the header with.
+    :param compressor: The compressor to compress the header and attachments with. None to send them uncompressed.
+    :param compression_threshold: The shortest header or attachment (in bytes) that is compressed. Default to 0.
+    :return: The frame's pieces (without the length prefix), to be sent one after the other, and the length the frame
+    would have had without compression.
+    """
+    attachments = []
+    header = _extract_attachments(header, attachments)
+    header_bytes = codec.encode(header)
+    uncompressed_length = len(header_bytes) + sum(len(attachment) for attachment in attachments)
+
+    flags = codec.codec_id & _CODEC_MASK
+    attachment_flags = [0] * len(attachments)
+    if compressor is not None:
+        flags |= compressor.compression_id << _COMPRESSION_SHIFT
+        header_bytes, compressed = _compress(header_bytes, compressor, compression_threshold)
+        if compressed:
+            flags |= _HEADER_COMPRESSED
+        for i, attachment in enumerate(attachments):
+            attachments[i], compressed = _compress(attachment, compressor, compression_threshold)
+            if compressed:
+                attachment_flags[i] = _ATTACHMENT_COMPRESSED
+
+    head = [_BINARY_FRAME_PROLOGUE.pack(BINARY_FRAME_MAGIC, BINARY_FRAME_VERSION, flags, len(header_bytes),
+                                        len(attachments))]
+    head += [_ATTACHMENT_ENTRY.pack(len(attachment), attachment_flags[i]) for i, attachment in enumerate(attachments)]
+    head.append(header_bytes)
+    uncompressed_length += len(head[0]) + _ATTACHMENT_ENTRY.size * len(attachments)
+    return [b''.join(head)] + attachments, uncompressed_length
+
+
+def _parse_binary_frame(data: memoryview, max_decompressed_length: int = MAX_PAYLOAD_LENGTH) \
+        -> tuple[dict, Codec, Compressor | None]:
+    """
+    Parses a binary frame. Uncompressed attachments are exposed as memoryviews over the frame's buffer, without
+    copying; compressed ones are decompressed into memoryviews of their own.
+
+    :param data: The frame (without the length prefix).
+    :param max_decompressed_length: The longest a compressed header or attachment may grow to when decompressed.
+    Default to MAX_PAYLOAD_LENGTH.
+    :return: The header object, with its attachment references resolved, the codec it was encoded with, and the
+    compressor the sender accepts (None if it accepts no compression).
+    """
+    magic, version, flags, header_length, attachments_count = _BINARY_FRAME_PROLOGUE.unpack_from(data)
+    if version != BINARY_FRAME_VERSION:
+        raise ValueError(f"Unsupported binary frame version: {version}")
+
+    codec = get_codec(flags & _CODEC_MASK)
+    compressor = get_compressor((flags >> _COMPRESSION_SHIFT) & _COMPRESSION_MASK)
+    if compressor is None and flags & _HEADER_COMPRESSED:
+        raise ValueError("Compressed header without a compression id.")
+
+    offset = _BINARY_FRAME_PROLOGUE.size
+    attachment_entries = []
+    for _ in range(attachments_count):
+        attachment_entries.append(_ATTACHMENT_ENTRY.unpack_from(data, offset))
+        offset += _ATTACHMENT_ENTRY.size
+
+    header_bytes = data[offset:offset + header_length]
+    if flags & _HEADER_COMPRESSED:
+        header_bytes = compressor.decompress(header_bytes, max_decompressed_length)
+    header = codec.decode(header_bytes)
+    offset += header_length
+
+    attachments = []
+    for length, attachment_flags in attachment_entries:
+        if offset + length > len(data):
+            raise ValueError("Attachment exceeds the frame.")
+        attachment = data[offset:offset + length]
+        if attachment_flags & _ATTACHMENT_COMPRESSED:
+            if compressor is None:
+                raise ValueError("Compressed attachment without a compression id.")
+            attachment = memoryview(compressor.decompress(attachment, max_decompressed_length))
+        attachments.append(attachment)
+        offset += length
+
+    return _resolve_attachments(header, attachments), codec, compressor
+
+
+def _record_compression(connection: ConnectionContext, request_type: RequestType | None, uncompressed_length: int,
+                        compressed_length: int, cpu_time: float) -> None:
+    """
+    Records the compression ratio and CPU time of a response frame in the connection's metrics, per request type.
+
+    :param connection: The context of the connection the frame is sent on.
+    :param request_type: The type of the request the frame answers. None if unknown (e.g. error responses).
+    :param uncompressed_length: The length the frame would have had without compression.
+    :param compressed_length: The length of the frame that is sent.
+    :param cpu_time: The CPU time (in seconds) it took to serialize and compress the frame.
+    """
+    metrics = connection.metrics
+    if metrics is None:
+        return
+    prefix = f'compression.{request_type.name if request_type is not None else "unknown"}'
+    metrics.increment(f'{prefix}.uncompressed_bytes', uncompressed_length)
+    metrics.increment(f'{prefix}.compressed_bytes', compressed_length)
+    metrics.observe(f'{prefix}.ratio', uncompressed_length / compressed_length if compressed_length else 1)
+    metrics.observe(f'{prefix}.cpu_seconds', cpu_time)
+
+
+def _serialize(obj: dict, connection: ConnectionContext, framed: bool,
+               request_type: RequestType = None) -> list[BytesLike]:
+    """
+    Serializes an object into a frame in the format of the connection.
+
+    :param obj: The object to send.
+    :param connection: The context of the connection the object is sent on.
+    :param framed: Whether to prefix the frame with its 4-byte length.
+    :param request_type: The type of the request the frame answers, for the compression metrics.
+    :return: The frame, as pieces to be sent one after the other.
+    """
+    if connection.binary and connection.compressor is not None:
+        start = time.thread_time()
+        pieces, uncompressed_length = _serialize_binary_frame(obj, connection.codec, connection.compressor,
+                                                              connection.compression_threshold)
+        _record_compression(connection, request_type, uncompressed_length, sum(len(piece) for piece in pieces),
+                            time.thread_time() - start)
+    elif connection.binary:
+        pieces, _ = _serialize_binary_frame(obj, connection.codec)
+    else:
+        pieces = [JSON_CODEC.encode(obj)]
+
+    if framed:
+        length_prefix = sum(len(piece) for piece in pieces).to_bytes(4, "big")
+        if len(pieces[0]) <= _MAX_COALESCED_LENGTH:  # avoid sending the 4-byte prefix in a packet of its own
+            return [length_prefix + pieces[0]] + pieces[1:]
+        return [length_prefix] + pieces
+    return pieces
+
+
+def serialize_response(response: Response, connection: ConnectionContext,
+                       request_type: RequestType = None) -> list[BytesLike]:
+    """
+    Parses a Response() object into the bytes that are sent to the client, in the format of the connection.
+
+    Bytes-like objects inside the payload are sent as binary attachments on binary connections, and as base64 strings
+    on JSON-only connections. Binary connections that negotiated compression get their large sections compressed.
+
+    :param response: Response object to serialize.
+    :param connection: The context of the connection the response is sent on.
+    :param request_type: The type of the request the response answers, for the compression metrics.
+    :return: The serialized response, as pieces to be sent one after the other.
     """
     response_dict = dict(
         status_code=response.status_code,
         payload=response.payload
     )
-    jsoned_response = json.dumps(response_dict)
+    if response.correlation_id is not None:
+        response_dict['correlation_id'] = response.correlation_id
+
+    return _serialize(response_dict, connection, connection.framed, request_type)
+
+
+def serialize_stream(response: StreamingResponse, connection: ConnectionContext,
+                     request_type: RequestType = None) -> Iterator[list[BytesLike]]:
+    """
+    Lazily serializes a StreamingResponse() object into its frames. Stream frames are always length-prefixed.
+
+    * Begin frame: {"stream": "begin", "status_code": ..., "payload": <header>}
+    * Item frames: {"stream": "item", "payload": <item>}
+    * End frame: {"stream": "end", "status_code": ...} - 500 if producing the items failed midway.
+
+    Every frame also holds the correlation id of the request, if it had one.
+
+    :param response: StreamingResponse object to serialize.
+    :param connection: The context of the connection the response is sent on.
+    :param request_type: The type of the request the response answers, for the compression metrics.
+    :return: Iterator of frames, each as pieces to be sent one after the other.
+    """
+    frame_base = dict(correlation_id=response.correlation_id) if response.correlation_id is not None else {}
+
+    yield _serialize(dict(frame_base, stream=STREAM_BEGIN, status_code=response.status_code,
+                          payload=response.payload), connection, True, request_type)
 
+    status_code = StatusCode.OK_200
     try:
-        sender.send(jsoned_response.encode())
+        for item in response.items:
+            yield _serialize(dict(frame_base, stream=STREAM_ITEM, payload=item), connection, True, request_type)
+    except GeneratorExit:
+        raise
+    except Exception:
+        status_code = StatusCode.InternalServerError_500
+
+    yield _serialize(dict(frame_base, stream=STREAM_END, status_code=status_code), connection, True, request_type)
+
+
+def parse_request(data: BytesLike, connection: ConnectionContext = None) -> tuple[str, Request]:
+    """
+    Parses the bytes of a request frame (without its length prefix) into a Request() object.
+
+    Both JSON-only frames and binary frames are accepted. The format (codec and compression) of the first request decides
+    the format of the connection's responses.
+
+    :param data: The request frame, as bytes.
+    :param connection: The context of the connection the request arrived on.
+    :return: id_token, Request()
+    """
+    view = memoryview(data)
+    binary = view[:len(BINARY_FRAME_MAGIC)] == BINARY_FRAME_MAGIC
+    if binary:
+        max_length = connection.max_frame_size if connection is not None else MAX_PAYLOAD_LENGTH
+        data_json, codec, compressor = _parse_binary_frame(view, max_length)
+    else:
+        data_json, codec, compressor = JSON_CODEC.decode(data), JSON_CODEC, None
+
+    if connection is not None and connection.binary is None:
+        connection.binary = binary
+        connection.codec = codec
+        connection.compressor = compressor
+
+    return data_json['id_token'], Request(data_json['request_id'], data_json['args'], data_json['payload'],
+                                          correlation_id=data_json.get('correlation_id'),
+                                          keep_alive=bool(data_json.get('keep_alive', False)))
+
+
+def send_response(response: Response, sender: SSLSocket, connection: ConnectionContext,
+                  request_type: RequestType = None) -> bool:
+    """
+    Accepts Response() object, parses it into bytes and sends it over the sender socket.
+    A StreamingResponse() is sent frame by frame, producing each frame only when the previous one was sent.
+
+    :param response: Response object to send back to the client.
+    :param sender: Sender socket (client socket).
+    :param connection: The context of the connection the response is sent on.
+    :param request_type: The type of the request the response answers, for the compression metrics.
+    :return: If the data was sent successfully.
+    """
+    try:
+        if isinstance(response, StreamingResponse):
+            for frame in serialize_stream(response, connection, request_type):
+                for piece in frame:
+                    sender.sendall(piece)
+            return True
+
+        for piece in serialize_response(response, connection, request_type):
+            sender.sendall(piece)
         return True
-    except ssl.SSLEOFError:
+    except (ssl.SSLEOFError, ConnectionError):
         return False
 
 
-def receive_request(sender: SSLSocket) -> tuple[str, Request] | tuple[bool, Response]:
+def _recv_into_memory(sender: SSLSocket, length: int) -> bytearray:
+    """
+    Receives exactly length bytes into a preallocated buffer, filled in place through a memoryview.
+
+    :param sender: The socket to receive from.
+    :param length: How many bytes to receive.
+    :return: bytearray
+    """
+    buffer = bytearray(length)
+    view = memoryview(buffer)
+    received = 0
+    while received < length:
+        read_amount = sender.recv_into(view[received:], length - received)
+        if read_amount == 0:
+            raise ConnectionError("Connection closed in the middle of a request.")
+        received += read_amount
+    return buffer
+
+
+def _recv_into_file(sender: SSLSocket, length: int, directory: str = None) -> memoryview:
+    """
+    Receives exactly length bytes into a temporary file, and maps the file back into memory read-only.
+
+    The file is unlinked right away, so it is removed once the returned view (and every slice of it) is released.
+
+    :param sender: The socket to receive from.
+    :param length: How many bytes to receive. Must be positive.
+    :param directory: Directory for the temporary file. Default to the system's temporary directory.
+    :return: memoryview over the mapped file.
+    """
+    chunk = bytearray(min(length, SPILL_READ_LENGTH))
+    chunk_view = memoryview(chunk)
+    with tempfile.TemporaryFile(dir=directory) as f:
+        received = 0
+        while received < length:
+            read_amount = sender.recv_into(chunk_view, min(len(chunk), length - received))
+            if read_amount == 0:
+                raise ConnectionError("Connection closed in the middle of a request.")
+            f.write(chunk_view[:read_amount])
+            received += read_amount
+        f.flush()
+        return memoryview(mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ))
+
+
+def receive_frame(sender: SSLSocket, length: int, connection: ConnectionContext) -> tuple[bytearray | memoryview, int]:
+    """
+    Receives the body of a request frame, whose length prefix was already read.
+
+    Frames that fit the connection's memory budget are received into memory without intermediate copies; larger
+    frames are spilled to a temporary file.
+
+    :param sender: The socket to receive from.
+    :param length: The length of the frame, as declared by its prefix.
+    :param connection: The context of the connection.
+    :return: The frame's bytes, and how many bytes of the connection's memory budget they hold.
+    """
+    if connection.reserve_memory(length):
+        try:
+            return _recv_into_memory(sender, length), length
+        except BaseException:
+            connection.release_memory(length)
+            raise
+    return _recv_into_file(sender, length, connection.spill_directory), 0
+
+
+def receive_request(sender: SSLSocket, connection: ConnectionContext) \
+        -> tuple[str, Request] | tuple[bool, Response] | tuple[bool, None]:
     """
     Receives bytes from the sender socket, parses it into Request() object and returns it.
 
+    The memory the request's frame holds is reserved in the connection's budget, and recorded in
+    Request.buffered_bytes - the caller releases it once the request is done.
+
     :param sender: The socket that sent the data.
-    :return: id_token, Request() (False, Response() in case of an error)
+    :param connection: The context of the connection.
+    :return: id_token, Request() (False, Response() in case of an error; False, None if the connection was closed, or
+    timed out, before a new request started)
     """
+    # read request length
+    try:
+        payload_length_bytes = b''
+        while len(payload_length_bytes) < 4:
+            read_data = sender.recv(4 - len(payload_length_bytes))
+            if not read_data:
+                break
+            payload_length_bytes += read_data
+    except (TimeoutError, ConnectionError):
+        return False, None
+    if not payload_length_bytes:
+        return False, None
+
+    buffered = 0
     try:
-        # read request length
-        payload_length_bytes = sender.recv(4)
         data_length = int.from_bytes(payload_length_bytes[0:4], "big")
+        if data_length > connection.max_frame_size:
+            return False, Response(StatusCode.PayloadTooLarge_413)
 
         # read request json object
-        bytes_left = data_length
-        data = b''
-        while bytes_left > 0:
-            read_amount = max(0, min(bytes_left, MAX_PACKET_READ_LENGTH))  # clamp bytes_left between 0 and MAX_READ
-            read_data = sender.recv(read_amount)
-            data += read_data
-            bytes_left -= len(read_data)
+        data, buffered = receive_frame(sender, data_length, connection)
 
-        data_json: dict = json.loads(data)
-
-        return data_json['id_token'], Request(data_json['request_id'], data_json['args'], data_json['payload'])
+        id_token, request = parse_request(data, connection)
+        request.buffered_bytes = buffered
+        return id_token, request
     except:
+        connection.release_memory(buffered)
+        return False, Response(StatusCode.BadRequest_400)
+
+
+async def _read_into_file(reader: asyncio.StreamReader, length: int, directory: str = None) -> memoryview:
+    """
+    Asyncio counterpart of _recv_into_file.
+
+    :param reader: The stream reader to read from.
+    :param length: How many bytes to read. Must be positive.
+    :param directory: Directory for the temporary file. Default to the system's temporary directory.
+    :return: memoryview over the mapped file.
+    """
+    with tempfile.TemporaryFile(dir=directory) as f:
+        received = 0
+        while received < length:
+            read_data = await reader.read(min(SPILL_READ_LENGTH, length - received))
+            if not read_data:
+                raise ConnectionError("Connection closed in the middle of a request.")
+            f.write(read_data)
+            received += len(read_data)
+        f.flush()
+        return memoryview(mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ))
+
+
+async def receive_request_async(reader: asyncio.StreamReader, connection: ConnectionContext,
+                                idle_timeout: float = None) \
+        -> tuple[str, Request] | tuple[bool, Response] | tuple[bool, None]:
+    """
+    Asyncio counterpart of receive_request. Reads one length-prefixed request frame from the stream reader.
+
+    :param reader: The stream reader of the client's connection.
+    :param connection: The context of the connection.
+    :param idle_timeout: How many seconds to wait for a new request to start. None to wait forever.
+    :return: id_token, Request() (False, Response() in case of an error; False, None if the connection was closed, or
+    timed out, before a new request started)
+    """
+    # read request length
+    try:
+        payload_length_bytes = await asyncio.wait_for(reader.readexactly(4), idle_timeout)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return False, None
+        return False, Response(StatusCode.BadRequest_400)
+    except (asyncio.TimeoutError, ConnectionError):
+        return False, None
+
+    buffered = 0
+    try:
+        data_length = int.from_bytes(payload_length_bytes, "big")
+        if data_length > connection.max_frame_size:
+            return False, Response(StatusCode.PayloadTooLarge_413)
+
+        # read request json object
+        if connection.reserve_memory(data_length):
+            buffered = data_length
+            data = await reader.readexactly(data_length)
+        else:
+            data = await _read_into_file(reader, data_length, connection.spill_directory)
+
+        id_token, request = parse_request(data, connection)
+        request.buffered_bytes = buffered
+        return id_token, request
+    except Exception:
+        connection.release_memory(buffered)
         return False, Response(StatusCode.BadRequest_400)
@@ -1,13 +1,37 @@
+import os
+
 import firebase_admin
 from firebase_admin import credentials
 
+from db_services.blob_cache import remove_stale_process_directories
+
 from ..framework import Framework
+from ..server_config import ServerConfig
 
 cred = credentials.Certificate("serviceAccountKey.json")
 firebase_app: firebase_admin.App = firebase_admin.initialize_app(cred, {
     'storageBucket': 'fotogo-5e99f.appspot.com'
 })
-app = Framework(firebase_app)
+# every worker process caches the images in its own directory, since a cache empties its directory when it starts.
+# The directories of processes that exited (and were restarted with other pids) are removed
+blob_cache_directory = os.environ.get('FOTOGO_BLOB_CACHE')
+if blob_cache_directory:
+    remove_stale_process_directories(blob_cache_directory)
+    blob_cache_directory = os.path.join(blob_cache_directory, str(os.getpid()))
+
+# TLS is terminated by the server itself when a certificate is configured (see main.py's --certfile)
+app = Framework(firebase_app, config=ServerConfig(
+    tls_certfile=os.environ.get('FOTOGO_TLS_CERTFILE'),
+    tls_keyfile=os.environ.get('FOTOGO_TLS_KEYFILE'),
+    materialized_counters=bool(os.environ.get('FOTOGO_COUNTERS')),
+    album_cache=bool(os.environ.get('FOTOGO_ALBUM_CACHE')),
+    blob_cache_directory=blob_cache_directory or None,
+    blob_cache_size=int(os.environ.get('FOTOGO_BLOB_CACHE_SIZE', 1024 * 1024 * 1024)),
+    blob_memory_cache_size=int(os.environ.get('FOTOGO_BLOB_MEMORY_CACHE_SIZE', 0)),
+    renditions=bool(os.environ.get('FOTOGO_RENDITIONS')),
+    rendition_processes=int(os.environ['FOTOGO_RENDITION_PROCESSES']) if 'FOTOGO_RENDITION_PROCESSES' in os.environ
+    else None
+))
 
 import fotogo_networking.endpoints.albums_endpoints
 import fotogo_networking.endpoints.users_endpoints
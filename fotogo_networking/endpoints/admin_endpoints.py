@@ -1,9 +1,14 @@
+from collections.abc import Iterator
+
+from ..admin_data_structures import UserData
 from ..endpoints import app
 from ..request import Request
 from ..request_type import RequestType
-from ..response import Response
+from ..response import Response, StreamingResponse
 from ..status_code import StatusCode
 
+_USERS_PAGE_SIZE = 500  # users fetched per page of a streamed GetUsers
+
 
 @app.endpoint(endpoint_id=RequestType.GenerateStatistics)
 def generate_statistics(request: Request) -> Response:
@@ -14,7 +19,7 @@ def generate_statistics(request: Request) -> Response:
     :return: Response
     """
     try:
-        res = app.db.generate_statistics(request.user_id)
+        res = app.db.generate_statistics(request.user_id, request.identity)
         return Response(StatusCode.OK_200,
                         dict(usr_count=res.users_count, albm_count=res.albums_count, img_count=res.images_count))
     except:
@@ -26,13 +31,70 @@ def get_users(request: Request) -> Response:
     """
     Get information about all the users in the system.
 
+    If the "page_size" argument is given, a single page of users is returned, as dict(users=[...], cursor=...) - pass
+    the cursor in the "cursor" argument to get the next page (it is None after the last page).
+
+    If the "stream" argument is true, the users are streamed: a header frame, then a frame per user, fetched a page
+    at a time, then an end-of-stream frame.
+
     :param request: Request object.
     :return: Response
     """
     try:
-        res = app.db.get_users_data(request.user_id)
-        return Response(StatusCode.OK_200,
-                        [dict(id=i.uid, name=i.display_name, email=i.email, photo_url=i.photo_url,
-                              priv=i.privilege_level) for i in res])
+        if request.args.get('stream', False):
+            # checks the permission before the stream begins
+            users, cursor = app.db.get_users_page(request.user_id, _USERS_PAGE_SIZE, identity=request.identity)
+            return StreamingResponse(StatusCode.OK_200, items=_stream_users(request, users, cursor))
+
+        if 'page_size' in request.args:
+            users, cursor = app.db.get_users_page(request.user_id, request.args['page_size'],
+                                                  request.args.get('cursor'), request.identity)
+            return Response(StatusCode.OK_200, dict(users=[_user_dict(i) for i in users], cursor=cursor))
+
+        res = app.db.get_users_data(request.user_id, request.identity)
+        return Response(StatusCode.OK_200, [_user_dict(i) for i in res])
+    except Exception as e:
+        return Response(StatusCode.InternalServerError_500, str(e))
+
+
+def _user_dict(user: UserData) -> dict:
+    """
+    Packs a user's data as it is sent to the admin console.
+
+    :param user: UserData object.
+    :return: dict
+    """
+    return dict(id=user.uid, name=user.display_name, email=user.email, photo_url=user.photo_url,
+                priv=user.privilege_level)
+
+
+def _stream_users(request: Request, users: list[UserData], cursor: str | None) -> Iterator[dict]:
+    """
+    Yields the users of the first page, then fetches and yields the next pages, until the last one.
+
+    :param request: The GetUsers request.
+    :param users: The users of the first page.
+    :param cursor: The cursor of the second page.
+    :return: Iterator of the users' dicts.
+    """
+    while True:
+        yield from (_user_dict(i) for i in users)
+        if cursor is None:
+            return
+        users, cursor = app.db.get_users_page(request.user_id, _USERS_PAGE_SIZE, cursor, request.identity)
+
+
+@app.endpoint(endpoint_id=RequestType.GetServerMetrics)
+def get_server_metrics(request: Request) -> Response:
+    """
+    Get a snapshot of the server's runtime metrics (queue depths, shed requests, timings) for an admin user.
+
+    :param request: Request object.
+    :return: Response
+    """
+    try:
+        if app.db.get_privilege_level(request.user_id, request.identity) != 0:
+            return Response(StatusCode.Forbidden_403)
+        return Response(StatusCode.OK_200, app.metrics.snapshot())
     except Exception as e:
         return Response(StatusCode.InternalServerError_500, str(e))
@@ -1,13 +1,14 @@
 import base64
 from datetime import datetime
 
-from db_services.data_structures import AlbumDetails, DateTimeRange
+from db_services.data_structures import AlbumDetails, DateTimeRange, Image
+from db_services.renditions import ORIGINAL, RENDITIONS, rendition_path
 from ..endpoints import app
-from .images_endpoints import upload_images, delete_images
+from .images_endpoints import upload_images, delete_image_files
 from ..exceptions import *
 from ..request import Request
 from ..request_type import RequestType
-from ..response import Response
+from ..response import Response, StreamingResponse
 from ..status_code import StatusCode
 
 
@@ -16,6 +17,9 @@ def create_album(request: Request) -> Response:
     """
     Handles CreateAlbum request.
 
+    If some of the images failed to upload, the album and the other images are still created, and the response is
+    207 Multi-Status with dict(album_id=..., failed_images=[...]) - the file names of the images that were not added.
+
     :param request: Request object.
     :return: Response
     """
@@ -31,9 +35,14 @@ def create_album(request: Request) -> Response:
             last_modified=album_data['last_modified'],
             is_built=True,
             permitted_users=album_data['permitted_users']
-        ))
+        ), request.identity)
 
-        upload_images(request, album_id)
+        try:
+            upload_images(request, album_id)
+        except UploadFailedException as e:
+            # the album and the other images were created - the client retries the failed images only
+            app.logger.error(str(e))
+            return Response(StatusCode.MultiStatus_207, dict(album_id=str(album_id), failed_images=e.failed_images))
 
         return Response(StatusCode.Created_201, str(album_id))
     except UserNotExistsException:
@@ -47,59 +56,197 @@ def sync_album_details(request: Request) -> Response:
     """
     Handles SyncAlbumDetails request.
 
+    If the "watermark" argument is given, only the albums changed since the sync that returned the watermark are
+    returned (all of them, if it is None), as dict(albums=[...], watermark=...) - the client sends the new watermark
+    on its next sync.
+
+    The "rendition" argument chooses the rendition of the cover images: "original" (the default), "preview" or
+    "thumbnail". Covers that do not have the rendition are sent in their original.
+
     :param request: Request object.
     :return: Response
     """
     try:
+        if 'watermark' in request.args:
+            watermark = request.args['watermark']
+            res, watermark = app.db.sync_album_changes(
+                request.user_id,
+                datetime.fromisoformat(watermark) if watermark is not None else None,
+                request.identity
+            )
+            return Response(StatusCode.OK_200, dict(albums=_album_dicts(res, _rendition(request)),
+                                                    watermark=watermark.isoformat() if watermark is not None else None))
+
         res = app.db.sync_album_details(
             request.user_id,
-            request.args['requested_albums'] if 'requested_albums' in request.args else None
+            request.args['requested_albums'] if 'requested_albums' in request.args else None,
+            request.identity
         )
-        album_list = [
-            dict(
-                owner_id=i.owner_id,
-                album_id=i.id,
-                name=i.name,
-                date_range=i.date_range.format(),
-                last_modified=str(i.last_modified),
-                is_built=i.is_built,
-                tags=i.tags,
-                permitted_users=i.permitted_users,
-                cover_image=app.storage.get_file_url(f"{i.owner_id}/{i.cover_image}") if i.owner_id != '' else '',
-                # cover_image=base64.b64encode(app.storage.get_file_bytes(f"{i.owner_id}/{i.cover_image}")).decode(
-                #     'ascii') if i.owner_id != '' else ''
-            ) for i in res
-        ]
+        album_list = _album_dicts(res, _rendition(request))
         return Response(StatusCode.OK_200, album_list)
-    except Exception as e:
-        raise e
+    except ValueError:  # a malformed watermark or an unknown rendition
+        return Response(StatusCode.BadRequest_400)
+    except:
         return Response(StatusCode.InternalServerError_500)
 
 
+def _rendition(request: Request) -> str:
+    """
+    Returns the rendition of the images a request chose in its "rendition" argument - the original, if renditions are
+    not generated.
+
+    :raises ValueError: If the rendition is unknown.
+
+    :param request: Request object.
+    :return: The rendition's name.
+    """
+    rendition = request.args.get('rendition') or ORIGINAL
+    if rendition != ORIGINAL and rendition not in RENDITIONS:
+        raise ValueError(f"Unknown rendition: {rendition}")
+    return rendition if app.renditions.enabled else ORIGINAL
+
+
+def _album_dicts(albums: list[AlbumDetails], rendition: str = ORIGINAL) -> list[dict]:
+    """
+    Builds the dictionaries of albums' details, as sent to the client, with the URLs of their cover images signed in
+    a single batch.
+
+    :param albums: list of AlbumDetails objects.
+    :param rendition: The rendition of the cover images. Default to the original.
+    :return: list of dict
+    """
+    live_albums = [i for i in albums if i.owner_id != '']
+    cover_renditions = {}  # cover image -> the rendition it is signed in
+    if rendition != ORIGINAL:
+        # covers that do not have the rendition (uploaded before renditions were generated) are sent in the original
+        covers = app.db.get_images([i.cover_image for i in live_albums if i.cover_image])
+        cover_renditions = {image_id: rendition for image_id, doc in covers.items()
+                            if rendition in ((doc.to_dict() or {}).get('renditions') or ())}
+    cover_urls = dict(zip((i.id for i in live_albums), app.storage.get_files_urls(
+        rendition_path(i.owner_id, i.cover_image, cover_renditions.get(i.cover_image, ORIGINAL))
+        for i in live_albums)))
+    return [_album_dict(i, cover_urls.get(i.id, '')) for i in albums]
+
+
+def _album_dict(album: AlbumDetails, cover_url: str) -> dict:
+    """
+    Builds the dictionary of an album's details, as sent to the client.
+
+    :param album: AlbumDetails object. An empty owner_id marks a deleted album.
+    :param cover_url: Signed URL of the album's cover image. Empty for a deleted album.
+    :return: dict
+    """
+    return dict(
+        owner_id=album.owner_id,
+        album_id=album.id,
+        name=album.name,
+        date_range=album.date_range.format(),
+        last_modified=album.last_modified,
+        is_built=album.is_built,
+        tags=album.tags,
+        permitted_users=album.permitted_users,
+        cover_image=cover_url,
+        # cover_image=base64.b64encode(app.storage.get_file_bytes(f"{album.owner_id}/{album.cover_image}")).decode(
+        #     'ascii') if album.owner_id != '' else ''
+    )
+
+
+def _image_dict(image: Image, data) -> dict:
+    """
+    Builds the dictionary of an image, as sent to the client.
+
+    :param image: Image object.
+    :param data: The image's file contents.
+    :return: dict
+    """
+    return dict(
+        file_name=image.file_name,
+        timestamp=str(image.timestamp).split(' ')[0],
+        location=image.location,
+        tag=image.tag,
+        containing_albums=image.containing_albums,
+        # data=app.storage.get_file_url(f"{image.owner_id}/{image.file_name}")
+        # sent as a binary attachment, or as a base64 string to JSON-only clients
+        data=data
+    )
+
+
+def _image_metadata_dict(image: Image, url: str) -> dict:
+    """
+    Builds the dictionary of an image without its contents, as sent to the client - with a signed URL to download the
+    contents from, when the client needs them.
+
+    :param image: Image object.
+    :param url: Signed URL of the image.
+    :return: dict
+    """
+    return dict(
+        file_name=image.file_name,
+        timestamp=str(image.timestamp).split(' ')[0],
+        location=image.location,
+        tag=image.tag,
+        containing_albums=image.containing_albums,
+        url=url
+    )
+
+
 @app.endpoint(endpoint_id=RequestType.GetAlbumContents)
 def get_album_contents(request: Request) -> Response:
     """
     Handles GetAlbumContents request.
 
+    If the "stream" argument is true, the album is streamed: a header frame with the album id and images count, then
+    a frame per image as soon as it is downloaded, then an end-of-stream frame.
+
+    If the "page_size" argument is given, only a page of the images (ordered by their timestamps) is returned, as
+    dict(images=[...], cursor=...) - or, when streamed, with the cursor in the header frame. Pass the cursor in the
+    "cursor" argument to get the next page (it is None after the last page).
+
+    If the "metadata_only" argument is true, the images' contents are not sent - each image has a signed "url" to
+    download its contents from instead.
+
+    The "rendition" argument chooses the rendition of the images: "original" (the default), "preview" or "thumbnail".
+    Images that do not have the rendition are sent in their original.
+
     :param request: Request object.
     :return: Response
     """
     try:
-        res = app.db.get_album_contents(request.args['album_id'])
-        images = [
-            dict(
-                file_name=i.file_name,
-                timestamp=str(i.timestamp).split(' ')[0],
-                location=(i.location.longitude, i.location.latitude) if i.location is not None else None,
-                tag=i.tag,
-                containing_albums=i.containing_albums,
-                # data=app.storage.get_file_url(f"{i.owner_id}/{i.file_name}")
-                data=base64.b64encode(app.storage.get_file_bytes(f"{i.owner_id}/{i.file_name}")).decode('ascii')
-            ) for i in res
-        ]
-        return Response(StatusCode.OK_200, images)
+        if 'page_size' in request.args:
+            page_size = request.args['page_size']
+            if not isinstance(page_size, int) or isinstance(page_size, bool) or page_size <= 0:
+                return Response(StatusCode.BadRequest_400)
+            res, cursor = app.db.get_album_contents_page(request.args['album_id'], page_size,
+                                                         request.args.get('cursor'), request.identity)
+        else:
+            res, cursor = app.db.get_album_contents(request.args['album_id'], request.identity), None
+
+        rendition = _rendition(request)
+        # images that do not have the rendition (uploaded before renditions were generated) are sent in the original
+        paths = [rendition_path(i.owner_id, i.file_name, rendition if rendition in (i.renditions or ()) else ORIGINAL)
+                 for i in res]
+        if request.args.get('metadata_only', False):
+            urls = app.storage.get_files_urls(paths)
+            images = (_image_metadata_dict(i, url) for i, url in zip(res, urls))
+        elif request.args.get('stream', False):
+            files = app.storage.iter_files_bytes(paths)
+            images = (_image_dict(i, data) for i, data in zip(res, files))
+        else:
+            files = app.storage.get_files_bytes(paths)
+            images = (_image_dict(i, data) for i, data in zip(res, files))
+
+        if request.args.get('stream', False):
+            header = dict(album_id=request.args['album_id'], count=len(res))
+            if 'page_size' in request.args:
+                header['cursor'] = cursor
+            return StreamingResponse(StatusCode.OK_200, header, images)
+        if 'page_size' in request.args:
+            return Response(StatusCode.OK_200, dict(images=list(images), cursor=cursor))
+        return Response(StatusCode.OK_200, list(images))
     except AlbumNotExistsException:
         return Response(StatusCode.NotFound_404)
+    except ValueError:  # a malformed cursor or an unknown rendition
+        return Response(StatusCode.BadRequest_400)
     except Exception as e:
         return Response(StatusCode.InternalServerError_500)
 
@@ -125,7 +272,8 @@ def update_album(request: Request) -> Response:
                 last_modified=datetime.strptime(album_data['last_modified'], '%Y-%m-%d %H:%M:%S.%f'),
                 is_built=True,
                 permitted_users=album_data['permitted_users']
-            )
+            ),
+            request.identity
         )
         if not res:
             return Response(StatusCode.NotFound_404)
@@ -141,13 +289,24 @@ def add_to_album(request: Request) -> Response:
     """
     Handles AddToAlbum request.
 
+    If some of the images failed to upload, the other images are still added, and the response is 207 Multi-Status
+    with dict(failed_images=[...]) - the file names of the images that were not added.
+
     :param request: Request object.
     :return: Response
     """
     try:
-        upload_images(request, request.args['album_id'])
+        failed_images = []
+        try:
+            upload_images(request, request.args['album_id'])
+        except UploadFailedException as e:
+            # the other images were added - the client retries the failed images only
+            app.logger.error(str(e))
+            failed_images = e.failed_images
         app.db.update_last_modified(datetime.strptime(request.args['last_modified'], '%Y-%m-%d %H:%M:%S.%f'),
                                     request.args['album_id'])
+        if failed_images:
+            return Response(StatusCode.MultiStatus_207, dict(failed_images=failed_images))
         return Response(StatusCode.OK_200)
     except:
         return Response(StatusCode.InternalServerError_500)
@@ -162,14 +321,9 @@ def remove_from_album(request: Request) -> Response:
     :return: Response
     """
     try:
-        images_to_delete = []
-
-        for img in request.payload:
-            deleted = app.db.unlink_image_from_album(request.user_id, img, request.args['album_id'])
-            if deleted:
-                images_to_delete.append(img)
-
-        delete_images(request.user_id, images_to_delete)
+        images_to_delete = app.db.unlink_images_from_album(request.user_id, request.payload, request.args['album_id'],
+                                                           request.identity)
+        delete_image_files(request.user_id, images_to_delete)
 
         app.db.update_last_modified(datetime.strptime(request.args['last_modified'], '%Y-%m-%d %H:%M:%S.%f'),
                                     request.args['album_id'])
@@ -189,8 +343,8 @@ def delete_album(request: Request) -> Response:
     :return: Response
     """
     try:
-        img_ids_to_unlink = app.db.delete_album(request.user_id, request.args['album_id'])
-        delete_images(request.user_id, img_ids_to_unlink)
+        img_ids_to_unlink = app.db.delete_album(request.user_id, request.args['album_id'], request.identity)
+        delete_image_files(request.user_id, img_ids_to_unlink)
 
         return Response(StatusCode.OK_200)
     except AlbumNotExistsException:
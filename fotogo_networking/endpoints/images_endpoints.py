@@ -1,58 +1,152 @@
 import base64
-import os
 
 from db_services.data_structures import Image
+from db_services.renditions import ORIGINAL, RENDITIONS, rendition_path
 from ..endpoints import app
+from ..exceptions import UploadFailedException
 from ..request import Request
 
 
+_UPLOAD_BATCH_SIZE = 16  # how many new images are decoded, rendered and uploaded at a time
+
+
 def upload_images(request: Request, album_id) -> None:
     """
     Uploads images to the database.
 
     Both creates a document in the Images collection and uploads the actual file to the storage, for each image.
+    Images that already exist are only linked to the album. The existing images are looked up in a single batched
+    read, and the documents are written in batches. The files are uploaded in parallel from memory, along with their
+    thumbnail and preview renditions (see RenditionPipeline).
+
+    The new images are handled _UPLOAD_BATCH_SIZE at a time - decoded, rendered, written and uploaded - so only a
+    batch of decoded images and renditions is held in memory at once, besides the request itself.
+
+    :raises UploadFailedException: If some of the files failed to upload - the documents and the other files of their
+    images are deleted, and the other images remain uploaded. Its failed_images are the file names of the deleted
+    images.
 
     :param request: Request object.
     :param album_id: Album's id to link the images to.
     """
+    snapshots = app.db.get_images([img['file_name'] for img in request.payload], request.identity)
+    existing_image_ids = []
+    new_images = []
     for img in request.payload:
-        curr_image_id = img['file_name']
+        if snapshots[img['file_name']].exists:
+            existing_image_ids.append(img['file_name'])
+        else:
+            new_images.append(img)
+
+    app.db.link_images_to_album(request.user_id, existing_image_ids, album_id, request.identity)
+
+    failures = {}
+    for start in range(0, len(new_images), _UPLOAD_BATCH_SIZE):
+        failures.update(_upload_new_images(request, album_id, new_images[start:start + _UPLOAD_BATCH_SIZE]))
+    if failures:
+        failed_images = sorted({name for name, _ in failures.values()})
+        path, (_, error) = next(iter(failures.items()))
+        raise UploadFailedException(failed_images,
+                                    f"Failed to upload {len(failures)} files, such as {path}: {error}")
+
+
+def _upload_new_images(request: Request, album_id, images: list[dict]) -> dict:
+    """
+    Uploads a batch of new images - creates their documents and uploads their files and renditions, and undoes the
+    images that some of their files failed to upload.
+
+    :param request: Request object.
+    :param album_id: Album's id to link the images to.
+    :param images: The images' dictionaries from the request's payload.
+    :return: dict of the paths of the files that failed to upload to (image file name, error). Empty if all of them
+    were uploaded.
+    """
+    # the originals are decoded once, to be both uploaded and rendered. Images that cannot be rendered get no
+    # renditions, and are served in their originals
+    originals = [(img['file_name'], _image_bytes(img)) for img in images]
+    renditions = app.renditions.render_many(data for _, data in originals) or [{} for _ in originals]
+    files = {rendition_path(request.user_id, name): (name, data) for name, data in originals}
+    for (name, _), image_renditions in zip(originals, renditions):
+        files.update((rendition_path(request.user_id, name, rendition), (name, data))
+                     for rendition, data in image_renditions.items())
+
+    # create images documents, recording the renditions each image has (None if they were not rendered)
+    app.db.add_images([Image(
+        owner_id=request.user_id,
+        file_name=img['file_name'],
+        timestamp=img['timestamp'],
+        location=img['location'] if 'location' in img else None,
+        tag=img['tag'] if 'tag' in img else None,
+        containing_albums=[album_id],
+        renditions=list(image_renditions) if app.renditions.enabled else None
+    ) for img, image_renditions in zip(images, renditions)], request.identity)
 
-        if app.db.image_exists(curr_image_id):
-            app.db.link_image_to_album(request.user_id, curr_image_id, album_id)
-            continue
+    # upload files to storage, straight from memory, and undo the images that some of their files failed to upload
+    failures = app.storage.upload_many((path, data) for path, (_, data) in files.items())
+    if failures:
+        failed_images = {files[path][0] for path in failures}
+        app.db.delete_images(request.user_id, list(failed_images), request.identity)
+        app.storage.delete_files(path for path, (name, _) in files.items() if name in failed_images)
+    return {path: (files[path][0], error) for path, error in failures.items()}
 
-        # create image document
-        app.db.add_image(Image(
-            owner_id=request.user_id,
-            file_name=curr_image_id,
-            timestamp=img['timestamp'],
-            location=img['location'] if 'location' in img else None,
-            tag=img['tag'] if 'tag' in img else None,
-            containing_albums=[album_id],
-        ))
-        # upload files to storage
-        path = f"temp/{img['file_name']}"
-        with open(path, 'w+b') as f:
-            decoded_bytes = base64.b64decode(img['data'])
-            f.write(decoded_bytes)
-            f.seek(0)
-            app.storage.upload_file(f"{request.user_id}/{img['file_name']}", f)
-        os.remove(path)
 
+def _image_bytes(img: dict) -> bytes | memoryview:
+    """
+    Returns the contents of an uploaded image, and drops them from the image's dictionary - so a base64 string is not
+    held along with its decoded contents until the whole request is done.
 
-def delete_images(uid: str, image_ids: list) -> None:
+    :param img: The image's dictionary from the request's payload.
+    :return: The image's contents.
     """
-    Deletes images from the database.
+    data = img.pop('data')
+    # JSON-only clients send the image as a base64 string, binary clients as an attachment (memoryview)
+    return base64.b64decode(data) if isinstance(data, str) else data
+
 
-    Both deletes the document in the Images collection and the actual file to the storage, for each image.
+def delete_image_files(uid: str, image_ids: list) -> None:
+    """
+    Deletes the files of images (and their renditions) from the storage, once their documents were deleted from the
+    database.
 
     :param uid: User id.
     :param image_ids: list of image IDs to delete.
     :return: None
     """
-    for img in image_ids:
-        app.db.delete_image(uid, img)
-        app.storage.delete_file(f"{uid}/{img}")
+    app.storage.delete_files(rendition_path(uid, img, rendition) for img in image_ids
+                             for rendition in (ORIGINAL, *RENDITIONS))
 
 
+def generate_missing_renditions(batch_size: int = 32) -> int:
+    """
+    Generates the renditions of the images that have none - the ones uploaded before renditions were generated, so
+    every image can be requested in every rendition - and records them in the images' documents.
+
+    Images that cannot be decoded get no renditions, and are served in their originals. They are recorded as rendered
+    too (with empty renditions), so the next runs do not download and render them again.
+
+    :param batch_size: How many images to download and render at a time. Default to 32.
+    :return: How many images got their renditions generated.
+    """
+    if not app.renditions.enabled:
+        return 0
+    paths = set(app.storage.list_files())
+    originals = [path.split('/', 1) for path in paths if path.count('/') == 1]  # (uid, file name) pairs
+    missing = [(uid, name) for uid, name in originals
+               if any(rendition_path(uid, name, rendition) not in paths for rendition in RENDITIONS)]
+
+    generated = 0
+    for start in range(0, len(missing), batch_size):
+        # files left behind by images that were deleted are skipped, and so are images that were already rendered
+        snapshots = app.db.get_images([name for _, name in missing[start:start + batch_size]])
+        batch = [(uid, name) for uid, name in missing[start:start + batch_size]
+                 if snapshots[name].exists and snapshots[name].to_dict().get('renditions') is None]
+        renditions = app.renditions.render_many(app.storage.get_files_bytes(rendition_path(*i) for i in batch))
+        failures = app.storage.upload_many((rendition_path(uid, name, rendition), data)
+                                           for (uid, name), files in zip(batch, renditions)
+                                           for rendition, data in files.items())
+        if failures:
+            raise Exception(f"Failed to upload {len(failures)} renditions, such as {next(iter(failures))}: "
+                            f"{next(iter(failures.values()))}")
+        app.db.add_image_renditions({name: list(files) for (_, name), files in zip(batch, renditions)})
+        generated += sum(1 for files in renditions if files)
+    return generated
@@ -1,15 +1,19 @@
+import queue
+import threading
+from collections.abc import Callable, Iterator
+
 from ..endpoints import app
 from ..exceptions import *
 from ..request import Request
 from ..request_type import RequestType
-from ..response import Response
+from ..response import Response, StreamingResponse
 from ..status_code import StatusCode
 
 
 @app.endpoint(endpoint_id=RequestType.UserAuth)
 def user_auth(id_token: str, request: Request) -> Request | Response:
     """
-    Authenticates a user by validating its id_token.
+    Authenticates a user by validating its id_token, and loads the user's identity context.
 
     :param id_token: Id token to validate.
     :param request: Request object.
@@ -17,6 +21,7 @@ def user_auth(id_token: str, request: Request) -> Request | Response:
     """
     try:
         request.user_id = app.db.authenticate_user(id_token)
+        request.identity = app.db.get_identity(request.user_id)
         return request
     except UserNotAuthenticatedException as e:
         return Response(StatusCode.Unauthorized_401, str(e))
@@ -36,8 +41,8 @@ def check_user_exists(request: Request) -> Response:
     :return: Privilege level of the user, if it exists; else -1.
     """
     try:
-        if app.db.user_exists(request.user_id):
-            return Response(StatusCode.OK_200, app.db.get_privilege_level(request.user_id))
+        if app.db.user_exists(request.user_id, request.identity):
+            return Response(StatusCode.OK_200, app.db.get_privilege_level(request.user_id, request.identity))
         return Response(StatusCode.OK_200, -1)
     except:
         return Response(StatusCode.InternalServerError_500)
@@ -65,20 +70,62 @@ def delete_account(request: Request) -> Response:
     """
     Handles DeleteAccount request.
 
-    Also handles a AdminDeleteUser by checking the client's privilege level.
+    Also handles a AdminDeleteUser by checking the client's privilege level. If the "progress" argument of a
+    AdminDeleteUser is true, the deletion's progress is streamed: a header frame with the user id, then a frame with
+    the stage ("images", "albums" or "files") and how many of its items were deleted so far, after every page or batch
+    of deletes, then an end-of-stream frame.
 
     :param request: Request object.
     :return: Response
     """
     try:
-        if app.db.get_privilege_level(request.user_id) == 0:
+        if app.db.get_privilege_level(request.user_id, request.identity) == 0:
             uid = request.args['uid']
         else:
             uid = request.user_id
 
-        app.db.delete_user_data(uid)
-        app.storage.delete_directory(uid)
+        if request.type == RequestType.AdminDeleteUser and request.args.get('progress', False):
+            return StreamingResponse(StatusCode.OK_200, dict(uid=uid), _deletion_progress(uid))
+
+        _delete_user(uid)
 
         return Response(StatusCode.OK_200)
     except:
         return Response(StatusCode.InternalServerError_500)
+
+
+def _delete_user(uid: str, on_progress: Callable[[str, int], None] = None) -> None:
+    """
+    Deletes all the data of a user - its documents in the database and its files in the storage.
+
+    :param uid: User id to delete.
+    :param on_progress: Called with the stage ("images", "albums" or "files") and how many of its items were deleted
+    so far.
+    """
+    app.db.delete_user_data(uid, on_progress)
+    app.storage.delete_directory(uid, (lambda deleted: on_progress('files', deleted)) if on_progress else None)
+
+
+def _deletion_progress(uid: str) -> Iterator[dict]:
+    """
+    Deletes a user on a background thread, and yields the deletion's progress.
+
+    The deletion goes on even if the client stops reading the progress.
+
+    :param uid: User id to delete.
+    :return: Iterator of dicts with the stage and the number of deleted items. Raises if the deletion failed.
+    """
+    progress = queue.Queue()
+
+    def delete():
+        try:
+            _delete_user(uid, lambda stage, deleted: progress.put(dict(stage=stage, deleted=deleted)))
+            progress.put(None)
+        except Exception as e:
+            progress.put(e)
+
+    threading.Thread(target=delete, name=f"delete-user-{uid}", daemon=True).start()
+    while (item := progress.get()) is not None:
+        if isinstance(item, Exception):
+            raise item
+        yield item
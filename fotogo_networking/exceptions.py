@@ -46,3 +46,14 @@ class PermissionDeniedException(Exception):
     def __str__(self):
         return self._message if self._message is not None else \
             "Does not have the right permission to that source."
+
+
+class UploadFailedException(Exception):
+    """An exception that indicates that some of the images of an upload failed to upload, and were rolled back."""
+    def __init__(self, failed_images: list[str], message=None):
+        self.failed_images = failed_images
+        self._message = message
+
+    def __str__(self):
+        return self._message if self._message is not None else \
+            f"Failed to upload {len(self.failed_images)} images."
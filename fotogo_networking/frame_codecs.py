@@ -0,0 +1,142 @@
+import base64
+import json
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+from google.cloud.firestore_v1 import GeoPoint
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+BytesLike = bytes | bytearray | memoryview
+
+# Codec ids, as sent in the flags byte of a binary frame
+JSON_CODEC_ID = 0
+MSGPACK_CODEC_ID = 1
+
+
+def _encode_default(obj):
+    """
+    Encodes the types that frames commonly hold and the serialization libraries do not know.
+
+    * datetime: str(datetime), e.g. "2023-01-31 12:00:00.000000+00:00" - the format the clients already parse.
+    * GeoPoint: [longitude, latitude].
+    * bytes-like: base64 string (binary frames move them to attachments before encoding, so this is JSON-only).
+    """
+    if isinstance(obj, datetime):
+        return str(obj)
+    if isinstance(obj, GeoPoint):
+        return [obj.longitude, obj.latitude]
+    if isinstance(obj, BytesLike):
+        return base64.b64encode(obj).decode('ascii')
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+class Codec(ABC):
+    """
+    Serializes the objects inside frames.
+
+    Each codec is identified on the wire by its codec_id. The client picks one in the flags byte of its first binary
+    frame, and the server answers in the same codec for the rest of the connection. Subclasses implement encode and
+    decode - a codec that misses one of them cannot be created, let alone registered.
+    """
+    name = ''
+    codec_id = -1
+
+    @abstractmethod
+    def encode(self, obj) -> bytes:
+        """
+        Encodes an object.
+
+        :param obj: The object to encode.
+        :return: bytes
+        """
+
+    @abstractmethod
+    def decode(self, data: BytesLike):
+        """
+        Decodes an object.
+
+        :param data: The encoded object.
+        :return: The decoded object.
+        """
+
+    def __repr__(self):
+        return f"{type(self).__name__}(name: {self.name}, codec_id: {self.codec_id})"
+
+
+class JsonCodec(Codec):
+    """JSON, using the standard library. The fallback when orjson is not installed."""
+    name = 'json'
+    codec_id = JSON_CODEC_ID
+
+    def encode(self, obj) -> bytes:
+        return json.dumps(obj, default=_encode_default).encode()
+
+    def decode(self, data: BytesLike):
+        return json.loads(data.tobytes() if isinstance(data, memoryview) else data)
+
+
+class OrjsonCodec(Codec):
+    """JSON, using orjson. Produces the same JSON documents as JsonCodec (without the optional whitespace)."""
+    name = 'json'
+    codec_id = JSON_CODEC_ID
+
+    def encode(self, obj) -> bytes:
+        return orjson.dumps(obj, default=_encode_default,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+
+    def decode(self, data: BytesLike):
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    """MessagePack, using msgpack."""
+    name = 'msgpack'
+    codec_id = MSGPACK_CODEC_ID
+
+    def encode(self, obj) -> bytes:
+        return msgpack.packb(obj, default=_encode_default, use_bin_type=True)
+
+    def decode(self, data: BytesLike):
+        return msgpack.unpackb(data, raw=False)
+
+
+CODECS: dict[int, Codec] = {}
+
+
+def register_codec(codec: Codec) -> None:
+    """
+    Registers a codec, replacing any codec registered with the same codec_id.
+
+    :param codec: Codec object.
+    """
+    CODECS[codec.codec_id] = codec
+
+
+def get_codec(codec_id: int) -> Codec:
+    """
+    Returns the registered codec with the given id.
+
+    :raises ValueError: If no codec is registered with that id (e.g. msgpack is not installed on the server).
+
+    :param codec_id: Codec id.
+    :return: Codec object.
+    """
+    if codec_id not in CODECS:
+        raise ValueError(f"Unsupported codec id: {codec_id}")
+    return CODECS[codec_id]
+
+
+register_codec(OrjsonCodec() if orjson is not None else JsonCodec())
+if msgpack is not None:
+    register_codec(MsgpackCodec())
+
+JSON_CODEC = CODECS[JSON_CODEC_ID]
@@ -0,0 +1,139 @@
+import zlib
+from abc import ABC, abstractmethod
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BytesLike = bytes | bytearray | memoryview
+
+# Compression ids, as sent in the flags byte of a binary frame (0 means no compression)
+NO_COMPRESSION_ID = 0
+ZLIB_COMPRESSION_ID = 1
+ZSTD_COMPRESSION_ID = 2
+
+# Signatures of file formats that are already compressed, which are not worth compressing again
+_COMPRESSED_FORMAT_SIGNATURES = (
+    b'\xff\xd8\xff',  # JPEG
+    b'\x89PNG',  # PNG
+    b'GIF8',  # GIF
+)
+
+
+def is_compressed_format(data: BytesLike) -> bool:
+    """
+    Checks whether data is a file in a format that is already compressed, like a JPEG image.
+
+    :param data: The data to check.
+    :return: bool
+    """
+    head = bytes(data[:12])
+    return head.startswith(_COMPRESSED_FORMAT_SIGNATURES) or (head[:4] == b'RIFF' and head[8:12] == b'WEBP')
+
+
+class Compressor(ABC):
+    """
+    Compresses the parts of binary frames.
+
+    Each compressor is identified on the wire by its compression_id. The client picks one in the flags byte of its
+    first binary frame, and the server compresses its responses with it for the rest of the connection. Subclasses
+    implement compress and decompress - a compressor that misses one of them cannot be created, let alone registered.
+    """
+    name = ''
+    compression_id = NO_COMPRESSION_ID
+
+    @abstractmethod
+    def compress(self, data: BytesLike) -> bytes:
+        """
+        Compresses data.
+
+        :param data: The data to compress.
+        :return: bytes
+        """
+
+    @abstractmethod
+    def decompress(self, data: BytesLike, max_length: int) -> bytes:
+        """
+        Decompresses data.
+
+        :raises ValueError: If the decompressed data is longer than max_length.
+
+        :param data: The compressed data.
+        :param max_length: The maximal length of the decompressed data, to guard against decompression bombs.
+        :return: bytes
+        """
+
+    def __repr__(self):
+        return f"{type(self).__name__}(name: {self.name}, compression_id: {self.compression_id})"
+
+
+class ZlibCompressor(Compressor):
+    """zlib (deflate), from the standard library."""
+    name = 'zlib'
+    compression_id = ZLIB_COMPRESSION_ID
+
+    def __init__(self, level: int = 6):
+        self._level = level
+
+    def compress(self, data: BytesLike) -> bytes:
+        return zlib.compress(data, self._level)
+
+    def decompress(self, data: BytesLike, max_length: int) -> bytes:
+        decompressor = zlib.decompressobj()
+        decompressed = decompressor.decompress(data, max_length)
+        if decompressor.unconsumed_tail:
+            raise ValueError("Decompressed data exceeds the maximal length.")
+        return decompressed
+
+
+class ZstdCompressor(Compressor):
+    """Zstandard, using zstandard."""
+    name = 'zstd'
+    compression_id = ZSTD_COMPRESSION_ID
+
+    def __init__(self, level: int = 3):
+        self._level = level
+
+    def compress(self, data: BytesLike) -> bytes:
+        # ZstdCompressor objects are not thread-safe, so one is created per call
+        return zstandard.ZstdCompressor(level=self._level).compress(data)
+
+    def decompress(self, data: BytesLike, max_length: int) -> bytes:
+        try:
+            return zstandard.ZstdDecompressor().decompress(data, max_output_size=max_length)
+        except zstandard.ZstdError as e:
+            raise ValueError(str(e))
+
+
+COMPRESSORS: dict[int, Compressor] = {}
+
+
+def register_compressor(compressor: Compressor) -> None:
+    """
+    Registers a compressor, replacing any compressor registered with the same compression_id.
+
+    :param compressor: Compressor object.
+    """
+    COMPRESSORS[compressor.compression_id] = compressor
+
+
+def get_compressor(compression_id: int) -> Compressor | None:
+    """
+    Returns the registered compressor with the given id.
+
+    :raises ValueError: If no compressor is registered with that id (e.g. zstandard is not installed on the server).
+
+    :param compression_id: Compression id.
+    :return: Compressor object, or None for NO_COMPRESSION_ID.
+    """
+    if compression_id == NO_COMPRESSION_ID:
+        return None
+    if compression_id not in COMPRESSORS:
+        raise ValueError(f"Unsupported compression id: {compression_id}")
+    return COMPRESSORS[compression_id]
+
+
+register_compressor(ZlibCompressor())
+if zstandard is not None:
+    register_compressor(ZstdCompressor())
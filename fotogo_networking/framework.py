@@ -3,9 +3,13 @@ from collections.abc import Callable
 from colorama import Fore
 
 from db_services.db_service import DBService
+from db_services.renditions import RenditionPipeline
 from db_services.storage_service import StorageService
+from fotogo_networking.async_socket_server import AsyncSocketServer
 from fotogo_networking.logger import Logger
+from fotogo_networking.metrics import Metrics
 from fotogo_networking.response import Response
+from fotogo_networking.server_config import ServerConfig
 from fotogo_networking.socket_server import SocketServer
 from fotogo_networking.request_type import RequestType
 from fotogo_networking.request import Request
@@ -15,22 +19,43 @@ class Framework:
     """
     Manages all the different parts of the server.
 
-    Containing the SocketServer and the DB services, as well as a Logger.
+    Containing the socket server and the DB services, as well as a Logger and the server's Metrics.
     """
+    _ENGINES = {
+        'threaded': SocketServer,
+        'asyncio': AsyncSocketServer,
+    }
 
-    def __init__(self, app):
-        self.server = SocketServer(self)
-        self.db = DBService(app)
-        self.storage = StorageService(app)
-        self.endpoint_map: dict[RequestType, Callable] = {}
+    def __init__(self, app, engine: str = 'threaded', config: ServerConfig = None):
+        """
+        Initializes the Framework with a Firebase app.
+
+        :param app: Firebase app.
+        :param engine: The socket server engine to use - "threaded" (a thread per connection) or "asyncio" (an event
+        loop, with the endpoints running on the worker pool). Default to "threaded".
+        :param config: ServerConfig object. Default to ServerConfig().
+        """
+        if engine not in Framework._ENGINES:
+            raise ValueError(f"Unknown server engine: {engine}. Available engines: {list(Framework._ENGINES)}")
+        if config is None:
+            config = ServerConfig()
+        self.config = config
+        self.metrics = Metrics()
         self.logger = Logger("fotogo")
+        self.server = Framework._ENGINES[engine](self, config)
+        self.db = DBService(app, self.metrics, self.logger, materialized_counters=config.materialized_counters,
+                            album_cache=config.album_cache)
+        self.storage = StorageService(app, config.blob_cache_directory, config.blob_cache_size,
+                                      config.blob_memory_cache_size, config.signed_url_refresh_margin, self.metrics)
+        self.renditions = RenditionPipeline(config.rendition_processes, config.renditions)
+        self.endpoint_map: dict[RequestType, Callable] = {}
 
     def start(self):
         """
         Starts the application and the server.
         """
         self.logger.info("Starting application", Fore.CYAN)
-        self.server.start(backlog=2)
+        self.server.start(backlog=self.config.backlog)
 
     def stop(self):
         """
@@ -38,6 +63,7 @@ class Framework:
         """
         self.logger.info("Closing application", Fore.CYAN)
         self.server.stop()
+        self.renditions.close()
 
     def endpoint(self, endpoint_id: RequestType):
         """
@@ -69,5 +95,8 @@ class Framework:
         if type(request_validated) is Response:  # if token invalid
             return request_validated
 
-        res = self.endpoint_map[request.type](request_validated)
+        with self.metrics.timer(f'requests.{request.type.name}'):
+            res = self.endpoint_map[request.type](request_validated)
+        if request_validated.identity is not None:
+            self.metrics.observe(f'firestore.reads.{request.type.name}', request_validated.identity.reads)
         return res
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    A thread-safe registry of the server's runtime metrics.
+
+    Holds three kinds of metrics:
+
+    * Counters: monotonically increasing numbers, like how many requests were shed.
+    * Gauges: functions that are sampled when a snapshot is taken, like the current queue depth.
+    * Timings: summaries (count, total, max) of observed durations or sizes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, int] = defaultdict(int)
+        self._gauges: dict[str, Callable[[], float]] = {}
+        self._timings: dict[str, list[float]] = {}
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        """
+        Increments a counter.
+
+        :param name: Counter name.
+        :param amount: How much to add to the counter. Default to 1.
+        """
+        with self._lock:
+            self._counters[name] += amount
+
+    def register_gauge(self, name: str, sample: Callable[[], float]) -> None:
+        """
+        Registers a gauge, which is sampled every time a snapshot is taken.
+
+        :param name: Gauge name.
+        :param sample: A function that returns the current value of the gauge.
+        """
+        with self._lock:
+            self._gauges[name] = sample
+
+    def observe(self, name: str, value: float) -> None:
+        """
+        Adds an observation (like a duration in seconds) to a timing summary.
+
+        :param name: Timing name.
+        :param value: The observed value.
+        """
+        with self._lock:
+            summary = self._timings.setdefault(name, [0, 0.0, 0.0])
+            summary[0] += 1
+            summary[1] += value
+            summary[2] = max(summary[2], value)
+
+    @contextmanager
+    def timer(self, name: str):
+        """
+        Context manager that observes the wall time of its block under the given timing name.
+
+        :param name: Timing name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def counter(self, name: str) -> int:
+        """
+        Returns the current value of a counter.
+
+        :param name: Counter name.
+        :return: int
+        """
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> dict:
+        """
+        Takes a snapshot of all the metrics.
+
+        :return: dict with "counters", "gauges" and "timings" (each timing as count, total, avg and max).
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            timings = {name: list(summary) for name, summary in self._timings.items()}
+
+        return dict(
+            counters=counters,
+            gauges={name: sample() for name, sample in gauges.items()},
+            timings={name: dict(count=count, total=total, avg=total / count if count else 0, max=max_value)
+                     for name, (count, total, max_value) in timings.items()}
+        )
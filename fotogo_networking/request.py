@@ -4,12 +4,17 @@ from fotogo_networking.request_type import RequestType
 class Request:
     """Represents a request that comes from a client."""
 
-    def __init__(self, request_type: RequestType, args: dict, payload: list, user_id: str = ''):
+    def __init__(self, request_type: RequestType, args: dict, payload: list, user_id: str = '',
+                 correlation_id=None, keep_alive: bool = False):
         assert(request_type in RequestType._value2member_map_, "Request type index does not exists")
         self._type = RequestType._value2member_map_[request_type]
         self._uid = user_id
         self._args = args
         self._payload = payload
+        self._correlation_id = correlation_id
+        self._keep_alive = keep_alive
+        self._buffered_bytes = 0
+        self._identity = None
 
     @property
     def type(self):
@@ -53,9 +58,68 @@ class Request:
         """
         Get Request's payload.
 
+        Binary attachments sent by the client are exposed inside the payload as memoryviews over the received frame.
+
         :return: list
         """
         return self._payload
 
+    @property
+    def correlation_id(self):
+        """
+        Get the id the client attached to the request, which is echoed back in its Response.
+        Lets the client match responses to requests that were pipelined over the same connection.
+
+        :return: The correlation id, or None if the client did not attach one.
+        """
+        return self._correlation_id
+
+    @property
+    def keep_alive(self) -> bool:
+        """
+        Get whether the client wants to keep the connection open for more requests after this one.
+
+        :return: bool
+        """
+        return self._keep_alive
+
+    @property
+    def buffered_bytes(self) -> int:
+        """
+        Get how many bytes of the connection's memory budget the request's frame holds.
+
+        :return: int
+        """
+        return self._buffered_bytes
+
+    @buffered_bytes.setter
+    def buffered_bytes(self, value: int):
+        """
+        Sets how many bytes of the connection's memory budget the request's frame holds.
+
+        :param value: Size in bytes. 0 if the frame was spilled to disk.
+        :return: None
+        """
+        self._buffered_bytes = value
+
+    @property
+    def identity(self):
+        """
+        Get the identity context of the user making the request, loaded when the request was authenticated.
+
+        :return: IdentityContext, or None if the request was not authenticated yet.
+        """
+        return self._identity
+
+    @identity.setter
+    def identity(self, value):
+        """
+        Sets the identity context of the user making the request.
+
+        :param value: IdentityContext object.
+        :return: None
+        """
+        self._identity = value
+
     def __repr__(self):
         return f"Request(type: {self._type}, user_id: {self._uid}, args: {self._args}, payload: {self._payload})"
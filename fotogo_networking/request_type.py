@@ -26,3 +26,14 @@ class RequestType(IntEnum):
     # External
     ExtAddImagesToAlbum = 14,
     ExtDeleteAlbum = 15,
+
+    # Server
+    GetServerMetrics = 16,
+
+
+# Requests that are served from the worker pool's priority lane, so the admin console stays responsive under load.
+PRIORITY_REQUEST_TYPES = frozenset({
+    RequestType.GenerateStatistics,
+    RequestType.GetUsers,
+    RequestType.GetServerMetrics,
+})
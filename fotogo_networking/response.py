@@ -1,18 +1,22 @@
+from collections.abc import Iterable
+
 from fotogo_networking.status_code import StatusCode
 
 
 class Response:
     """Represents a response from the server to the client."""
 
-    def __init__(self, status_code: StatusCode, payload=''):
+    def __init__(self, status_code: StatusCode, payload='', correlation_id=None):
         """
         Creates a Response() object.
 
         :param status_code: Response StatusCode
         :param payload: Response payload (optional)
+        :param correlation_id: The correlation id of the request this response answers (optional)
         """
         self._status_code = status_code
         self._payload = payload
+        self._correlation_id = correlation_id
 
     @property
     def status_code(self) -> StatusCode:
@@ -28,10 +32,65 @@ class Response:
         """
         The payload of the response.
 
+        Bytes-like objects (bytes, bytearray, memoryview) inside the payload are sent as binary attachments to clients
+        that use binary frames, and as base64 strings to JSON-only clients.
+
         :return: string
         """
         return self._payload
 
+    @property
+    def correlation_id(self):
+        """
+        The correlation id of the request this response answers. None if the request had none.
+
+        :return: The correlation id
+        """
+        return self._correlation_id
+
+    @correlation_id.setter
+    def correlation_id(self, value):
+        """
+        Sets the correlation id.
+
+        :param value: The correlation id of the request this response answers.
+        :return: None
+        """
+        self._correlation_id = value
+
     def __repr__(self):
         return f"Response(status_code: {self._status_code}, " \
                f"payload: {(str(len(self._payload)) + ' images') if type(self._payload) is list else self._payload})"
+
+
+class StreamingResponse(Response):
+    """
+    A response that is sent as a stream of frames instead of a single one.
+
+    The client first gets a frame with the status code and the header payload, then one frame per item (produced
+    lazily by the items iterable, only as fast as the client reads them), and finally an end-of-stream frame.
+    """
+
+    def __init__(self, status_code: StatusCode, header=None, items: Iterable = (), correlation_id=None):
+        """
+        Creates a StreamingResponse() object.
+
+        :param status_code: Response StatusCode
+        :param header: The payload of the stream's first frame (optional)
+        :param items: An iterable of the payloads of the item frames. Consumed while the response is being sent.
+        :param correlation_id: The correlation id of the request this response answers (optional)
+        """
+        super().__init__(status_code, header, correlation_id)
+        self._items = items
+
+    @property
+    def items(self) -> Iterable:
+        """
+        The payloads of the item frames.
+
+        :return: Iterable
+        """
+        return self._items
+
+    def __repr__(self):
+        return f"StreamingResponse(status_code: {self._status_code}, header: {self._payload})"
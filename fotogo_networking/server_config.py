@@ -0,0 +1,127 @@
+MAX_PAYLOAD_LENGTH = int.from_bytes(b'\xff\xff\xff\xff', "big")  # 4294967295 | 4,294,967,295 bytes
+
+
+class ServerConfig:
+    """
+    Holds the tunable settings of the server.
+
+    Passed to Framework, which hands it over to the socket server engine it creates.
+    """
+
+    def __init__(self, address: tuple[str, int] = ('0.0.0.0', 80), backlog: int = 128, max_workers: int = 32,
+                 keep_alive_timeout: float = 30, max_requests_per_connection: int = 100,
+                 max_pipelined_requests: int = 8, max_queued_requests: int = 64,
+                 max_queued_priority_requests: int = 16, max_stream_workers: int = 8,
+                 max_frame_size: int = MAX_PAYLOAD_LENGTH,
+                 spill_threshold: int = 8 * 1024 * 1024, connection_memory_budget: int = 64 * 1024 * 1024,
+                 spill_directory: str = None, compression_threshold: int = 1024,
+                 reuse_port: bool = False, tls_certfile: str = None, tls_keyfile: str = None,
+                 tls_session_tickets: bool = True, tls_tickets: int = 2, tls_handshake_timeout: float = 10,
+                 materialized_counters: bool = False, album_cache: bool = False, blob_cache_directory: str = None,
+                 blob_cache_size: int = 1024 * 1024 * 1024, blob_memory_cache_size: int = 0,
+                 signed_url_refresh_margin: float = 300, renditions: bool = False, rendition_processes: int = None):
+        """
+        Creates a ServerConfig object.
+
+        :param address: The (host, port) pair the server listens on. Default to port 80 on all interfaces.
+        :param backlog: How many clients can wait in the listen queue until they are accepted. Default to 128.
+        :param max_workers: How many endpoint calls can run at the same time (the size of the worker pool).
+        Default to 32.
+        :param keep_alive_timeout: How many seconds a keep-alive connection may stay idle between requests before it is
+        closed. Default to 30.
+        :param max_requests_per_connection: How many requests a keep-alive connection may carry before the server closes
+        it. Default to 100.
+        :param max_pipelined_requests: How many requests of a single keep-alive connection the asyncio engine executes
+        at the same time. Default to 8.
+        :param max_queued_requests: How many requests can wait for a free worker. Requests beyond that are answered
+        with 503 Service Unavailable right away. Default to 64.
+        :param max_queued_priority_requests: How many admin requests can wait in the worker pool's priority lane.
+        Default to 16.
+        :param max_stream_workers: How many frames of streamed responses the asyncio engine produces at the same time
+        (producing a frame may block, e.g. on a download). Streams wait for a free thread beyond that. Default to 8.
+        :param max_frame_size: The largest request frame (in bytes) the server accepts. Larger frames are answered with
+        413 Payload Too Large. Default to MAX_PAYLOAD_LENGTH (4 GB).
+        :param spill_threshold: Request frames larger than this (in bytes) are received into a temporary file instead of
+        memory. Default to 8 MB.
+        :param connection_memory_budget: How many bytes of request frames a single connection may hold in memory at
+        once. Frames that would exceed it are spilled to a temporary file too. Default to 64 MB.
+        :param spill_directory: Directory for the temporary files of spilled frames. Default to the system's temporary
+        directory.
+        :param compression_threshold: On connections that negotiated compression, response headers and attachments
+        shorter than this (in bytes) are sent uncompressed, since compressing them costs more than it saves. Default
+        to 1 KB.
+        :param reuse_port: Whether to bind the listening socket with SO_REUSEPORT, so several server processes can
+        listen on the same port and the kernel spreads the connections between them (see Supervisor). Default to
+        False.
+        :param tls_certfile: Path to the PEM certificate chain to terminate TLS with. None to serve plain TCP. Default
+        to None.
+        :param tls_keyfile: Path to the certificate's private key. None if it is inside tls_certfile. Default to None.
+        :param tls_session_tickets: Whether returning clients resume their TLS sessions with session tickets (True), or
+        with the server's session cache (False). Default to True.
+        :param tls_tickets: How many session tickets are sent after a full TLS 1.3 handshake - one per connection the
+        client may open in parallel. Default to 2.
+        :param tls_handshake_timeout: How many seconds a client has to complete the TLS handshake. Default to 10.
+        :param materialized_counters: Whether the database keeps materialized counters of the users, albums and images,
+        so GenerateStatistics reads them instead of counting the collections (see DBService). Default to False.
+        :param album_cache: Whether the albums of recently active users are cached in memory, kept fresh by snapshot
+        listeners, so their album reads cost no RPC (see AlbumIndexCache). Default to False.
+        :param blob_cache_directory: Directory to cache downloaded images in (see BlobCache). It is emptied when the
+        server starts. None to not cache them. Default to None.
+        :param blob_cache_size: How many bytes of images the cache directory may hold. Default to 1 GB.
+        :param blob_memory_cache_size: How many bytes of small images the cache also keeps in memory. Default to 0.
+        :param signed_url_refresh_margin: How many seconds before a cached signed URL (of an hour) expires it is signed
+        again (see SignedUrlCache). Default to 300.
+        :param renditions: Whether uploaded images get thumbnail and preview renditions, which requests can choose
+        instead of the originals (see RenditionPipeline). Needs Pillow. Default to False.
+        :param rendition_processes: How many worker processes render the renditions. Every server process starts its
+        own pool, so with several server processes (see Supervisor) it should be their share of the CPU cores. Default
+        to the number of CPU cores.
+        """
+        self.address = address
+        self.backlog = backlog
+        self.max_workers = max_workers
+        self.keep_alive_timeout = keep_alive_timeout
+        self.max_requests_per_connection = max_requests_per_connection
+        self.max_pipelined_requests = max_pipelined_requests
+        self.max_queued_requests = max_queued_requests
+        self.max_queued_priority_requests = max_queued_priority_requests
+        self.max_stream_workers = max_stream_workers
+        self.max_frame_size = max_frame_size
+        self.spill_threshold = spill_threshold
+        self.connection_memory_budget = connection_memory_budget
+        self.spill_directory = spill_directory
+        self.compression_threshold = compression_threshold
+        self.reuse_port = reuse_port
+        self.tls_certfile = tls_certfile
+        self.tls_keyfile = tls_keyfile
+        self.tls_session_tickets = tls_session_tickets
+        self.tls_tickets = tls_tickets
+        self.tls_handshake_timeout = tls_handshake_timeout
+        self.materialized_counters = materialized_counters
+        self.album_cache = album_cache
+        self.blob_cache_directory = blob_cache_directory
+        self.blob_cache_size = blob_cache_size
+        self.blob_memory_cache_size = blob_memory_cache_size
+        self.signed_url_refresh_margin = signed_url_refresh_margin
+        self.renditions = renditions
+        self.rendition_processes = rendition_processes
+
+    def __repr__(self):
+        return f"ServerConfig(address: {self.address}, backlog: {self.backlog}, max_workers: {self.max_workers}, " \
+               f"keep_alive_timeout: {self.keep_alive_timeout}, " \
+               f"max_requests_per_connection: {self.max_requests_per_connection}, " \
+               f"max_pipelined_requests: {self.max_pipelined_requests}, " \
+               f"max_queued_requests: {self.max_queued_requests}, " \
+               f"max_queued_priority_requests: {self.max_queued_priority_requests}, " \
+               f"max_stream_workers: {self.max_stream_workers}, " \
+               f"max_frame_size: {self.max_frame_size}, spill_threshold: {self.spill_threshold}, " \
+               f"connection_memory_budget: {self.connection_memory_budget}, spill_directory: {self.spill_directory}, " \
+               f"compression_threshold: {self.compression_threshold}, reuse_port: {self.reuse_port}, " \
+               f"tls_certfile: {self.tls_certfile}, tls_keyfile: {self.tls_keyfile}, " \
+               f"tls_session_tickets: {self.tls_session_tickets}, tls_tickets: {self.tls_tickets}, " \
+               f"tls_handshake_timeout: {self.tls_handshake_timeout}, " \
+               f"materialized_counters: {self.materialized_counters}, album_cache: {self.album_cache}, " \
+               f"blob_cache_directory: {self.blob_cache_directory}, blob_cache_size: {self.blob_cache_size}, " \
+               f"blob_memory_cache_size: {self.blob_memory_cache_size}, " \
+               f"signed_url_refresh_margin: {self.signed_url_refresh_margin}, renditions: {self.renditions}, " \
+               f"rendition_processes: {self.rendition_processes})"
@@ -1,24 +1,42 @@
 import socket
 import threading
 import ssl
+import time
 
 from fotogo_networking.logger import Fore
+from fotogo_networking.connection_context import ConnectionContext
 from fotogo_networking.data_transportation import *
+from fotogo_networking.request_type import PRIORITY_REQUEST_TYPES
+from fotogo_networking.server_config import ServerConfig
+from fotogo_networking.tls import HandshakeMetrics, create_server_context
+from fotogo_networking.worker_pool import WorkerPool
 
 
 class SocketServer:
-    """A secure, multi-threaded socket server."""
+    """
+    A secure, multi-threaded socket server.
 
-    def __init__(self, framework):
-        self._address = ('0.0.0.0', 80)
+    Every connection gets a thread that reads its requests and writes its responses, while the endpoints run on a
+    bounded WorkerPool. When the pool's queue is full, requests are answered with 503 Service Unavailable right away.
+
+    If the config has a TLS certificate, the server terminates TLS itself. The handshake runs on the connection's
+    thread, so a slow client cannot hold up the acceptor.
+    """
+
+    def __init__(self, framework, config: ServerConfig):
+        self._config = config
+        self._address = config.address
+        self._keep_alive_timeout = config.keep_alive_timeout
+        self._max_requests_per_connection = config.max_requests_per_connection
         self._socket: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # self._socket: SSLSocket = ssl.wrap_socket(self._socket,
-        #                                           certfile=r'fullchain.pem',
-        #                                           keyfile=r'privkey.pem',
-        #                                           # certfile=r'C:\Certbot\live\vm128.hisham.ru\fullchain.pem',
-        #                                           # keyfile=r'C:\Certbot\live\vm128.hisham.ru\privkey.pem',
-        #                                           server_side=True)
+        self._tls_context: ssl.SSLContext | None = None
+        self._handshake_metrics: HandshakeMetrics | None = None
+        if config.tls_certfile is not None:
+            self._tls_context = create_server_context(config)
+            self._handshake_metrics = HandshakeMetrics(framework.metrics, self._tls_context)
         self._client_accepting_thread = threading.Thread(target=self.__client_acceptor)
+        self._worker_pool = WorkerPool(config.max_workers, config.max_queued_requests,
+                                       config.max_queued_priority_requests, framework.metrics)
         self._active = False
         self._framework = framework
 
@@ -35,9 +53,12 @@ class SocketServer:
         :param backlog: How many backlogged clients are allowed (how many clients can wait in queue until they are
         accepted). Default to 1.
         """
+        if self._config.reuse_port:
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self._socket.bind(self._address)
         self._socket.listen(backlog)
         self._active = True
+        self._worker_pool.start()
         self._client_accepting_thread.start()
         self._framework.logger.info(f"Server is online. Listening on port {self._address[1]}", Fore.CYAN)
 
@@ -46,8 +67,12 @@ class SocketServer:
         while self._active:
             try:
                 client, address = self._socket.accept()
+                if not self._active:  # the wake-up connection made by stop()
+                    client.close()
+                    break
                 self._framework.logger.info("Client accepted")
-                threading.Thread(target=self.__connection_handler, args=[client]).start()
+                threading.Thread(target=self.__tls_connection_handler if self._tls_context is not None else
+                                 self.__connection_handler, args=[client]).start()
             except ssl.SSLEOFError as e:
                 self._framework.logger.error(str(e))
                 continue
@@ -57,47 +82,124 @@ class SocketServer:
             except ConnectionError as e:
                 self._framework.logger.error(str(e))
                 continue
+            except OSError as e:
+                if not self._active:  # the listening socket was shut down by stop()
+                    break
+                self._framework.logger.error(str(e))
+                continue
             except Exception as e:
                 self._framework.logger.error(str(e))
                 continue
 
+    def __tls_connection_handler(self, client: socket.socket):
+        """
+        Completes the TLS handshake with a client that connected to the server, and passes it on to
+        connection_handler.
+
+        :param client: Client's (plain) socket.
+        """
+        start = time.perf_counter()
+        try:
+            client.settimeout(self._config.tls_handshake_timeout)
+            client = self._tls_context.wrap_socket(client, server_side=True, do_handshake_on_connect=False)
+            client.do_handshake()
+            client.settimeout(None)
+        except (ssl.SSLError, OSError) as e:
+            self._handshake_metrics.record_failure()
+            self._framework.logger.error(f"TLS handshake failed: {e}")
+            client.close()
+            return
+        self._handshake_metrics.record(client, time.perf_counter() - start)
+        self.__connection_handler(client)
+
     def __connection_handler(self, client: SSLSocket):
         """
         Handles a client that connected to the server.
 
-        Passes the client's request to Framework, getting back the response and sends it back to the client.
+        Passes the client's requests to Framework, getting back the responses and sends them back to the client.
+        If the client asked for keep-alive, keeps serving requests from the connection (in the order they arrived)
+        until it is closed, stays idle for keep_alive_timeout or reaches max_requests_per_connection.
 
         :param client: Client's socket.
         """
+        connection = ConnectionContext(self._config, self._framework.metrics)
         try:
-            id_token, request = receive_request(client)
-            if not id_token:
-                send_response(request, client)
-                self._framework.logger.info(request)
-                client.shutdown(socket.SHUT_WR)
-                return
-            res: Response = self._framework.execute(id_token, request)
-
-            if not send_response(res, client):
-                self._framework.logger.error(
-                    f"Connection closed unexpectedly with client: {client.getsockname()}")
-            else:
+            while True:
+                id_token, request = receive_request(client, connection)
+                if request is None:  # closed or idle
+                    break
+                if not id_token:
+                    send_response(request, client, connection)
+                    self._framework.logger.info(request)
+                    break
+
+                connection.begin_request(request.keep_alive)
+                if connection.requests_served == 1 and connection.keep_alive:
+                    client.settimeout(self._keep_alive_timeout)
+
+                try:
+                    future = self._worker_pool.submit(self._framework.execute, id_token, request,
+                                                      priority=request.type in PRIORITY_REQUEST_TYPES)
+                    try:
+                        res: Response = future.result() if future is not None else \
+                            Response(StatusCode.ServiceUnavailable_503)
+                    except Exception as e:
+                        # an endpoint that raised is answered, so the client is not left waiting for its response
+                        self._framework.logger.error(str(e))
+                        res = Response(StatusCode.InternalServerError_500)
+                    res.correlation_id = request.correlation_id
+                    sent = send_response(res, client, connection, request.type)
+                finally:
+                    connection.release_memory(request.buffered_bytes)
+
+                if not sent:
+                    self._framework.logger.error(
+                        f"Connection closed unexpectedly with client: {client.getsockname()}")
+                    break
                 self._framework.logger.info(res)
 
-            client.shutdown(socket.SHUT_WR)
+                if not request.keep_alive or connection.requests_served >= self._max_requests_per_connection:
+                    break
+
+            self.__end_connection(client)
         except Exception as e:
             self._framework.logger.error(str(e))
-            client.shutdown(socket.SHUT_WR)
+            self.__end_connection(client)
             return
 
+    def __end_connection(self, client: socket.socket):
+        """
+        Signals the end of the responses to the client by shutting down the write side of the connection.
+
+        TLS connections send a close_notify alert first, since OpenSSL drops the session of a connection that was not
+        shut down cleanly from its session cache.
+
+        :param client: Client's socket.
+        """
+        if isinstance(client, ssl.SSLSocket):
+            client.settimeout(self._config.tls_handshake_timeout)
+            try:
+                client.unwrap()
+            except (ssl.SSLError, OSError):
+                pass
+        client.shutdown(socket.SHUT_WR)
+
     def stop(self):
         """
         Stops the server.
 
-        Sets active to False, closes the client_accepting_thread and shuts down the server's socket.
+        Sets active to False, closes the client_accepting_thread, shuts down the server's socket and waits for the
+        queued requests to finish.
         """
         self._active = False
+        # wake up the acceptor, which is blocked on accept(), so it can notice that the server is no longer active
+        if self._config.reuse_port:
+            # a wake-up connection could be balanced to another process listening on the port - shutting the socket
+            # down wakes up accept() instead (on Linux, where SO_REUSEPORT balances connections)
+            self._socket.shutdown(socket.SHUT_RDWR)
+        else:
+            socket.create_connection(('127.0.0.1', self._address[1])).close()
         self._client_accepting_thread.join()
-        socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect(('127.0.0.1', self._address[1]))
-        self._socket.shutdown(socket.SHUT_WR)
+        self._socket.close()
+        self._worker_pool.shutdown()
         self._framework.logger.info("Server has been shut down", Fore.CYAN)
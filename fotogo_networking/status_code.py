@@ -7,10 +7,13 @@ class StatusCode(IntEnum):
     """
     OK_200 = 200
     Created_201 = 201
+    MultiStatus_207 = 207
 
     BadRequest_400 = 400
     Unauthorized_401 = 401
     Forbidden_403 = 403
     NotFound_404 = 404
+    PayloadTooLarge_413 = 413
 
     InternalServerError_500 = 500
+    ServiceUnavailable_503 = 503
@@ -0,0 +1,143 @@
+import multiprocessing
+import multiprocessing.connection
+import signal
+import threading
+import time
+from collections.abc import Callable
+
+from fotogo_networking.logger import Fore, Logger
+
+
+class Supervisor:
+    """
+    Runs the server as several worker processes that share the listening port, and keeps them running.
+
+    Every worker is a fresh Python process (started with the "spawn" method, never forked from the supervisor), so it
+    builds its own Framework with its own Firebase clients and its own GIL. The workers bind the port with
+    SO_REUSEPORT (see ServerConfig.reuse_port) and the kernel spreads the incoming connections between them.
+
+    A worker that exits while the supervisor is running is restarted. Workers that keep crashing right after they start
+    are restarted with an exponential backoff, so a broken deployment does not turn into a fork loop.
+    """
+
+    def __init__(self, target: Callable[[], None], workers: int, logger: Logger, restart_delay: float = 1,
+                 max_restart_delay: float = 30, stop_timeout: float = 30):
+        """
+        Creates a Supervisor. The workers are started by run().
+
+        :param target: The function every worker process runs - typically builds a Framework and calls run_worker with
+        it. Must be importable by the worker processes (a module-level function).
+        :param workers: How many worker processes to run.
+        :param logger: Logger object.
+        :param restart_delay: How many seconds to wait before restarting a worker that crashed right after it started.
+        Doubles with every consecutive crash. Default to 1.
+        :param max_restart_delay: The longest the restart delay grows to, in seconds. Default to 30.
+        :param stop_timeout: How many seconds stop() waits for the workers to finish their in-flight requests before
+        killing them. Default to 30.
+        """
+        if workers < 1:
+            raise ValueError(f"Invalid workers count: {workers}")
+        self._target = target
+        self._workers_count = workers
+        self._logger = logger
+        self._restart_delay = restart_delay
+        self._max_restart_delay = max_restart_delay
+        self._stop_timeout = stop_timeout
+        self._context = multiprocessing.get_context('spawn')
+        self._workers: list[multiprocessing.Process | None] = [None] * workers
+        self._started_at = [0.0] * workers
+        self._crashes = [0] * workers
+        self._restart_at: dict[int, float] = {}
+        self._stopping = threading.Event()
+
+    @property
+    def workers(self) -> list[multiprocessing.Process | None]:
+        return list(self._workers)
+
+    def __start_worker(self, slot: int) -> None:
+        """Starts the worker process of the given slot."""
+        worker = self._context.Process(target=self._target, name=f"fotogo-server-{slot}")
+        worker.start()
+        self._workers[slot] = worker
+        self._started_at[slot] = time.monotonic()
+        self._logger.info(f"Started worker {slot} (pid {worker.pid})", Fore.CYAN)
+
+    def __worker_exited(self, slot: int) -> None:
+        """Schedules the restart of a worker that exited, backing off if it crashed right after it started."""
+        worker = self._workers[slot]
+        worker.join()
+        uptime = time.monotonic() - self._started_at[slot]
+        self._logger.error(f"Worker {slot} (pid {worker.pid}) exited with code {worker.exitcode} after {uptime:.1f}s")
+        worker.close()
+        self._workers[slot] = None
+
+        if uptime < self._max_restart_delay:
+            self._crashes[slot] += 1
+        else:
+            self._crashes[slot] = 0
+        delay = min(self._restart_delay * 2 ** (self._crashes[slot] - 1), self._max_restart_delay) \
+            if self._crashes[slot] else 0
+        self._restart_at[slot] = time.monotonic() + delay
+
+    def run(self) -> None:
+        """
+        Starts the workers and supervises them until stop() is called, or the supervisor gets SIGTERM or SIGINT.
+        Then stops the workers. Must be called from the main thread (it installs the signal handlers).
+        """
+        signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        signal.signal(signal.SIGINT, lambda *_: self.stop())
+
+        for slot in range(self._workers_count):
+            self.__start_worker(slot)
+
+        while not self._stopping.is_set():
+            sentinels = {worker.sentinel: slot for slot, worker in enumerate(self._workers) if worker is not None}
+            for sentinel in multiprocessing.connection.wait(list(sentinels), timeout=0.5):
+                self.__worker_exited(sentinels[sentinel])
+
+            now = time.monotonic()
+            for slot, restart_at in list(self._restart_at.items()):
+                if restart_at <= now and not self._stopping.is_set():
+                    del self._restart_at[slot]
+                    self.__start_worker(slot)
+
+        self.__stop_workers()
+
+    def stop(self) -> None:
+        """Asks the supervisor to stop the workers. run() returns once they are stopped."""
+        self._stopping.set()
+
+    def __stop_workers(self) -> None:
+        """Sends SIGTERM to the workers, waits for them to stop and kills the ones that do not stop in time."""
+        self._logger.info("Stopping workers", Fore.CYAN)
+        workers = [worker for worker in self._workers if worker is not None]
+        for worker in workers:
+            worker.terminate()
+
+        deadline = time.monotonic() + self._stop_timeout
+        for worker in workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+            if worker.is_alive():
+                self._logger.error(f"Worker (pid {worker.pid}) did not stop in time, killing it")
+                worker.kill()
+                worker.join()
+            worker.close()
+        self._workers = [None] * self._workers_count
+
+
+def run_worker(framework) -> None:
+    """
+    Runs a Framework as a supervised worker process, until the process gets SIGTERM.
+
+    SIGINT is ignored - when Ctrl+C reaches the whole process group, the supervisor decides how the workers stop.
+
+    :param framework: The worker's Framework object.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    terminated = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: terminated.set())
+
+    framework.config.reuse_port = True
+    framework.start()
+    terminated.wait()
+    framework.stop()
@@ -0,0 +1,99 @@
+import ssl
+import threading
+import time
+from collections import deque
+
+from fotogo_networking.metrics import Metrics
+from fotogo_networking.server_config import ServerConfig
+
+
+def create_server_context(config: ServerConfig) -> ssl.SSLContext:
+    """
+    Creates the SSLContext the socket server engines terminate TLS with.
+
+    Returning clients can skip the full handshake in two ways, both handled by OpenSSL:
+
+    * Session tickets (the default): the session state is encrypted into a ticket the client keeps, so the server holds
+      no state per client. In TLS 1.3, config.tls_tickets tickets are sent after every full handshake.
+    * Session cache: with tickets disabled (config.tls_session_tickets=False), the server keeps the sessions in its
+      in-memory session cache, and the client resumes by session id instead.
+
+    Either way, resumption only works within one process - every worker process of a Supervisor has its own ticket
+    keys and session cache.
+
+    :param config: The ServerConfig with the certificate and the session resumption settings.
+    :return: ssl.SSLContext
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(config.tls_certfile, config.tls_keyfile)
+    context.options |= ssl.OP_NO_COMPRESSION
+    if config.tls_session_tickets:
+        context.num_tickets = config.tls_tickets
+    else:
+        context.options |= ssl.OP_NO_TICKET
+    return context
+
+
+class HandshakeMetrics:
+    """
+    Reports the TLS handshakes of a socket server engine into the server's Metrics.
+
+    * Counters: tls.handshakes, tls.handshakes.resumed and tls.handshakes.failed.
+    * Timing: tls.handshake_seconds (threaded engine only - the asyncio engine handshakes inside the event loop).
+    * Gauges: tls.handshake_rate (handshakes per second over the last window_seconds), tls.resumption_hit_rate (the
+      share of the handshakes that resumed a session) and tls.session_cache.size.
+    """
+
+    def __init__(self, metrics: Metrics, context: ssl.SSLContext, window_seconds: float = 60):
+        """
+        Creates a HandshakeMetrics object and registers its gauges.
+
+        :param metrics: Metrics registry to report into.
+        :param context: The server's SSLContext.
+        :param window_seconds: The time window tls.handshake_rate is computed over. Default to 60.
+        """
+        self._metrics = metrics
+        self._window_seconds = window_seconds
+        self._recent_handshakes: deque[float] = deque()
+        self._lock = threading.Lock()
+
+        metrics.register_gauge('tls.handshake_rate', self.__handshake_rate)
+        metrics.register_gauge('tls.resumption_hit_rate', self.__resumption_hit_rate)
+        metrics.register_gauge('tls.session_cache.size', lambda: context.session_stats()['number'])
+
+    def record(self, ssl_object: ssl.SSLObject | ssl.SSLSocket, duration: float = None) -> None:
+        """
+        Records a completed handshake.
+
+        :param ssl_object: The connection's SSLSocket (threaded engine) or SSLObject (asyncio engine).
+        :param duration: How many seconds the handshake took, if known.
+        """
+        self._metrics.increment('tls.handshakes')
+        if ssl_object.session_reused:
+            self._metrics.increment('tls.handshakes.resumed')
+        if duration is not None:
+            self._metrics.observe('tls.handshake_seconds', duration)
+
+        now = time.monotonic()
+        with self._lock:
+            self._recent_handshakes.append(now)
+            self.__expire(now)
+
+    def record_failure(self) -> None:
+        """Records a handshake that failed or timed out."""
+        self._metrics.increment('tls.handshakes.failed')
+
+    def __expire(self, now: float) -> None:
+        """Forgets the handshakes that are older than the window. Must be called with the lock held."""
+        while self._recent_handshakes and self._recent_handshakes[0] < now - self._window_seconds:
+            self._recent_handshakes.popleft()
+
+    def __handshake_rate(self) -> float:
+        with self._lock:
+            self.__expire(time.monotonic())
+            return len(self._recent_handshakes) / self._window_seconds
+
+    def __resumption_hit_rate(self) -> float:
+        handshakes = self._metrics.counter('tls.handshakes')
+        return self._metrics.counter('tls.handshakes.resumed') / handshakes if handshakes else 0
@@ -0,0 +1,103 @@
+import threading
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future
+
+from fotogo_networking.metrics import Metrics
+
+
+class WorkerPool:
+    """
+    A fixed-size pool of worker threads with admission control.
+
+    Work waits in one of two bounded queues: the priority lane, which the workers always drain first, and the normal
+    lane. Work submitted to a full lane is not queued at all - it is shed, so the caller can answer right away instead
+    of waiting behind a queue that cannot drain in time.
+    """
+
+    def __init__(self, workers: int, queue_size: int, priority_queue_size: int, metrics: Metrics):
+        """
+        Creates a WorkerPool. The worker threads are started by start().
+
+        :param workers: Number of worker threads.
+        :param queue_size: Maximal number of work items waiting in the normal lane.
+        :param priority_queue_size: Maximal number of work items waiting in the priority lane.
+        :param metrics: Metrics registry to report queue depths and shed counters into.
+        """
+        self._workers_count = workers
+        self._queue_size = queue_size
+        self._priority_queue_size = priority_queue_size
+        self._queue: deque = deque()
+        self._priority_queue: deque = deque()
+        self._condition = threading.Condition()
+        self._workers: list[threading.Thread] = []
+        self._busy_workers = 0
+        self._running = False
+        self._metrics = metrics
+
+        metrics.register_gauge('worker_pool.queue_depth', lambda: len(self._queue))
+        metrics.register_gauge('worker_pool.priority_queue_depth', lambda: len(self._priority_queue))
+        metrics.register_gauge('worker_pool.busy_workers', lambda: self._busy_workers)
+
+    def start(self) -> None:
+        """Starts the worker threads."""
+        self._running = True
+        self._workers = [threading.Thread(target=self.__worker, name=f"fotogo-worker-{i}", daemon=True)
+                         for i in range(self._workers_count)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, fn: Callable, *args, priority: bool = False) -> Future | None:
+        """
+        Submits work to the pool.
+
+        :param fn: The function to call on a worker thread.
+        :param args: The arguments to call fn with.
+        :param priority: Whether to queue the work in the priority lane.
+        :return: A Future of fn's result, or None if the lane is full and the work was shed.
+        """
+        queue, limit, lane = (self._priority_queue, self._priority_queue_size, 'priority') if priority else \
+            (self._queue, self._queue_size, 'normal')
+        with self._condition:
+            if not self._running or len(queue) >= limit:
+                self._metrics.increment(f'worker_pool.shed.{lane}')
+                return None
+
+            future = Future()
+            queue.append((future, fn, args))
+            self._condition.notify()
+
+        self._metrics.increment(f'worker_pool.admitted.{lane}')
+        return future
+
+    def __worker(self):
+        """Runs queued work, priority lane first, until the pool is shut down and both lanes are drained."""
+        while True:
+            with self._condition:
+                while self._running and not self._priority_queue and not self._queue:
+                    self._condition.wait()
+                if self._priority_queue:
+                    future, fn, args = self._priority_queue.popleft()
+                elif self._queue:
+                    future, fn, args = self._queue.popleft()
+                else:  # shut down
+                    return
+                self._busy_workers += 1
+
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._condition:
+                    self._busy_workers -= 1
+
+    def shutdown(self) -> None:
+        """Stops accepting work, lets the workers drain the queued work and waits for them to finish."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join()
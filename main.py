@@ -1,11 +1,83 @@
+import argparse
+import os
 import sys
 from datetime import datetime, timedelta
 
-from fotogo_networking.endpoints import app
+from fotogo_networking.logger import Logger
+from fotogo_networking.supervisor import Supervisor, run_worker
+
+
+def worker_main():
+    """Entry point of a worker process - builds its own Framework (and Firebase clients) and serves until stopped."""
+    from fotogo_networking.endpoints import app
+    run_worker(app)
 
 
 def main():
-    app.start()
+    parser = argparse.ArgumentParser(description="Fotogo server.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of server processes sharing the port. 0 for one per CPU core. Default to 1 "
+                             "(a single process, without a supervisor).")
+    parser.add_argument('--certfile', help="PEM certificate chain to terminate TLS with. Default to plain TCP.")
+    parser.add_argument('--keyfile', help="The certificate's private key, if it is not inside the certificate file.")
+    parser.add_argument('--materialized-counters', action='store_true',
+                        help="Keep materialized counters of the users, albums and images for the admin statistics.")
+    parser.add_argument('--reconcile-counters', action='store_true',
+                        help="Rebuild the materialized counters from the database, and exit.")
+    parser.add_argument('--album-cache', action='store_true',
+                        help="Cache the albums of recently active users in memory, kept fresh by snapshot listeners.")
+    parser.add_argument('--blob-cache', metavar='DIRECTORY',
+                        help="Cache downloaded images in a directory (a subdirectory per worker process).")
+    parser.add_argument('--blob-cache-size', type=int, help="How many bytes of images the cache may hold on disk.")
+    parser.add_argument('--blob-memory-cache-size', type=int,
+                        help="How many bytes of small images the cache also keeps in memory.")
+    parser.add_argument('--renditions', action='store_true',
+                        help="Generate thumbnail and preview renditions of uploaded images. Needs Pillow.")
+    parser.add_argument('--rendition-processes', type=int,
+                        help="How many processes render the renditions, per server process. Default to the server "
+                             "process' share of the CPU cores.")
+    parser.add_argument('--generate-renditions', action='store_true',
+                        help="Generate the thumbnail and preview renditions of the images that have none, and exit.")
+    args = parser.parse_args()
+
+    # passed through the environment, so the worker processes build their Framework with the same TLS settings
+    if args.certfile:
+        os.environ['FOTOGO_TLS_CERTFILE'] = args.certfile
+    if args.keyfile:
+        os.environ['FOTOGO_TLS_KEYFILE'] = args.keyfile
+    if args.materialized_counters:
+        os.environ['FOTOGO_COUNTERS'] = '1'
+    if args.album_cache:
+        os.environ['FOTOGO_ALBUM_CACHE'] = '1'
+    if args.blob_cache:
+        os.environ['FOTOGO_BLOB_CACHE'] = args.blob_cache
+    if args.blob_cache_size is not None:
+        os.environ['FOTOGO_BLOB_CACHE_SIZE'] = str(args.blob_cache_size)
+    if args.blob_memory_cache_size is not None:
+        os.environ['FOTOGO_BLOB_MEMORY_CACHE_SIZE'] = str(args.blob_memory_cache_size)
+    if args.renditions or args.generate_renditions:
+        os.environ['FOTOGO_RENDITIONS'] = '1'
+
+    # every server process renders in its own pool, so the CPU cores are split between them
+    workers = args.workers or os.cpu_count()
+    os.environ['FOTOGO_RENDITION_PROCESSES'] = str(args.rendition_processes or max(1, os.cpu_count() // workers))
+
+    if args.reconcile_counters:
+        from fotogo_networking.endpoints import app
+        Logger("fotogo").info(f"Reconciled the counters: {app.db.reconcile_counters()}")
+        return
+
+    if args.generate_renditions:
+        from fotogo_networking.endpoints.images_endpoints import generate_missing_renditions
+        Logger("fotogo").info(f"Generated the renditions of {generate_missing_renditions()} images")
+        return
+
+    if workers == 1:
+        from fotogo_networking.endpoints import app
+        app.start()
+        return
+
+    Supervisor(worker_main, workers, Logger("fotogo")).run()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,216 @@
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from db_services.album_cache import AlbumIndexCache
+
+_ALBUMS, _TOMBSTONES, _IMAGES = 'Albums', 'AlbumTombstones', 'Images'
+
+
+class _Snapshot:
+    """Fake DocumentSnapshot."""
+
+    def __init__(self, document_id: str, **fields):
+        self.id = document_id
+        self._fields = fields
+
+    def to_dict(self) -> dict:
+        return dict(self._fields)
+
+
+class _Type:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class _Change:
+    """Fake DocumentChange."""
+
+    def __init__(self, type_name: str, document: _Snapshot):
+        self.type = _Type(type_name)
+        self.document = document
+
+
+class _Watch:
+    """Fake snapshot listener, that delivers the snapshots the tests push."""
+
+    def __init__(self, collection: str, uid: str, callback):
+        self.collection = collection
+        self.uid = uid
+        self.callback = callback
+        self.is_active = True
+
+    def push(self, *changes: tuple[str, _Snapshot], read_time: datetime = None):
+        self.callback([], [_Change(type_name, document) for type_name, document in changes],
+                      read_time if read_time is not None else datetime.now(timezone.utc))
+
+    def unsubscribe(self):
+        self.is_active = False
+
+
+class _Query:
+    def __init__(self, db, collection: str):
+        self._db = db
+        self._collection = collection
+        self._uid = None
+
+    def where(self, field: str, op: str, value):
+        assert (field, op) == ('owner_id', '==')
+        self._uid = value
+        return self
+
+    def on_snapshot(self, callback) -> _Watch:
+        watch = _Watch(self._collection, self._uid, callback)
+        self._db.watches.append(watch)
+        return watch
+
+
+class _Firestore:
+    """Fake Firestore client, that records the listeners started on it."""
+
+    def __init__(self):
+        self.watches: list[_Watch] = []
+
+    def collection(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    def watch(self, uid: str, collection: str) -> _Watch:
+        return next(i for i in self.watches if i.uid == uid and i.collection == collection and i.is_active)
+
+    def active(self, uid: str = None) -> list[_Watch]:
+        return [i for i in self.watches if i.is_active and uid in (None, i.uid)]
+
+
+class AlbumIndexCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.db = _Firestore()
+        self.cache = self._cache()
+
+    def tearDown(self):
+        self.cache.close()
+
+    def _cache(self, **kwargs) -> AlbumIndexCache:
+        return AlbumIndexCache(self.db, _ALBUMS, _TOMBSTONES, _IMAGES, **kwargs)
+
+    def _cache_user(self, uid: str, cache: AlbumIndexCache = None, albums=(), images=(), tombstones=()):
+        """Touches a user twice, so it is cached, and delivers the first snapshots of its listeners."""
+        cache = cache if cache is not None else self.cache
+        cache.touch(uid)
+        cache.touch(uid)
+        self.db.watch(uid, _ALBUMS).push(*(('ADDED', i) for i in albums))
+        self.db.watch(uid, _TOMBSTONES).push(*(('ADDED', i) for i in tombstones))
+        self.db.watch(uid, _IMAGES).push(*(('ADDED', i) for i in images))
+
+    def test_caches_a_user_on_the_second_miss(self):
+        self.cache.touch('user')
+        self.assertEqual(self.db.active(), [])
+        self.cache.touch('user')
+        self.assertEqual(sorted(i.collection for i in self.db.active('user')), sorted([_ALBUMS, _TOMBSTONES, _IMAGES]))
+
+    def test_misses_until_every_listener_synced(self):
+        self.cache.touch('user')
+        self.cache.touch('user')
+        self.db.watch('user', _ALBUMS).push(('ADDED', _Snapshot('a1', owner_id='user')))
+        self.db.watch('user', _TOMBSTONES).push()
+        self.assertIsNone(self.cache.user_albums('user'))
+        self.db.watch('user', _IMAGES).push()
+        self.assertEqual([i.id for i in self.cache.user_albums('user')], ['a1'])
+
+    def test_applies_album_changes(self):
+        self._cache_user('user', albums=[_Snapshot('a1', name='first'), _Snapshot('a2', name='second')])
+        albums = self.db.watch('user', _ALBUMS)
+        albums.push(('MODIFIED', _Snapshot('a1', name='renamed')), ('REMOVED', _Snapshot('a2', name='second')),
+                    ('ADDED', _Snapshot('a3', name='third')))
+        self.assertEqual({i.id: i.to_dict()['name'] for i in self.cache.user_albums('user')},
+                         dict(a1='renamed', a3='third'))
+        self.assertEqual(self.cache.get_album('a1').to_dict()['name'], 'renamed')
+        self.assertIsNone(self.cache.get_album('a2'))
+
+    def test_applies_tombstone_changes(self):
+        self._cache_user('user', tombstones=[_Snapshot('a1')])
+        self.db.watch('user', _TOMBSTONES).push(('ADDED', _Snapshot('a2')), ('REMOVED', _Snapshot('a1')))
+        self.assertEqual([i.id for i in self.cache.user_tombstones('user')], ['a2'])
+
+    def test_applies_image_changes_to_the_membership(self):
+        self._cache_user('user', albums=[_Snapshot('a1'), _Snapshot('a2')], images=[
+            _Snapshot('x.jpg', containing_albums=['a1', 'a2']), _Snapshot('y.jpg', containing_albums=['a1'])])
+        self.assertEqual(self.cache.album_image_ids('user', 'a1'), {'x.jpg', 'y.jpg'})
+        self.assertEqual(self.cache.album_image_ids('user', 'a2'), {'x.jpg'})
+
+        images = self.db.watch('user', _IMAGES)
+        images.push(('MODIFIED', _Snapshot('x.jpg', containing_albums=['a2'])))
+        self.assertEqual(self.cache.album_image_ids('user', 'a1'), {'y.jpg'})
+        images.push(('REMOVED', _Snapshot('y.jpg', containing_albums=['a1'])),
+                    ('ADDED', _Snapshot('z.jpg', containing_albums=None)))
+        self.assertEqual(self.cache.album_image_ids('user', 'a1'), set())
+        self.assertEqual(self.cache.album_image_ids('user', 'a2'), {'x.jpg'})
+
+    def test_synced_at(self):
+        self.assertIsNone(self.cache.synced_at('user'))
+        self._cache_user('user')
+        now = datetime.now(timezone.utc)
+        self.db.watch('user', _ALBUMS).push(read_time=now)
+        self.db.watch('user', _TOMBSTONES).push(read_time=now - timedelta(seconds=1))
+        self.db.watch('user', _IMAGES).push(read_time=now - timedelta(seconds=2))
+        # the images listener does not affect the albums and tombstones
+        self.assertEqual(self.cache.synced_at('user'), now - timedelta(seconds=1))
+
+    def test_failed_listener_stops_the_others(self):
+        self._cache_user('user')
+        self.db.watch('user', _IMAGES).is_active = False
+        self.assertIsNone(self.cache.user_albums('user'))
+        deadline = time.monotonic() + 5
+        while self.db.active('user') and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.db.active('user'), [])
+
+        # listened to again on the next misses
+        self._cache_user('user')
+        self.assertEqual(self.cache.user_albums('user'), [])
+
+    def test_evicts_least_recently_used_users(self):
+        self.cache = self._cache(max_users=2)
+        self._cache_user('u1', self.cache)
+        self._cache_user('u2', self.cache)
+        self.cache.user_albums('u1')  # u2 is now the least recently used
+        self._cache_user('u3', self.cache)
+        self.assertEqual(self.db.active('u2'), [])
+        self.assertEqual(len(self.db.active('u1')), 3)
+        self.assertEqual(len(self.db.active('u3')), 3)
+        self.assertEqual(self.cache._metrics.counter('album_cache.evictions'), 1)
+
+    def test_evicts_users_over_the_memory_budget(self):
+        # a user's listeners alone take more than the budget, so only the most recently used user is kept
+        self.cache = self._cache(memory_budget=1)
+        self._cache_user('u1', self.cache)
+        self._cache_user('u2', self.cache)
+        self.assertEqual(self.db.active('u1'), [])
+        self.assertEqual(self.cache.user_albums('u2'), [])
+
+    def test_idle_users(self):
+        self.cache = self._cache(idle_timeout=10)
+        now = time.monotonic()
+        with mock.patch('db_services.album_cache.time.monotonic', return_value=now):
+            self.cache.touch('u1')
+        with mock.patch('db_services.album_cache.time.monotonic', return_value=now + 11):
+            # the previous miss is too old to count
+            self.cache.touch('u1')
+            self.assertEqual(self.db.active(), [])
+            self._cache_user('u2', self.cache)
+        with mock.patch('db_services.album_cache.time.monotonic', return_value=now + 22):
+            self._cache_user('u1', self.cache)
+        self.assertEqual(self.db.active('u2'), [])
+
+    def test_ignores_the_listeners_of_evicted_users(self):
+        self._cache_user('user', albums=[_Snapshot('a1')])
+        albums = self.db.watch('user', _ALBUMS)
+        self.cache.close()
+        self.assertEqual(self.db.active(), [])
+        albums.push(('ADDED', _Snapshot('a2')))
+        self.assertIsNone(self.cache.user_albums('user'))
+        self.assertIsNone(self.cache.get_album('a1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
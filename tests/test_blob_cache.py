@@ -0,0 +1,150 @@
+import os
+import tempfile
+import unittest
+
+from db_services.blob_cache import BlobCache, remove_stale_process_directories
+from fotogo_networking.metrics import Metrics
+
+
+class _Storage:
+    """Fake storage, that counts the downloads the cache makes."""
+
+    def __init__(self):
+        self.blobs = {}  # blob path -> (contents, generation)
+        self.downloads = []
+
+    def downloader(self, blob_path: str):
+        def download(generation):
+            self.downloads.append((blob_path, generation))
+            data, current_generation = self.blobs[blob_path]
+            return (None, generation) if generation == current_generation else (data, current_generation)
+        return download
+
+
+class BlobCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._temp = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self._temp.name, 'cache')
+        self.storage = _Storage()
+        self.metrics = Metrics()
+
+    def tearDown(self):
+        self._temp.cleanup()
+
+    def _cache(self, **kwargs) -> BlobCache:
+        return BlobCache(self.directory, metrics=self.metrics, **kwargs)
+
+    def _get(self, cache: BlobCache, blob_path: str) -> bytes:
+        return cache.get(blob_path, self.storage.downloader(blob_path))
+
+    def _files(self) -> list[str]:
+        return [name for _, _, names in os.walk(self.directory) for name in names]
+
+    def test_hit(self):
+        cache = self._cache()
+        self.storage.blobs['u/a.jpg'] = (b'a' * 10, 1)
+        self.assertEqual(self._get(cache, 'u/a.jpg'), b'a' * 10)
+        self.assertEqual(self._get(cache, 'u/a.jpg'), b'a' * 10)
+        self.assertEqual(self.storage.downloads, [('u/a.jpg', None)])
+        self.assertEqual(self.metrics.counter('blob_cache.hits'), 1)
+        self.assertEqual(self.metrics.counter('blob_cache.bytes_saved'), 10)
+
+    def test_evicts_least_recently_used(self):
+        cache = self._cache(max_bytes=25)
+        for name in 'abc':
+            self.storage.blobs[name] = (name.encode() * 10, 1)
+        self._get(cache, 'a')
+        self._get(cache, 'b')
+        self._get(cache, 'a')  # b is now the least recently used
+        self._get(cache, 'c')
+        self.assertEqual(self.metrics.counter('blob_cache.evictions'), 1)
+        self.assertEqual(len(self._files()), 2)
+
+        self.storage.downloads.clear()
+        self._get(cache, 'a')
+        self._get(cache, 'c')
+        self.assertEqual(self.storage.downloads, [])
+        self._get(cache, 'b')
+        self.assertEqual(self.storage.downloads, [('b', None)])
+
+    def test_stores_same_contents_once(self):
+        cache = self._cache(max_bytes=15)
+        self.storage.blobs['a'] = self.storage.blobs['b'] = (b'x' * 10, 1)
+        self._get(cache, 'a')
+        self._get(cache, 'b')
+        self.assertEqual(len(self._files()), 1)
+        self.assertEqual(self.metrics.snapshot()['gauges']['blob_cache.bytes'], 10)
+
+        # the contents are kept while another blob still references them
+        cache.invalidate('a')
+        self.storage.downloads.clear()
+        self.assertEqual(self._get(cache, 'b'), b'x' * 10)
+        self.assertEqual(self.storage.downloads, [])
+        cache.invalidate('b')
+        self.assertEqual(self._files(), [])
+        self.assertEqual(self.metrics.snapshot()['gauges']['blob_cache.bytes'], 0)
+
+    def test_does_not_cache_blobs_larger_than_the_budget(self):
+        cache = self._cache(max_bytes=5)
+        self.storage.blobs['a'] = (b'a' * 10, 1)
+        self.assertEqual(self._get(cache, 'a'), b'a' * 10)
+        self.assertEqual(self._get(cache, 'a'), b'a' * 10)
+        self.assertEqual(len(self.storage.downloads), 2)
+        self.assertEqual(self._files(), [])
+
+    def test_revalidates_against_the_generation(self):
+        cache = self._cache(revalidate_after=0)
+        self.storage.blobs['a'] = (b'old', 1)
+        self._get(cache, 'a')
+        self.assertEqual(self._get(cache, 'a'), b'old')
+        self.storage.blobs['a'] = (b'new', 2)
+        self.assertEqual(self._get(cache, 'a'), b'new')
+        self.assertEqual(self.storage.downloads, [('a', None), ('a', 1), ('a', 1)])
+        self.assertEqual(len(self._files()), 1)
+
+    def test_invalidate_directory(self):
+        cache = self._cache()
+        for blob_path in ('u1/a', 'u1/b', 'u2/a'):
+            self.storage.blobs[blob_path] = (blob_path.encode(), 1)
+            self._get(cache, blob_path)
+        cache.invalidate_directory('u1/')
+        self.storage.downloads.clear()
+        for blob_path in ('u1/a', 'u1/b', 'u2/a'):
+            self._get(cache, blob_path)
+        self.assertEqual(self.storage.downloads, [('u1/a', None), ('u1/b', None)])
+
+    def test_memory_tier(self):
+        cache = self._cache(memory_size=25, memory_item_size=10)
+        for name, length in (('a', 10), ('b', 10), ('c', 10), ('big', 11)):
+            self.storage.blobs[name] = (name.encode()[:1] * length, 1)
+            self._get(cache, name)
+        self.assertEqual(self.metrics.snapshot()['gauges']['blob_cache.memory_bytes'], 20)
+
+        self._get(cache, 'c')
+        self._get(cache, 'big')
+        self.assertEqual(self.metrics.counter('blob_cache.memory_hits'), 1)
+
+    def test_empties_the_directory(self):
+        os.makedirs(self.directory)
+        with open(os.path.join(self.directory, 'leftover'), 'wb') as f:
+            f.write(b'x')
+        self._cache()
+        self.assertEqual(self._files(), [])
+
+
+class RemoveStaleProcessDirectoriesTest(unittest.TestCase):
+    def test_removes_directories_of_exited_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # pid_max is at most 2 ** 22, so the last directory cannot belong to a running process
+            for name in (str(os.getpid()), str(os.getppid()), 'shared', str(2 ** 22 + 1)):
+                os.makedirs(os.path.join(directory, name, 'ab'))
+            self.assertEqual(remove_stale_process_directories(directory), 1)
+            self.assertEqual(sorted(os.listdir(directory)), sorted([str(os.getpid()), str(os.getppid()), 'shared']))
+
+    def test_missing_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual(remove_stale_process_directories(os.path.join(directory, 'missing')), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import base64
+import json
+import unittest
+from datetime import datetime, timezone
+
+from db_services.db_service import DBService
+
+
+class CursorsTest(unittest.TestCase):
+    def test_round_trip(self):
+        for timestamp in ('2023-01-31 12:00:00', 1675166400, 1675166400.5, datetime(2023, 1, 31, 12),
+                          datetime(2023, 1, 31, 12, tzinfo=timezone.utc), None):
+            with self.subTest(timestamp=timestamp):
+                cursor = DBService._encode_cursor(timestamp, 'image/id.jpg')
+                self.assertEqual(DBService._decode_cursor(cursor), (timestamp, 'image/id.jpg'))
+
+    def test_keeps_the_timestamp_type(self):
+        # Firestore orders values of different types apart, so a datetime must not come back as a string
+        timestamp, _ = DBService._decode_cursor(DBService._encode_cursor(datetime(2023, 1, 31), 'a.jpg'))
+        self.assertIsInstance(timestamp, datetime)
+        timestamp, _ = DBService._decode_cursor(DBService._encode_cursor('2023-01-31T00:00:00', 'a.jpg'))
+        self.assertIsInstance(timestamp, str)
+
+    def test_is_url_safe(self):
+        cursor = DBService._encode_cursor('???>>>', '~~~')
+        self.assertNotIn('+', cursor)
+        self.assertNotIn('/', cursor)
+
+    def test_malformed(self):
+        unknown_kind = base64.urlsafe_b64encode(json.dumps(['date', 1, 'a.jpg']).encode()).decode()
+        too_short = base64.urlsafe_b64encode(json.dumps(['value', 1]).encode()).decode()
+        bad_datetime = base64.urlsafe_b64encode(json.dumps(['datetime', 'yesterday', 'a.jpg']).encode()).decode()
+        for cursor in ('', 'not a cursor', unknown_kind, too_short, bad_datetime, 'e30='):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(ValueError):
+                    DBService._decode_cursor(cursor)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+
+from fotogo_networking.connection_context import ConnectionContext
+from fotogo_networking.data_transportation import _parse_binary_frame, _serialize_binary_frame, parse_request
+from fotogo_networking.frame_codecs import JSON_CODEC, JsonCodec
+from fotogo_networking.frame_compression import ZlibCompressor
+from fotogo_networking.request_type import RequestType
+
+_IMAGE = b'\x00\x01\x02' * 1000
+
+
+def _frame(header: dict, compressor=None, compression_threshold: int = 0) -> memoryview:
+    pieces, _ = _serialize_binary_frame(header, JsonCodec(), compressor, compression_threshold)
+    return memoryview(b''.join(pieces))
+
+
+class BinaryFrameTest(unittest.TestCase):
+    def test_round_trip(self):
+        header = dict(request_id=4, payload=[dict(file_name='a.jpg', data=_IMAGE), dict(file_name='b.jpg', data=b'')])
+        parsed, codec, compressor = _parse_binary_frame(_frame(header))
+        self.assertEqual(codec.codec_id, JSON_CODEC.codec_id)
+        self.assertIsNone(compressor)
+        self.assertEqual([bytes(i['data']) for i in parsed['payload']], [_IMAGE, b''])
+        self.assertEqual([i['file_name'] for i in parsed['payload']], ['a.jpg', 'b.jpg'])
+
+    def test_attachments_are_not_copied(self):
+        frame = _frame(dict(data=_IMAGE))
+        parsed, _, _ = _parse_binary_frame(frame)
+        self.assertIsInstance(parsed['data'], memoryview)
+        self.assertIs(parsed['data'].obj, frame.obj)
+
+    def test_compressed_round_trip(self):
+        header = dict(payload=[dict(file_name='a.jpg', data=_IMAGE)], names=['album'] * 100)
+        frame = _frame(header, ZlibCompressor())
+        self.assertLess(len(frame), len(_IMAGE))
+        parsed, _, compressor = _parse_binary_frame(frame)
+        self.assertEqual(compressor.name, 'zlib')
+        self.assertEqual(bytes(parsed['payload'][0]['data']), _IMAGE)
+        self.assertEqual(parsed['names'], ['album'] * 100)
+
+    def test_compression_threshold(self):
+        pieces, uncompressed_length = _serialize_binary_frame(dict(data=_IMAGE), JsonCodec(), ZlibCompressor(),
+                                                              len(_IMAGE) + 1)
+        self.assertEqual(len(b''.join(pieces)), uncompressed_length)
+
+    def test_decompression_is_bounded(self):
+        with self.assertRaises(ValueError):
+            _parse_binary_frame(_frame(dict(data=_IMAGE), ZlibCompressor()), len(_IMAGE) - 1)
+
+    def test_attachment_exceeding_the_frame(self):
+        with self.assertRaises(ValueError):
+            _parse_binary_frame(_frame(dict(data=_IMAGE))[:-1])
+
+
+class ParseRequestTest(unittest.TestCase):
+    def test_json_frame(self):
+        connection = ConnectionContext()
+        id_token, request = parse_request(b'{"id_token": "token", "request_id": 4, "args": {"name": "a"}, '
+                                          b'"payload": [], "correlation_id": "c1", "keep_alive": true}', connection)
+        self.assertEqual(id_token, 'token')
+        self.assertEqual(request.type, RequestType.CreateAlbum)
+        self.assertEqual(request.args, dict(name='a'))
+        self.assertEqual(request.correlation_id, 'c1')
+        self.assertTrue(request.keep_alive)
+        self.assertFalse(connection.binary)
+
+    def test_binary_frame_sets_the_connection_format(self):
+        connection = ConnectionContext()
+        header = dict(id_token='token', request_id=4, args={}, payload=[dict(file_name='a.jpg', data=_IMAGE)])
+        _, request = parse_request(_frame(header, ZlibCompressor()), connection)
+        self.assertEqual(bytes(request.payload[0]['data']), _IMAGE)
+        self.assertFalse(request.keep_alive)
+        self.assertTrue(connection.binary)
+        self.assertEqual(connection.compressor.name, 'zlib')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from datetime import datetime, timezone
+
+from google.cloud.firestore_v1 import GeoPoint
+
+from fotogo_networking.frame_codecs import (CODECS, JSON_CODEC_ID, MSGPACK_CODEC_ID, Codec, JsonCodec, MsgpackCodec,
+                                            OrjsonCodec, get_codec, msgpack, orjson, register_codec)
+
+_OBJECT = dict(request_type='GetAlbumContents', request_id=7, payload=[
+    dict(file_name='a.jpg', timestamp=1675166400, tag=None, location=[34.8, 32.1], containing_albums=['x', 'y']),
+    dict(file_name='שלום.jpg', timestamp='2023-01-31', tag=3, ratio=0.5, shared=True),
+])
+
+
+class CodecsTest(unittest.TestCase):
+    def _codecs(self) -> list[Codec]:
+        codecs = [JsonCodec()]
+        if orjson is not None:
+            codecs.append(OrjsonCodec())
+        if msgpack is not None:
+            codecs.append(MsgpackCodec())
+        return codecs
+
+    def test_round_trip(self):
+        for codec in self._codecs():
+            with self.subTest(codec=codec):
+                self.assertEqual(codec.decode(codec.encode(_OBJECT)), _OBJECT)
+                self.assertEqual(codec.decode(memoryview(codec.encode(_OBJECT))), _OBJECT)
+
+    def test_encodes_unknown_types(self):
+        timestamp = datetime(2023, 1, 31, 12, tzinfo=timezone.utc)
+        obj = dict(timestamp=timestamp, location=GeoPoint(32.1, 34.8))
+        for codec in self._codecs():
+            with self.subTest(codec=codec):
+                self.assertEqual(codec.decode(codec.encode(obj)), dict(timestamp=str(timestamp), location=[34.8, 32.1]))
+
+    def test_json_codecs_agree(self):
+        if orjson is None:
+            self.skipTest("orjson is not installed")
+        self.assertEqual(JsonCodec().decode(OrjsonCodec().encode(_OBJECT)), _OBJECT)
+        self.assertEqual(OrjsonCodec().decode(JsonCodec().encode(_OBJECT)), _OBJECT)
+
+    def test_registry(self):
+        self.assertEqual(get_codec(JSON_CODEC_ID).name, 'json')
+        if msgpack is not None:
+            self.assertEqual(get_codec(MSGPACK_CODEC_ID).name, 'msgpack')
+        with self.assertRaises(ValueError):
+            get_codec(7)
+
+    def test_incomplete_codec_is_rejected(self):
+        class EncodeOnlyCodec(Codec):
+            name = 'encode-only'
+            codec_id = 7
+
+            def encode(self, obj) -> bytes:
+                return b''
+
+        with self.assertRaises(TypeError):
+            register_codec(EncodeOnlyCodec())
+        self.assertNotIn(7, CODECS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from fotogo_networking.frame_compression import (COMPRESSORS, NO_COMPRESSION_ID, ZLIB_COMPRESSION_ID, Compressor,
+                                                  ZlibCompressor, ZstdCompressor, get_compressor,
+                                                  is_compressed_format, register_compressor, zstandard)
+
+_DATA = b'{"file_name": "a.jpg", "timestamp": 1675166400, "containing_albums": ["x"]}' * 100
+
+
+class CompressorsTest(unittest.TestCase):
+    def _compressors(self) -> list[Compressor]:
+        compressors = [ZlibCompressor()]
+        if zstandard is not None:
+            compressors.append(ZstdCompressor())
+        return compressors
+
+    def test_round_trip(self):
+        for compressor in self._compressors():
+            with self.subTest(compressor=compressor):
+                compressed = compressor.compress(_DATA)
+                self.assertLess(len(compressed), len(_DATA))
+                self.assertEqual(compressor.decompress(compressed, len(_DATA)), _DATA)
+                self.assertEqual(compressor.decompress(memoryview(compressed), len(_DATA)), _DATA)
+
+    def test_decompression_is_bounded(self):
+        for compressor in self._compressors():
+            with self.subTest(compressor=compressor):
+                with self.assertRaises(ValueError):
+                    compressor.decompress(compressor.compress(_DATA), len(_DATA) - 1)
+
+    def test_registry(self):
+        self.assertIsNone(get_compressor(NO_COMPRESSION_ID))
+        self.assertEqual(get_compressor(ZLIB_COMPRESSION_ID).name, 'zlib')
+        with self.assertRaises(ValueError):
+            get_compressor(3)
+
+    def test_incomplete_compressor_is_rejected(self):
+        class CompressOnlyCompressor(Compressor):
+            name = 'compress-only'
+            compression_id = 3
+
+            def compress(self, data) -> bytes:
+                return bytes(data)
+
+        with self.assertRaises(TypeError):
+            register_compressor(CompressOnlyCompressor())
+        self.assertNotIn(3, COMPRESSORS)
+
+    def test_is_compressed_format(self):
+        self.assertTrue(is_compressed_format(b'\xff\xd8\xff\xe0' + bytes(16)))
+        self.assertTrue(is_compressed_format(b'\x89PNG\r\n\x1a\n'))
+        self.assertTrue(is_compressed_format(b'RIFF\x00\x00\x00\x00WEBPVP8 '))
+        self.assertFalse(is_compressed_format(_DATA))
+        self.assertFalse(is_compressed_format(b''))
+
+
+if __name__ == '__main__':
+    unittest.main()
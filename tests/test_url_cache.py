@@ -0,0 +1,59 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from db_services.url_cache import SignedUrlCache
+from fotogo_networking.metrics import Metrics
+
+
+def _expires_in(seconds: float) -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=seconds)
+
+
+class SignedUrlCacheTest(unittest.TestCase):
+    def test_hit_and_miss(self):
+        metrics = Metrics()
+        cache = SignedUrlCache(metrics=metrics)
+        self.assertIsNone(cache.get('u/a.jpg'))
+        cache.put('u/a.jpg', 'url-a', _expires_in(3600))
+        self.assertEqual(cache.get('u/a.jpg'), 'url-a')
+        self.assertEqual(metrics.snapshot()['gauges'], {'storage.url_cache.size': 1, 'storage.url_cache.hit_rate': 0.5})
+
+    def test_evicts_least_recently_used(self):
+        cache = SignedUrlCache(max_size=2)
+        cache.put('a', 'url-a', _expires_in(3600))
+        cache.put('b', 'url-b', _expires_in(3600))
+        cache.get('a')  # b is now the least recently used
+        cache.put('c', 'url-c', _expires_in(3600))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'url-a')
+        self.assertEqual(cache.get('c'), 'url-c')
+
+    def test_put_refreshes_an_entry(self):
+        cache = SignedUrlCache(max_size=2)
+        cache.put('a', 'url-a', _expires_in(3600))
+        cache.put('b', 'url-b', _expires_in(3600))
+        cache.put('a', 'url-a2', _expires_in(3600))
+        cache.put('c', 'url-c', _expires_in(3600))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'url-a2')
+
+    def test_near_expiry_is_a_miss(self):
+        cache = SignedUrlCache(refresh_margin=300)
+        cache.put('a', 'url-a', _expires_in(299))
+        cache.put('b', 'url-b', _expires_in(301))
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 'url-b')
+
+    def test_invalidate(self):
+        cache = SignedUrlCache()
+        for blob_path in ('u1/a', 'u1/thumbs/preview/a', 'u2/a'):
+            cache.put(blob_path, 'url:' + blob_path, _expires_in(3600))
+        cache.invalidate('u2/a')
+        self.assertIsNone(cache.get('u2/a'))
+        cache.invalidate_directory('u1/')
+        self.assertIsNone(cache.get('u1/a'))
+        self.assertIsNone(cache.get('u1/thumbs/preview/a'))
+
+
+if __name__ == '__main__':
+    unittest.main()